@@ -0,0 +1,145 @@
+# Benchmark of the audit run against the local stand-in network (audit_fakenet.py).
+#
+# For every registry size a fake geth.ipc and fake witness rpc are started in a child process,
+# the registry replaces nodes.json, and audit_and_report() runs as it would from cron (its
+# output discarded). Reported per size: wall time (best and median of --repeat runs), json-rpc
+# calls and requests (a batch is one request) seen by the fake geth, witness rpc requests, and
+# peak python memory of one extra run under tracemalloc (kept apart from the timed runs).
+#
+# Arguments the benchmark doesn't know are passed on to audit_network, e.g. --probe-workers 64.
+#
+# Usage:
+# $ python3 audit_bench.py --sizes 50,500,5000 --latency 0.05 --timeout-rate 0.02
+# $ python3 audit_bench.py --sizes 500 --repeat 5 --probe-workers 64 --checkin-index /tmp/checkins.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import audit_fakenet
+import audit_network
+import audit_registry
+from jsonrpc import IPCClient, RPCError
+
+FAKENET_OPTIONS = ['peer_ratio', 'latency', 'jitter', 'timeout_rate', 'failure_rate', 'lag_rate', 'fork_rate', 'geth_latency', 'seed']
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser('audit_bench')
+    parser.add_argument('--sizes', default='50,500,5000', help='comma separated registry sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per size')
+    parser.add_argument('--port', type=int, default=18501, help='port of the fake witness rpc')
+    parser.add_argument('--miner-ratio', type=float, default=0.3, help='share of miners in the registry')
+    parser.add_argument('--peer-ratio', type=float, default=0.9, help='share of nodes that are peers of the audit node')
+    parser.add_argument('--latency', type=float, default=0.02, help='mean witness rpc latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='standard deviation of the witness rpc latency')
+    parser.add_argument('--timeout-rate', type=float, default=0.01, help='share of witnesses that never answer')
+    parser.add_argument('--failure-rate', type=float, default=0.01, help='share of witnesses answering http 500')
+    parser.add_argument('--lag-rate', type=float, default=0.02, help='share of witnesses 100 blocks behind')
+    parser.add_argument('--fork-rate', type=float, default=0.01, help='share of witnesses on a fork')
+    parser.add_argument('--geth-latency', type=float, default=0.0, help='seconds added to every geth.ipc request')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--json', help='also write the results to this file')
+    return parser.parse_known_args(argv)
+
+## start the fake network in a child process and wait for its ipc to answer
+@contextlib.contextmanager
+def fakenet(registry_path, ipc_path, args):
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit_fakenet.py'),
+            'serve', ipc_path, registry_path, '--port', str(args.port)]
+    for option in FAKENET_OPTIONS:
+        cmd += ['--' + option.replace('_', '-'), str(getattr(args, option))]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    try:
+        rpc = IPCClient(ipc_path)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                rpc.call('fakenet_reset')
+                break
+            except RPCError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise Exception('fakenet did not start', cmd)
+                time.sleep(0.1)
+        yield rpc
+    finally:
+        proc.kill()
+        proc.wait()
+
+def run_once(rpc, audit_args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        audit_network.audit_and_report(rpc, audit_args)
+        return time.perf_counter() - t0
+
+## calls seen by the fake network during one run
+def rpc_counts(stats):
+    counts = {'ipc_calls': 0, 'ipc_requests': 0, 'witness_requests': 0}
+    for (key, n) in stats.items():
+        (source, method) = key.split(' ', 1)
+        if method.startswith('fakenet_'):
+            continue
+        if source == 'ipc':
+            counts['ipc_requests' if method == 'request' else 'ipc_calls'] += n
+        elif source == 'witness':
+            counts['witness_requests'] += n
+    # the stats and reset calls of the benchmark itself
+    counts['ipc_requests'] -= stats.get('ipc fakenet_reset', 0) + stats.get('ipc fakenet_stats', 0)
+    return counts
+
+def bench_size(size, args, extra, tmp):
+    registry = audit_fakenet.synthetic_registry(size, args.miner_ratio, args.seed)
+    registry_path = os.path.join(tmp, 'registry-%d.json' % size)
+    with open(registry_path, 'w') as f:
+        json.dump(registry, f)
+    ipc_path = os.path.join(tmp, 'geth-%d.ipc' % size)
+
+    audit_network.core_nodes = audit_registry.load(registry_path)
+    audit_args = audit_network.parse_args([ipc_path, '--rpc-port', str(args.port)] + extra)
+
+    with fakenet(registry_path, ipc_path, args) as control:
+        rpc = IPCClient(ipc_path)
+        walls = []
+        counts = None
+        for i in range(args.repeat):
+            control.call('fakenet_reset')
+            walls.append(run_once(rpc, audit_args))
+            counts = rpc_counts(control.call('fakenet_stats'))
+
+        peak = None
+        if not args.no_memory:
+            tracemalloc.start()
+            run_once(rpc, audit_args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        rpc.close()
+
+    result = {'size': size, 'best': min(walls), 'median': statistics.median(walls), 'peak_mem': peak}
+    result.update(counts)
+    return result
+
+def main():
+    (args, extra) = parse_args()
+    results = []
+    print('SIZE', 'BEST(s)', 'MEDIAN(s)', 'IPC-CALLS', 'IPC-REQUESTS', 'WITNESS-RPC', 'PEAK-MEM(MB)', flush=True)
+    with tempfile.TemporaryDirectory(prefix='audit_bench') as tmp:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            r = bench_size(size, args, extra, tmp)
+            results.append(r)
+            peak = '%.1f' % (r['peak_mem'] / 2**20) if r['peak_mem'] is not None else '-'
+            print(size, '%.3f' % r['best'], '%.3f' % r['median'], r['ipc_calls'], r['ipc_requests'], r['witness_requests'], peak, flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'audit_args': extra, 'results': results}, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# Record and replay of all json-rpc traffic of an audit run.
+#
+# With --record, every round trip of every rpc client (geth.ipc and each witness rpc) is kept
+# with its requests, responses (or the error raised) and duration, together with the wall
+# clock readings and the results of other network checks (e.g. tcp connects) of the run, and
+# written to a gzipped json cassette at the end. With --replay, the same run is answered from
+# the cassette: no socket is opened, and the report comes out the same, in milliseconds.
+#
+# Recorded round trips are matched by endpoint and request (ids aside), first in first out, so
+# concurrent witness probes replay regardless of their order. Durations are replayed on a per
+# thread virtual clock, so probe latencies come out as recorded without waiting for them.
+
+import gzip
+import json
+import threading
+import time
+from datetime import datetime
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+_mode = None
+_path = None
+_lock = threading.Lock()
+_exchanges = [] # record: [{'endpoint', 'requests', 'responses' | 'error', 'duration'}]
+_queues = {}    # replay: (endpoint, requests) -> recorded exchanges not replayed yet
+_values = []    # record: [[key, value]] of other network checks, e.g. tcp connects
+_value_queues = {}
+_clock = []     # wall clock readings, unix time
+_clock_pos = 0
+_virtual = threading.local()
+
+def record(path):
+    global _mode, _path
+    (_mode, _path) = (RECORD, path)
+
+def replay(path):
+    global _mode, _path, _clock_pos
+    (_mode, _path) = (REPLAY, path)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        cassette = json.load(f)
+    _clock[:] = cassette['clock']
+    _clock_pos = 0
+    _queues.clear()
+    for exchange in cassette['exchanges']:
+        _queues.setdefault(_key(exchange['endpoint'], exchange['requests']), []).append(exchange)
+    _value_queues.clear()
+    for (key, value) in cassette.get('values', []):
+        _value_queues.setdefault(json.dumps(key), []).append(value)
+
+def save():
+    if _mode != RECORD:
+        return
+    with _lock:
+        cassette = {'clock': list(_clock), 'exchanges': list(_exchanges), 'values': list(_values)}
+    with gzip.open(_path, 'wt', encoding='utf-8') as f:
+        json.dump(cassette, f, separators=(',', ':'))
+
+def replaying():
+    return _mode == REPLAY
+
+## clock
+
+## datetime.now(), as recorded when replaying. past the recorded readings the last one is repeated.
+def now():
+    global _clock_pos
+    with _lock:
+        if _mode == REPLAY:
+            ts = _clock[min(_clock_pos, len(_clock) - 1)] if _clock else time.time()
+            _clock_pos += 1
+            return datetime.fromtimestamp(ts)
+        ts = time.time()
+        if _mode == RECORD:
+            _clock.append(ts)
+        return datetime.fromtimestamp(ts)
+
+## time.monotonic(), or the virtual time of this thread when replaying
+def monotonic():
+    if _mode == REPLAY:
+        return getattr(_virtual, 't', 0.0)
+    return time.monotonic()
+
+## other network checks
+
+## result of fn(), recorded under key (json serializable), or as recorded when replaying
+def value(key, fn):
+    if _mode == REPLAY:
+        with _lock:
+            queue = _value_queues.get(json.dumps(key))
+            if not queue:
+                raise KeyError('not in the cassette', key)
+            return queue.pop(0)
+    result = fn()
+    if _mode == RECORD:
+        with _lock:
+            _values.append([key, result])
+    return result
+
+## round trips
+
+## (method, params) of each request, leaving out the ids which differ from run to run
+def _strip(payload):
+    if isinstance(payload, list):
+        return [_strip(p) for p in payload]
+    return [payload['method'], payload.get('params') or []]
+
+def _key(endpoint, requests):
+    return json.dumps([endpoint, requests], sort_keys=True)
+
+## responses without ids, batch responses put in request order
+def _strip_responses(payloads, responses):
+    out = []
+    for (payload, resp) in zip(payloads, responses):
+        if isinstance(payload, list) and isinstance(resp, list):
+            by_id = {r.get('id'): r for r in resp}
+            resp = [by_id.get(req['id']) for req in payload]
+            out.append([{k: v for (k, v) in r.items() if k != 'id'} if r else None for r in resp])
+        elif isinstance(resp, dict):
+            out.append({k: v for (k, v) in resp.items() if k != 'id'})
+        else:
+            out.append(resp)
+    return out
+
+## recorded responses with the ids of the new requests
+def _with_ids(payloads, responses):
+    out = []
+    for (payload, resp) in zip(payloads, responses):
+        if isinstance(payload, list) and isinstance(resp, list):
+            out.append([dict(r, id=req['id']) if r else None for (req, r) in zip(payload, resp)])
+        elif isinstance(resp, dict) and not isinstance(payload, list):
+            out.append(dict(resp, id=payload['id']))
+        else:
+            out.append(resp)
+    return out
+
+## send payloads with roundtrip(payloads), recording or replaying them as set up
+def roundtrip(endpoint, payloads, roundtrip):
+    if _mode is None:
+        return roundtrip(payloads)
+    if _mode == REPLAY:
+        return _replay(endpoint, payloads)
+
+    import jsonrpc
+    exchange = {'endpoint': endpoint, 'requests': _strip(payloads)}
+    t0 = time.monotonic()
+    try:
+        responses = roundtrip(payloads)
+        exchange['responses'] = _strip_responses(payloads, responses)
+        return responses
+    except jsonrpc.RPCError as e:
+        exchange['error'] = [type(e).__name__, [str(a) for a in e.args]]
+        raise
+    finally:
+        exchange['duration'] = time.monotonic() - t0
+        with _lock:
+            _exchanges.append(exchange)
+
+def _replay(endpoint, payloads):
+    import jsonrpc
+    requests = _strip(payloads)
+    with _lock:
+        queue = _queues.get(_key(endpoint, requests))
+        exchange = queue.pop(0) if queue else None
+    if exchange is None:
+        raise jsonrpc.RPCConnectionError(endpoint, 'not in the cassette', requests[0][0] if requests else '')
+
+    _virtual.t = getattr(_virtual, 't', 0.0) + exchange['duration']
+    if 'error' in exchange:
+        (name, args) = exchange['error']
+        raise getattr(jsonrpc, name, jsonrpc.RPCError)(*args)
+    return _with_ids(payloads, exchange['responses'])
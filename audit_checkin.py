@@ -0,0 +1,268 @@
+# JVCore check-in lookups.
+#
+# All tokenURI(coreId) calls of a run are resolved up front: coreIds are deduped, and the
+# eth_calls go out in a few JSON-RPC batches over geth.ipc, all pinned to the same block.
+#
+# Only two view functions of JVCore are used, so their ABI encoding is done by hand:
+#   tokenURI(uint256) returns (string)
+#   isLiveness(uint256) returns (bool)
+#
+# With a check-in index (a small json file) the tokenURI calls are mostly avoided: JVCore logs
+# are scanned incrementally from a stored block checkpoint, and every check-in event updates
+# coreId -> last check-in time and the check-in history of that coreId. Only coreIds the index
+# doesn't show as checked in this month are still verified with tokenURI. The history also
+# answers check-in compliance of past months, after a backfill scan.
+#
+# Usage:
+# $ python3 audit_checkin.py backfill ~/data/mainnet/geth.ipc ~/data/checkins.json --from 1234
+# $ python3 audit_checkin.py compliance ~/data/checkins.json [--month 2024-01]
+
+import argparse
+import base64
+import json
+import os
+import sys
+from datetime import datetime
+
+import audit_cassette
+import ethcrypto
+
+## JVCore 合约地址
+JVCORE_ADDRESS = '0x8d214415b9c5F5E4Cf4CbCfb4a5DEd47fb516392'
+
+## the check-in event. its abi is not published with this repo, so it can be overridden.
+## the coreId is taken from the first indexed topic, or the first data word if not indexed,
+## and the check-in time is the timestamp of the block the event is in.
+CHECKIN_EVENT = 'CheckIn(uint256,uint256)'
+
+## a scan of this many blocks without a single check-in log most likely has the wrong event
+SILENT_SCAN_BLOCKS = 50000
+
+## 4-byte function selectors, keccak256 of the signatures
+SELECTOR_TOKEN_URI = 'c87b56dd'   # tokenURI(uint256)
+SELECTOR_IS_LIVENESS = '9b94a04d' # isLiveness(uint256)
+
+def encode_uint256_call(selector, value):
+    return '0x' + selector + '%064x' % value
+
+def encode_token_uri(core_id):
+    return encode_uint256_call(SELECTOR_TOKEN_URI, core_id)
+
+def encode_is_liveness(core_id):
+    return encode_uint256_call(SELECTOR_IS_LIVENESS, core_id)
+
+def _hex_bytes(data):
+    return bytes.fromhex(data[2:] if data.startswith('0x') else data)
+
+## abi decode a single dynamic `string` return value
+def decode_string(data):
+    raw = _hex_bytes(data)
+    offset = int.from_bytes(raw[0:32], 'big')
+    length = int.from_bytes(raw[offset:offset+32], 'big')
+    value = raw[offset+32:offset+32+length]
+    if len(value) != length:
+        raise ValueError('truncated abi string')
+    return value.decode('utf-8')
+
+## abi decode a single `bool` return value
+def decode_bool(data):
+    raw = _hex_bytes(data)
+    if len(raw) != 32:
+        raise ValueError('bad abi bool')
+    return int.from_bytes(raw, 'big') != 0
+
+def formatTokenURI(data_str):
+    if 'application/json;base64' in data_str and ',' in data_str:
+        data_str = data_str.split(',')[1]
+        json_str = base64.b64decode(data_str).decode('utf-8')
+        data_obj = json.loads(json_str)
+        return data_obj
+    return None
+
+def get_month_start():
+    now = audit_cassette.now()
+    return int(datetime(now.year, now.month, 1).timestamp())
+
+## resolve tokenURI of all core_ids at block_number.
+## returns decoded token info indexed by coreId, None if the call failed or can't be decoded.
+def resolve_checkins(rpc, jvcore_address, core_ids, block_number, chunk_size=100):
+    core_ids = sorted(set(core_ids))
+    block_tag = hex(block_number)
+    calls = []
+    for core_id in core_ids:
+        calls.append(('eth_call', [{'to': jvcore_address, 'data': encode_token_uri(core_id)}, block_tag]))
+
+    token_infos = {}
+    for i in range(0, len(calls), chunk_size):
+        responses = rpc.batch(calls[i:i+chunk_size])
+        for (core_id, resp) in zip(core_ids[i:i+chunk_size], responses):
+            token_infos[core_id] = decode_token_info(resp)
+    return token_infos
+
+## decoded token info of a tokenURI eth_call response, None if the call failed or can't be decoded
+def decode_token_info(resp):
+    if not resp or not resp.get('result'):
+        return None
+    try:
+        token_uri = decode_string(resp['result'])
+        return formatTokenURI(token_uri) if token_uri else None
+    except Exception:
+        return None
+
+## has the node checked in since month_start?
+def is_checked_in(token_info, month_start):
+    if not token_info:
+        return False
+    last_checkin_time = int(token_info.get('lastCheckInTime') or 0)
+    return last_checkin_time > month_start
+
+## check-in index
+
+def load_index(path):
+    if not os.path.exists(path):
+        return {'checkpoint': None, 'last': {}, 'history': {}}
+    with open(path) as f:
+        return parse_index(json.load(f))
+
+## an index as json loads it: object keys are strings, coreIds are ints
+def parse_index(index):
+    index['last'] = {int(k): v for (k, v) in index['last'].items()}
+    index['history'] = {int(k): v for (k, v) in index['history'].items()}
+    return index
+
+def save_index(path, index):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, path)
+
+## record a check-in of core_id at ts
+def add_checkin(index, core_id, ts):
+    history = index['history'].setdefault(core_id, [])
+    if ts not in history:
+        history.append(ts)
+        history.sort()
+    if ts > index['last'].get(core_id, 0):
+        index['last'][core_id] = ts
+
+def event_topic(signature):
+    return '0x' + ethcrypto.keccak256(signature.encode()).hex()
+
+## coreId a check-in log is about
+def log_core_id(log):
+    if len(log['topics']) > 1:
+        return int(log['topics'][1], 16)
+    return int(log['data'][2:66], 16)
+
+## scan check-in logs in [from_block, to_block] and add them to the index.
+## returns the number of check-ins found.
+def scan_logs(rpc, index, from_block, to_block, jvcore_address=JVCORE_ADDRESS, event=CHECKIN_EVENT, chunk_blocks=5000, chunks_per_batch=10):
+    topic = event_topic(event)
+    ranges = [(b, min(b + chunk_blocks - 1, to_block)) for b in range(from_block, to_block + 1, chunk_blocks)]
+    logs = []
+    for i in range(0, len(ranges), chunks_per_batch):
+        calls = [('eth_getLogs', [{'address': jvcore_address, 'topics': [topic], 'fromBlock': hex(a), 'toBlock': hex(b)}])
+                for (a, b) in ranges[i:i+chunks_per_batch]]
+        for resp in rpc.batch(calls):
+            if resp is None or 'error' in resp:
+                raise Exception('eth_getLogs failed', resp and resp.get('error'))
+            logs.extend(l for l in resp['result'] if not l.get('removed'))
+    if not logs and to_block - from_block + 1 >= SILENT_SCAN_BLOCKS:
+        print('warning: no %s logs of %s in blocks %d .. %d. if check-ins did happen then, the event signature is wrong,'
+                ' set it with --checkin-event (--event of backfill)' % (event, jvcore_address, from_block, to_block), file=sys.stderr)
+
+    ## check-in time is the block time, fetch the blocks the logs are in, all in one batch
+    block_numbers = sorted(set(int(l['blockNumber'], 16) for l in logs))
+    responses = rpc.batch([('eth_getBlockByNumber', [hex(n), False]) for n in block_numbers])
+    block_times = {}
+    for (n, resp) in zip(block_numbers, responses):
+        if resp and resp.get('result'):
+            block_times[n] = int(resp['result']['timestamp'], 16)
+
+    count = 0
+    for l in logs:
+        ts = block_times.get(int(l['blockNumber'], 16))
+        if ts is not None:
+            add_checkin(index, log_core_id(l), ts)
+            count += 1
+    return count
+
+## bring the index up to to_block. an empty index is seeded from tokenURI of core_ids at to_block.
+## returns the token infos of the seed, {} if the index was not empty.
+def update_index(rpc, index, core_ids, to_block, jvcore_address=JVCORE_ADDRESS, event=CHECKIN_EVENT):
+    token_infos = {}
+    if index['checkpoint'] is None:
+        token_infos = resolve_checkins(rpc, jvcore_address, core_ids, to_block)
+        for (core_id, token_info) in token_infos.items():
+            last_checkin_time = int((token_info or {}).get('lastCheckInTime') or 0)
+            if last_checkin_time:
+                add_checkin(index, core_id, last_checkin_time)
+    elif to_block > index['checkpoint']:
+        scan_logs(rpc, index, index['checkpoint'] + 1, to_block, jvcore_address, event)
+    index['checkpoint'] = max(to_block, index['checkpoint'] or 0)
+    return token_infos
+
+## token infos like resolve_checkins() returns, built from the index. coreIds the index
+## doesn't show as checked in since month_start are verified with tokenURI, and fixed in the index,
+## unless fresh (token infos resolved at block_number already, e.g. the seed of update_index) has them.
+def indexed_checkins(rpc, index, core_ids, block_number, month_start, jvcore_address=JVCORE_ADDRESS, chunk_size=100, fresh=None):
+    fresh = fresh or {}
+    token_infos = {}
+    unsure = []
+    for core_id in set(core_ids):
+        last_checkin_time = index['last'].get(core_id, 0)
+        if last_checkin_time > month_start:
+            token_infos[core_id] = {'lastCheckInTime': last_checkin_time}
+        elif core_id in fresh:
+            token_infos[core_id] = fresh[core_id]
+        else:
+            unsure.append(core_id)
+
+    for (core_id, token_info) in resolve_checkins(rpc, jvcore_address, unsure, block_number, chunk_size).items():
+        token_infos[core_id] = token_info
+        last_checkin_time = int((token_info or {}).get('lastCheckInTime') or 0)
+        if last_checkin_time:
+            add_checkin(index, core_id, last_checkin_time)
+    return token_infos
+
+## coreIds with at least one check-in in [start, end)
+def checked_in_between(index, start, end):
+    return sorted(core_id for (core_id, history) in index['history'].items() if any(start <= ts < end for ts in history))
+
+def main():
+    parser = argparse.ArgumentParser('audit_checkin')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('backfill', help='scan older check-in logs into the index')
+    p.add_argument('geth_ipc', help='path to geth.ipc file to be attached to')
+    p.add_argument('index', help='path to the check-in index')
+    p.add_argument('--from', dest='start', type=int, required=True, help='first block to scan')
+    p.add_argument('--to', dest='end', type=int, help='last block to scan, default the index checkpoint or the latest block')
+    p.add_argument('--event', default=CHECKIN_EVENT, help='check-in event signature')
+
+    p = subparsers.add_parser('compliance', help='coreIds that checked in during a month')
+    p.add_argument('index', help='path to the check-in index')
+    p.add_argument('--month', default=datetime.now().strftime('%Y-%m'), help='YYYY-MM, default this month')
+
+    args = parser.parse_args()
+    index = load_index(args.index)
+    if args.command == 'backfill':
+        from jsonrpc import IPCClient
+        rpc = IPCClient(args.geth_ipc)
+        end = args.end or index['checkpoint'] or int(rpc.call('eth_blockNumber'), 16)
+        count = scan_logs(rpc, index, args.start, end, event=args.event)
+        if index['checkpoint'] is None:
+            index['checkpoint'] = end
+        save_index(args.index, index)
+        print('found', count, 'check-ins in blocks', args.start, '..', end)
+    else:
+        import audit_store
+        (start, end) = audit_store.month_range(args.month)
+        core_ids = checked_in_between(index, start, end)
+        print('month:', args.month, len(core_ids), 'coreIds checked in')
+        print('CHECKED-IN:', ','.join('J-' + str(c) for c in core_ids))
+        missing = sorted(set(index['last']) - set(core_ids))
+        print('NO CHECK-IN:', ','.join('J-' + str(c) for c in missing))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+# A local stand-in for the network the audit talks to, for benchmarks and dry runs.
+#
+# One process serves:
+#   - a fake geth.ipc with the methods the audit uses: admin_nodeInfo, admin_peers, admin_addPeer,
+#     clique_status, eth_blockNumber, eth_getBlockByNumber, eth_getLogs and JVCore eth_call tokenURI
+#   - fake witness rpc endpoints on one port: witness ips are loopback addresses (127.x.y.z),
+#     and the address a connection was made to tells which witness is asked
+#
+# Witness behaviour is drawn per ip from a seeded random: answer after a latency (with jitter),
+# hang past any sane read timeout, fail with http 500, answer with a lagging block height, or
+# answer from a fork (other block hashes). New blocks reach every witness after a delay of its
+# own, also drawn per ip, so block propagation can be measured.
+# Geth itself can be slowed down per request too, some signers can be made to miss all their
+# turns (blocks with clique difficulty 1), and newHeads subscriptions are served. The
+# fakenet_stall rpc method stops the chain for a number of seconds.
+#
+# Requests and calls are counted per method, read (and reset) them with the fakenet_stats and
+# fakenet_reset rpc methods on the ipc socket.
+#
+# Usage:
+# $ python3 audit_fakenet.py registry /tmp/nodes.json --size 500
+# $ python3 audit_fakenet.py serve /tmp/fake.ipc /tmp/nodes.json --port 18501 --latency 0.05 --timeout-rate 0.02
+
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import os
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import audit_checkin
+import ethcrypto
+
+BLOCK_TIME = 5
+
+## witness behaviours
+WITNESS_OK = 'ok'
+WITNESS_HANG = 'hang'
+WITNESS_FAIL = 'fail'
+WITNESS_LAG = 'lag'
+WITNESS_FORK = 'fork'
+
+## n loopback ips, 127.1.0.1 and on, never .0 or .255
+def loopback_ip(i):
+    return '127.%d.%d.%d' % (1 + i // (254 * 256), (i // 254) % 256, i % 254 + 1)
+
+def _hex(seed, n):
+    return hashlib.sha256(seed.encode()).hexdigest()[:n]
+
+## a registry shaped like nodes.json, miner_ratio of the nodes are miners
+def synthetic_registry(size, miner_ratio=0.3, seed=1):
+    rand = random.Random(seed)
+    nodes = []
+    for i in range(size):
+        ip = loopback_ip(i)
+        pubkey = _hex('pub%d' % i, 64) + _hex('key%d' % i, 64)
+        node_id = ethcrypto.keccak256(bytes.fromhex(pubkey)).hex()
+        node = {
+                'owner': 'node-%d' % i,
+                'type': 'miner' if rand.random() < miner_ratio else 'witness',
+                'ip': ip,
+                'id': node_id,
+                'enode': 'enode://%s@%s:30311' % (pubkey, ip),
+                'since': '20240101',
+                'coreId': i,
+                }
+        if node['type'] == 'miner':
+            node['signer'] = '0x' + _hex('signer%d' % i, 40)
+        nodes.append(node)
+    return nodes
+
+
+class FakeNetwork:
+    def __init__(self, nodes, peer_ratio=0.9, latency=0.02, jitter=0.01, timeout_rate=0.01, failure_rate=0.01,
+            lag_rate=0.02, fork_rate=0.01, geth_latency=0.0, checkin_ratio=0.8, missing_signers=0, block_time=BLOCK_TIME,
+            propagation=0.3, seed=1):
+        self.nodes = nodes
+        self.block_time = block_time
+        self.stalls = [] # (from, until) unix time, no blocks in between
+        self.latency = latency
+        self.jitter = jitter
+        self.geth_latency = geth_latency
+        self.rand = random.Random(seed)
+        self.start = time.time()
+        self.base = 100000
+
+        witnesses = [n for n in nodes if n['type'] != 'miner']
+        self.audit_node = witnesses[0] if witnesses else None
+        self.peers = [n['id'] for n in nodes if n is not self.audit_node and self.rand.random() < peer_ratio]
+        self.signers = sorted(n['signer'] for n in nodes if n.get('signer'))
+        self.missing = set(self.signers[:missing_signers]) # never seal their turns
+        self.checked_in = {n['coreId'] for n in nodes if self.rand.random() < checkin_ratio}
+        self.behaviour = {}
+        for n in witnesses:
+            r = self.rand.random()
+            if r < timeout_rate:
+                self.behaviour[n['ip']] = WITNESS_HANG
+            elif r < timeout_rate + failure_rate:
+                self.behaviour[n['ip']] = WITNESS_FAIL
+            elif r < timeout_rate + failure_rate + lag_rate:
+                self.behaviour[n['ip']] = WITNESS_LAG
+            elif r < timeout_rate + failure_rate + lag_rate + fork_rate:
+                self.behaviour[n['ip']] = WITNESS_FORK
+            else:
+                self.behaviour[n['ip']] = WITNESS_OK
+        ## seconds a new block takes to reach each witness, most fast, a few slow
+        self.propagation = {n['ip']: self.rand.expovariate(1 / propagation) if propagation else 0 for n in witnesses}
+
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.calls[key] += 1
+
+    ## head now, or as of delay seconds ago
+    def head(self, delay=0):
+        now = time.time() - delay
+        elapsed = now - self.start - sum(max(0, min(now, b) - a) for (a, b) in self.stalls)
+        return self.base + int(elapsed // self.block_time)
+
+    ## clique difficulty: 2 if the in-turn signer sealed the block, 1 if another one stepped in
+    def difficulty(self, n):
+        if self.signers and self.signers[n % len(self.signers)] in self.missing:
+            return '0x1'
+        return '0x2'
+
+    def block(self, n):
+        if n < 0 or n > self.head():
+            return None
+        return {
+                'number': hex(n),
+                'hash': '0x' + _hex('block%d' % n, 64),
+                'parentHash': '0x' + _hex('block%d' % (n - 1), 64),
+                'timestamp': hex(int(self.start + (n - self.base) * self.block_time)),
+                'difficulty': self.difficulty(n),
+                'gasUsed': '0x0',
+                'gasLimit': hex(30000000),
+                'miner': '0x' + '00' * 20,
+                'extraData': '0x' + '00' * (32 + 65),
+                'mixHash': '0x' + '00' * 32,
+                'nonce': '0x' + '00' * 8,
+                'sha3Uncles': '0x' + '00' * 32,
+                'logsBloom': '0x' + '00' * 256,
+                'stateRoot': '0x' + '00' * 32,
+                'transactionsRoot': '0x' + '00' * 32,
+                'receiptsRoot': '0x' + '00' * 32,
+                'transactions': [],
+                'uncles': [],
+                }
+
+    def token_uri(self, core_id):
+        month_ago = int(time.time()) - 40 * 86400
+        info = {'name': 'J-%d' % core_id, 'lastCheckInTime': int(time.time()) if core_id in self.checked_in else month_ago}
+        uri = ('data:application/json;base64,' + base64.b64encode(json.dumps(info).encode()).decode()).encode()
+        data = (32).to_bytes(32, 'big') + len(uri).to_bytes(32, 'big') + uri + b'\0' * (-len(uri) % 32)
+        return '0x' + data.hex()
+
+    def logs(self, query):
+        topic = audit_checkin.event_topic(audit_checkin.CHECKIN_EVENT)
+        if query.get('topics') and query['topics'][0] not in (None, topic):
+            return []
+        (a, b) = (int(query['fromBlock'], 16), min(int(query['toBlock'], 16), self.head()))
+        core_ids = sorted(self.checked_in)
+        return [{'address': query['address'], 'blockNumber': hex(n), 'topics': [topic, '0x%064x' % core_ids[n % len(core_ids)]],
+            'data': '0x' + '%064x' % n, 'removed': False} for n in range(a, b + 1) if core_ids and n % 10 == 0]
+
+    def geth(self, method, params):
+        if method == 'admin_nodeInfo':
+            return {'id': self.audit_node['id'] if self.audit_node else '00' * 32, 'name': 'fakenet'}
+        if method == 'admin_peers':
+            return [{'id': node_id} for node_id in self.peers]
+        if method == 'admin_addPeer':
+            return True
+        if method == 'clique_status':
+            return {'numBlocks': 64, 'sealerActivity': {s: 64 // max(1, len(self.signers)) for s in self.signers}, 'inturnPercent': 100}
+        if method == 'eth_blockNumber':
+            return hex(self.head())
+        if method == 'eth_syncing':
+            return False
+        if method == 'net_peerCount':
+            return hex(len(self.peers))
+        if method == 'eth_getBlockByNumber':
+            return self.block(self.head() if params[0] == 'latest' else int(params[0], 16))
+        if method == 'eth_call':
+            return self.token_uri(int(params[0]['data'][10:], 16))
+        if method == 'eth_getLogs':
+            return self.logs(params[0])
+        if method == 'clique_getSigners':
+            return self.signers
+        if method == 'web3_clientVersion':
+            return 'fakenet'
+        if method == 'fakenet_stall':
+            self.stalls.append((time.time(), time.time() + params[0]))
+            return True
+        if method == 'fakenet_stats':
+            with self._lock:
+                return dict(self.calls)
+        if method == 'fakenet_reset':
+            with self._lock:
+                self.calls.clear()
+            return True
+        raise KeyError(method)
+
+    def handle(self, req, source='ipc'):
+        self.count(source + ' ' + req['method'])
+        try:
+            return {'jsonrpc': '2.0', 'id': req.get('id'), 'result': self.geth(req['method'], req.get('params') or [])}
+        except KeyError:
+            return {'jsonrpc': '2.0', 'id': req.get('id'), 'error': {'code': -32601, 'message': 'method not found: ' + req['method']}}
+
+    def dispatch(self, payload, source='ipc'):
+        if source == 'ipc' and self.geth_latency:
+            time.sleep(self.geth_latency)
+        self.count(source + ' request') # a batch is one request
+        if isinstance(payload, list):
+            return [self.handle(req, source) for req in payload]
+        return self.handle(payload, source)
+
+    ## answer a witness rpc request, None for a http 500
+    def witness(self, ip, payload):
+        behaviour = self.behaviour.get(ip, WITNESS_OK)
+        self.count('witness ' + behaviour)
+        if behaviour == WITNESS_HANG:
+            time.sleep(3600)
+        if behaviour == WITNESS_FAIL:
+            return None
+        time.sleep(max(0, self.rand.gauss(self.latency, self.jitter)))
+        resp = self.dispatch(payload, 'http')
+        for (req, r) in zip(payload if isinstance(payload, list) else [payload], resp if isinstance(resp, list) else [resp]):
+            if not r.get('result'):
+                continue
+            if req['method'] == 'eth_blockNumber':
+                r['result'] = hex(self.head(self.propagation.get(ip, 0)) - (100 if behaviour == WITNESS_LAG else 0))
+            if behaviour == WITNESS_FORK and req['method'] == 'eth_getBlockByNumber':
+                r['result'] = dict(r['result'], hash='0x' + _hex('fork' + r['result']['hash'], 64))
+        return resp
+
+
+class IPCHandler(socketserver.StreamRequestHandler):
+    def send(self, obj):
+        with self.send_lock:
+            self.request.sendall(json.dumps(obj).encode('utf-8'))
+
+    ## newHeads notifications, pushed from their own thread while the connection is open
+    def push_heads(self, sub_id):
+        network = self.server.network
+        n = network.head()
+        try:
+            while True:
+                time.sleep(0.05)
+                while n < network.head():
+                    n += 1
+                    self.send({'jsonrpc': '2.0', 'method': 'eth_subscription', 'params': {'subscription': sub_id, 'result': network.block(n)}})
+        except OSError:
+            pass
+
+    def handle(self):
+        self.send_lock = threading.Lock()
+        decoder = json.JSONDecoder()
+        buf = ''
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            buf += data.decode('utf-8')
+            while buf.strip():
+                try:
+                    (payload, end) = decoder.raw_decode(buf.lstrip())
+                except ValueError:
+                    break # incomplete, keep reading
+                buf = buf.lstrip()[end:]
+                if isinstance(payload, dict) and payload.get('method') == 'eth_subscribe' and payload['params'][0] == 'newHeads':
+                    sub_id = '0x' + _hex('sub%d' % id(self), 32)
+                    self.send({'jsonrpc': '2.0', 'id': payload.get('id'), 'result': sub_id})
+                    threading.Thread(target=self.push_heads, args=(sub_id,), daemon=True).start()
+                    continue
+                self.send(self.server.network.dispatch(payload))
+
+class IPCServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class WitnessHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        ip = self.connection.getsockname()[0]
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        resp = self.server.network.witness(ip, payload)
+        if resp is None:
+            self.send_error(500)
+            return
+        body = json.dumps(resp).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class WitnessServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # a whole probe fan-out connects at once
+
+## serve ipc and witness rpc from background threads
+def serve(network, ipc_path, port, addr='0.0.0.0'):
+    if os.path.exists(ipc_path):
+        os.unlink(ipc_path)
+    ipc = IPCServer(ipc_path, IPCHandler)
+    ipc.network = network
+    # witnesses are told apart by the loopback address the probe connected to, so listen on all of them
+    http = WitnessServer((addr, port), WitnessHandler)
+    http.network = network
+    for server in [ipc, http]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return (ipc, http)
+
+def main():
+    parser = argparse.ArgumentParser('audit_fakenet')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('registry', help='write a synthetic node registry (json)')
+    p.add_argument('path', help='registry file to write')
+    p.add_argument('--size', type=int, default=50, help='number of nodes')
+    p.add_argument('--miner-ratio', type=float, default=0.3, help='share of miners')
+    p.add_argument('--seed', type=int, default=1)
+
+    p = subparsers.add_parser('serve', help='serve a fake geth.ipc and witness rpc for a registry')
+    p.add_argument('ipc', help='path of the fake geth.ipc')
+    p.add_argument('registry', help='node registry (json)')
+    p.add_argument('--port', type=int, default=18501, help='witness rpc port')
+    p.add_argument('--peer-ratio', type=float, default=0.9, help='share of nodes that are peers of the audit node')
+    p.add_argument('--latency', type=float, default=0.02, help='mean witness rpc latency in seconds')
+    p.add_argument('--jitter', type=float, default=0.01, help='standard deviation of the witness rpc latency')
+    p.add_argument('--timeout-rate', type=float, default=0.01, help='share of witnesses that never answer')
+    p.add_argument('--failure-rate', type=float, default=0.01, help='share of witnesses answering http 500')
+    p.add_argument('--lag-rate', type=float, default=0.02, help='share of witnesses 100 blocks behind')
+    p.add_argument('--fork-rate', type=float, default=0.01, help='share of witnesses on a fork')
+    p.add_argument('--geth-latency', type=float, default=0.0, help='seconds added to every geth.ipc request')
+    p.add_argument('--missing-signers', type=int, default=0, help='number of signers that never seal their turns')
+    p.add_argument('--block-time', type=float, default=BLOCK_TIME, help='seconds between two blocks')
+    p.add_argument('--propagation', type=float, default=0.3, help='mean seconds a new block takes to reach a witness')
+    p.add_argument('--seed', type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == 'registry':
+        with open(args.path, 'w') as f:
+            json.dump(synthetic_registry(args.size, args.miner_ratio, args.seed), f, indent=1, ensure_ascii=False)
+        return
+
+    with open(args.registry) as f:
+        nodes = json.load(f)
+    network = FakeNetwork(nodes, peer_ratio=args.peer_ratio, latency=args.latency, jitter=args.jitter,
+            timeout_rate=args.timeout_rate, failure_rate=args.failure_rate, lag_rate=args.lag_rate, fork_rate=args.fork_rate,
+            geth_latency=args.geth_latency, missing_signers=args.missing_signers, block_time=args.block_time,
+            propagation=args.propagation, seed=args.seed)
+    serve(network, args.ipc, args.port)
+    print('fakenet: %d nodes, geth at %s, witness rpc on port %d' % (len(nodes), args.ipc, args.port), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
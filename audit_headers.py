@@ -0,0 +1,290 @@
+# Incremental block header index for per-signer sealing statistics.
+#
+# clique_status only covers geth's recent window at the time of the run. This index keeps a
+# compact record of every block from a starting point on, so the block rate of each signer
+# can be computed over any window (24h, 7d, a month) with a range scan.
+#
+# Files in the index directory:
+#   headers.bin      fixed size records, one per block, block n at (n - first) * RECORD.size
+#   sealers.json     signer addresses, a record stores the index of its sealer in this list
+#   checkpoint.json  first/last indexed block and the hash of the last one
+#
+# Headers are fetched in json-rpc batches, and the sealer of each block is recovered from the
+# clique signature at the end of extraData. Without coincurve that takes about 10ms a block, so
+# the audit indexes at most HEADERS_PER_RUN blocks a run; do the first backfill with `update`.
+# A window reaching back before the first indexed block, or past the last one, is only partly
+# covered: span() tells how much of it is.
+#
+# Usage:
+# $ python3 audit_headers.py update ~/data/mainnet/geth.ipc ~/data/headers [--from 1234]
+# $ python3 audit_headers.py rates ~/data/headers [--window 24h|7d|month]
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+
+import ethcrypto
+
+## number, timestamp, sealer index, difficulty, gas used, tx count
+RECORD = struct.Struct('<QQHBQIx')
+
+UNKNOWN_SEALER = 0xFFFF
+
+EXTRA_SEAL = 65 # clique signature at the end of extraData
+
+BACKFILL = 20000 # blocks indexed back from the head when the index is empty
+HEADERS_PER_RUN = 2000 # max blocks indexed by one audit run, about 20s with pure python recovery
+PARTIAL_SLACK = 600 # seconds the last indexed block may be behind the end of a window
+
+## clique seal hash: keccak256 of the rlp encoded header without the signature
+def seal_hash(header):
+    extra = bytes.fromhex(header['extraData'][2:])
+    fields = [
+            bytes.fromhex(header['parentHash'][2:]),
+            bytes.fromhex(header['sha3Uncles'][2:]),
+            bytes.fromhex(header['miner'][2:]),
+            bytes.fromhex(header['stateRoot'][2:]),
+            bytes.fromhex(header['transactionsRoot'][2:]),
+            bytes.fromhex(header['receiptsRoot'][2:]),
+            bytes.fromhex(header['logsBloom'][2:]),
+            int(header['difficulty'], 16),
+            int(header['number'], 16),
+            int(header['gasLimit'], 16),
+            int(header['gasUsed'], 16),
+            int(header['timestamp'], 16),
+            extra[:-EXTRA_SEAL],
+            bytes.fromhex(header['mixHash'][2:]),
+            bytes.fromhex(header['nonce'][2:]),
+            ]
+    if header.get('baseFeePerGas') is not None:
+        fields.append(int(header['baseFeePerGas'], 16))
+    return ethcrypto.keccak256(ethcrypto.rlp_encode(fields))
+
+## address of the signer who sealed a block, None if it can't be recovered (e.g. genesis)
+def recover_sealer(header):
+    extra = bytes.fromhex(header['extraData'][2:])
+    if len(extra) < EXTRA_SEAL:
+        return None
+    try:
+        return ethcrypto.ecrecover(seal_hash(header), extra[-EXTRA_SEAL:])
+    except ValueError:
+        return None
+
+## 24h, 7d, month -> [start, end) unix time
+def parse_window(window, now=None):
+    now = now or time.time()
+    if window == 'month':
+        t = datetime.fromtimestamp(now)
+        return (int(datetime(t.year, t.month, 1).timestamp()), int(now))
+    units = {'h': 3600, 'd': 86400}
+    return (int(now - int(window[:-1]) * units[window[-1]]), int(now))
+
+## 300 -> '5m', 100000 -> '27h', 900000 -> '10.4d'
+def format_span(seconds):
+    if seconds < 3600:
+        return '%dm' % (seconds // 60)
+    return '%dh' % (seconds // 3600) if seconds < 2 * 86400 else '%.1fd' % (seconds / 86400)
+
+
+class HeaderIndex:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.data_path = os.path.join(path, 'headers.bin')
+        self.sealers_path = os.path.join(path, 'sealers.json')
+        self.checkpoint_path = os.path.join(path, 'checkpoint.json')
+
+        self.checkpoint = self._load(self.checkpoint_path, {'first': None, 'last': None, 'last_hash': None})
+        self.sealers = self._load(self.sealers_path, [])
+        self.sealer_ids = {addr: i for (i, addr) in enumerate(self.sealers)}
+
+        # drop records written after the last checkpoint, e.g. the process was killed mid batch
+        with open(self.data_path, 'ab') as f:
+            f.truncate(len(self) * RECORD.size)
+
+    def _load(self, path, default):
+        if not os.path.exists(path):
+            return default
+        with open(path) as f:
+            return json.load(f)
+
+    def _save(self, path, obj):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def __len__(self):
+        if self.checkpoint['first'] is None:
+            return 0
+        return self.checkpoint['last'] - self.checkpoint['first'] + 1
+
+    def sealer_id(self, addr):
+        if addr is None:
+            return UNKNOWN_SEALER
+        if addr not in self.sealer_ids:
+            self.sealer_ids[addr] = len(self.sealers)
+            self.sealers.append(addr)
+        return self.sealer_ids[addr]
+
+    ## append consecutive headers following the last indexed block
+    def append(self, headers):
+        if not headers:
+            return
+        with open(self.data_path, 'ab') as f:
+            for h in headers:
+                f.write(RECORD.pack(
+                    int(h['number'], 16),
+                    int(h['timestamp'], 16),
+                    self.sealer_id(recover_sealer(h)),
+                    int(h['difficulty'], 16) & 0xff,
+                    int(h['gasUsed'], 16),
+                    len(h.get('transactions') or [])))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._save(self.sealers_path, self.sealers)
+        if self.checkpoint['first'] is None:
+            self.checkpoint['first'] = int(headers[0]['number'], 16)
+        self.checkpoint['last'] = int(headers[-1]['number'], 16)
+        self.checkpoint['last_hash'] = headers[-1]['hash']
+        self._save(self.checkpoint_path, self.checkpoint)
+
+    ## forget blocks after `number`, e.g. after a reorg
+    def rewind(self, number, block_hash):
+        first = self.checkpoint['first']
+        if first is None or number < first:
+            self.checkpoint = {'first': None, 'last': None, 'last_hash': None}
+        else:
+            self.checkpoint['last'] = number
+            self.checkpoint['last_hash'] = block_hash
+        self._save(self.checkpoint_path, self.checkpoint)
+        with open(self.data_path, 'ab') as f:
+            f.truncate(len(self) * RECORD.size)
+
+    def record(self, number):
+        with open(self.data_path, 'rb') as f:
+            f.seek((number - self.checkpoint['first']) * RECORD.size)
+            return RECORD.unpack(f.read(RECORD.size))
+
+    ## seconds of [start, end) the index covers, None if it covers all of it
+    def span(self, start, end):
+        if not len(self):
+            return 0
+        first_ts = self.record(self.checkpoint['first'])[1]
+        last_ts = self.record(self.checkpoint['last'])[1]
+        if first_ts <= start and last_ts >= end - PARTIAL_SLACK:
+            return None
+        return max(0, min(end, last_ts) - max(start, first_ts))
+
+    ## index of the first record with timestamp >= ts
+    def _bisect(self, buf, ts):
+        (lo, hi) = (0, len(self))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD.unpack_from(buf, mid * RECORD.size)[1] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    ## blocks sealed per signer address in [start, end), and the number of blocks in that window
+    def sealer_counts(self, start, end):
+        if not len(self):
+            return ({}, 0)
+        counts = [0] * (UNKNOWN_SEALER + 1)
+        with open(self.data_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                lo = self._bisect(buf, start)
+                hi = self._bisect(buf, end)
+                for rec in struct.iter_unpack(RECORD.format, buf[lo * RECORD.size:hi * RECORD.size]):
+                    counts[rec[2]] += 1
+        by_addr = {addr: counts[i] for (i, addr) in enumerate(self.sealers) if counts[i]}
+        return (by_addr, hi - lo)
+
+    ## block rate of each signer in [start, end), same meaning as sealerActivity / numBlocks
+    def block_rates(self, start, end):
+        (counts, total) = self.sealer_counts(start, end)
+        return {addr: n / total for (addr, n) in counts.items()} if total else {}
+
+
+## fetch new headers from the rpc and append them to the index, at most max_blocks of them.
+## starts at `start` (default: `backfill` blocks back) if the index is empty. returns the number of blocks added.
+def update(rpc, index, start=None, backfill=BACKFILL, batch_size=100, confirmations=6, rewind=64, max_blocks=None):
+    head = int(rpc.call('eth_blockNumber'), 16) - confirmations
+    added = 0
+    if index.checkpoint['last'] is None:
+        next_n = start if start is not None else max(0, head - backfill)
+    else:
+        next_n = index.checkpoint['last'] + 1
+
+    while next_n <= head and (max_blocks is None or added < max_blocks):
+        last_n = min(head, next_n + batch_size - 1)
+        if max_blocks is not None:
+            last_n = min(last_n, next_n + max_blocks - added - 1)
+        numbers = range(next_n, last_n + 1)
+        responses = rpc.batch([('eth_getBlockByNumber', [hex(n), False]) for n in numbers])
+        headers = []
+        parent_hash = index.checkpoint['last_hash']
+        for resp in responses:
+            h = resp.get('result') if resp else None
+            if h is None:
+                break
+            if parent_hash is not None and h['parentHash'] != parent_hash:
+                break
+            headers.append(h)
+            parent_hash = h['hash']
+
+        if not headers:
+            if index.checkpoint['last'] is not None and responses and responses[0] and responses[0].get('result'):
+                # the chain we indexed is not canonical anymore, go back a little and refetch
+                back = max(index.checkpoint['first'] - 1, index.checkpoint['last'] - rewind)
+                prev = rpc.call('eth_getBlockByNumber', [hex(back), False]) if back >= index.checkpoint['first'] else None
+                index.rewind(back, prev['hash'] if prev else None)
+                next_n = back + 1
+                continue
+            break
+
+        index.append(headers)
+        added += len(headers)
+        next_n = index.checkpoint['last'] + 1
+    return added
+
+def main():
+    parser = argparse.ArgumentParser('audit_headers')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('update', help='index new blocks')
+    p.add_argument('geth_ipc', help='path to geth.ipc file to be attached to')
+    p.add_argument('dir', help='index directory')
+    p.add_argument('--from', dest='start', type=int, help='first block to index if the index is empty')
+    p.add_argument('--batch-size', type=int, default=100, help='headers per json-rpc batch')
+
+    p = subparsers.add_parser('rates', help='block rate of each signer over a window')
+    p.add_argument('dir', help='index directory')
+    p.add_argument('--window', default='24h', help='24h, 7d, month, ...')
+
+    args = parser.parse_args()
+    index = HeaderIndex(args.dir)
+    if args.command == 'update':
+        from jsonrpc import IPCClient
+        rpc = IPCClient(args.geth_ipc)
+        added = update(rpc, index, start=args.start, batch_size=args.batch_size)
+        print('indexed', added, 'blocks, now', index.checkpoint['first'], '..', index.checkpoint['last'])
+    else:
+        (start, end) = parse_window(args.window)
+        (counts, total) = index.sealer_counts(start, end)
+        span = index.span(start, end)
+        print('window:', args.window, total, 'blocks' + ('' if span is None else ', only %s of it indexed' % format_span(span)))
+        print('SIGNER', 'BLOCKS', 'BLOCK-RATE')
+        for (addr, n) in sorted(counts.items(), key=lambda x: -x[1]):
+            print(addr, n, '%.3f' % (n / total))
+
+if __name__ == '__main__':
+    main()
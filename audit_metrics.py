@@ -0,0 +1,163 @@
+# Prometheus metrics of the latest audit run.
+#
+# Metrics are rendered from the results an audit run already holds in memory, so a scrape
+# never sends a single rpc call. Two ways to publish them:
+#   - daemon mode: a small http server answering GET /metrics with the latest run
+#   - cron mode: a node_exporter textfile (--collector.textfile.directory), replaced atomically
+#
+# Per-node metrics are labeled with id, owner, type and coreId from the node registry.
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import audit_checkin
+import audit_propagation
+
+PREFIX = 'jouleverse_audit_'
+
+## name -> (type, help)
+METRICS = {
+        'node_connected': ('gauge', '1 if the node is a peer of the audit node'),
+        'node_reachable': ('gauge', '1 if the p2p port of a disconnected node accepts connections'),
+        'node_block_height': ('gauge', 'latest block number reported by the witness rpc, -1 if it did not answer'),
+        'node_head_lag_blocks': ('gauge', 'blocks the witness is behind the audit node'),
+        'node_probe_success': ('gauge', '1 if the witness rpc probe returned a block number'),
+        'node_probe_latency_seconds': ('gauge', 'duration of the witness rpc probe'),
+        'node_probe_skipped': ('gauge', '1 if the witness was not probed this run, its circuit breaker is open'),
+        'node_forked': ('gauge', '1 if the witness has another block at the reference height than the audit node'),
+        'node_syncing': ('gauge', '1 if the witness reports it is syncing'),
+        'node_peer_count': ('gauge', 'peers of the witness, from net_peerCount'),
+        'node_block_rate': ('gauge', 'share of the recent blocks sealed by the miner, from clique_status'),
+        'node_checked_in': ('gauge', '1 if the coreId checked in this month'),
+        'node_connection_uptime_ratio': ('gauge', 'share of the admin_peers samples the node was connected in (daemon mode)'),
+        'node_propagation_lag_seconds': ('gauge', 'seconds new blocks take from the audit node to the witness over 24h, by quantile (daemon mode)'),
+        'node_propagation_missed_ratio': ('gauge', 'share of the new blocks the witness did not report in time over 24h (daemon mode)'),
+        'nodes_alive': ('gauge', 'nodes counted alive by the audit'),
+        'last_block_number': ('gauge', 'latest block of the audit node'),
+        'last_block_timestamp_seconds': ('gauge', 'timestamp of the latest block of the audit node'),
+        'probe_duration_seconds': ('gauge', 'wall time of probing all witnesses'),
+        'run_timestamp_seconds': ('gauge', 'time the audit run finished'),
+        }
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, _escape(v)) for (k, v) in labels.items()) + '}'
+
+def node_labels(node):
+    return {
+            'id': node['id'],
+            'owner': node['owner'],
+            'type': node['type'],
+            'coreId': '' if node.get('coreId') is None else node['coreId'],
+            }
+
+## samples of a run: name -> [(labels, value), ...]
+def collect(run):
+    samples = {name: [] for name in METRICS}
+    table = run['table']
+    all_labels = {}
+    for i in range(len(table)):
+        node = table.row(i)
+        labels = all_labels[node['id']] = node_labels(node)
+        samples['node_connected'].append((labels, 1 if node['status'] == 'connected' else 0))
+        if node.get('reach') in ['reachable', 'unreachable']:
+            samples['node_reachable'].append((labels, 1 if node['reach'] == 'reachable' else 0))
+        if node.get('probe') == 'backoff':
+            samples['node_probe_skipped'].append((labels, 1))
+        elif 'probe' in node:
+            samples['node_probe_skipped'].append((labels, 0))
+            samples['node_block_height'].append((labels, node['block_height']))
+            samples['node_probe_success'].append((labels, 1 if node['probe'] == 'ok' else 0))
+            samples['node_probe_latency_seconds'].append((labels, node['probe_latency']))
+            if node['fork'] is not None:
+                samples['node_forked'].append((labels, 1 if node['fork'] else 0))
+            if node['syncing'] is not None:
+                samples['node_syncing'].append((labels, 1 if node['syncing'] else 0))
+            if node['peer_count'] is not None:
+                samples['node_peer_count'].append((labels, node['peer_count']))
+            if node['block_height'] > 0:
+                samples['node_head_lag_blocks'].append((labels, run['last_block_n'] - node['block_height']))
+        if node['type'] == 'miner':
+            samples['node_block_rate'].append((labels, node['block_rate']))
+        if node.get('coreId') is not None:
+            checked_in = audit_checkin.is_checked_in(run['token_infos'].get(node['coreId']), run['month_start_timestamp'])
+            samples['node_checked_in'].append((labels, 1 if checked_in else 0))
+
+    for (node_id, uptimes) in (run.get('uptime') or {}).items():
+        for (window, u) in zip(['24h', '30d'], uptimes):
+            if u is not None:
+                samples['node_connection_uptime_ratio'].append((dict(all_labels[node_id], window=window), round(u, 4)))
+
+    for (node_id, s) in (run.get('propagation') or {}).items():
+        labels = all_labels[node_id]
+        for (p, q) in zip(audit_propagation.PERCENTILES, s['percentiles']):
+            if q is not None:
+                samples['node_propagation_lag_seconds'].append((dict(labels, quantile='%g' % (p / 100)), round(q, 4)))
+        if s['heads']:
+            samples['node_propagation_missed_ratio'].append((labels, round(1 - s['seen'] / s['heads'], 4)))
+
+    samples['nodes_alive'] = [
+            ({'type': 'all'}, run['count']),
+            ({'type': 'miner'}, run['count_miner']),
+            ({'type': 'witness'}, run['count_witness']),
+            ]
+    samples['last_block_number'].append(({}, run['last_block_n']))
+    samples['last_block_timestamp_seconds'].append(({}, run['last_block_ts']))
+    samples['probe_duration_seconds'].append(({}, run['probe_t'].total_seconds()))
+    samples['run_timestamp_seconds'].append(({}, round(run['current_t'].timestamp(), 3)))
+    return samples
+
+## prometheus text exposition format
+def render(run):
+    lines = []
+    for (name, values) in collect(run).items():
+        if not values:
+            continue
+        (metric_type, help_text) = METRICS[name]
+        lines.append('# HELP %s%s %s' % (PREFIX, name, help_text))
+        lines.append('# TYPE %s%s %s' % (PREFIX, name, metric_type))
+        for (labels, value) in values:
+            lines.append('%s%s%s %s' % (PREFIX, name, _labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+## node_exporter reads the textfile at any time, so never let it see a partial one
+def write_textfile(run, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(render(run))
+    os.replace(tmp, path)
+
+## metrics server
+
+_latest = '' # rendered metrics of the latest run, swapped as a whole
+
+def publish(run):
+    global _latest
+    _latest = render(run)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = _latest.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # scraped every few seconds, keep the daemon log clean
+
+## serve /metrics from a background thread
+def serve(port, addr=''):
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -2,758 +2,938 @@
 
 # Usage:
 # $ python3 audit_network.py ~/data/mainnet/geth.ipc
+# $ python3 audit_network.py --networks networks.json
+# $ python3 audit_network.py ~/data/mainnet/geth.ipc --publish publish.json
+# $ python3 audit_network.py probe ~/data/mainnet/geth.ipc <owner | node id | coreId | enode>
 # You may need to grant the access for ~/data/mainnet/geth.ipc to current user.
 
 # Revision History:
 # 2024.1.24 evan.j initial rewrite from the js version. add checks for rpc 8501 and block height of witness nodes.
 
 import argparse
-import functools
-import base64
+import contextlib
+import copy
+import io
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
-
-# 核心节点信息
-core_nodes = [
-        {
-            'owner': 'Koant',
-            'type': 'miner',
-            'ip': '119.29.202.168',
-            'id': '93886caf6ba2a9b4cf31527385b53f7750dd8d6a3fcfaa41cb6c59a77c049ec6',
-            'signer': '0x8d6a6f3d18f0d378ecb75796c4ebc8f54fba7700',
-            'enode': 'enode://a475b2061e5b46e7a962541da252654d8629254c38ed4fb3410fe9a6240e40f3502c91f99ab5e82956bb91f028e76b4adf07659139736a4f19d8e19da824eba9@119.29.202.168:30311',
-            'since': '20231015',
-            'coreId': 0,
-            },
-        {
-            'owner': '楼兰渔夫', 
-            'type': 'miner',
-            'ip': '110.42.225.146',
-            'id': '944ad2cd26b56cd6e5b35d9878f5efc05a713d91d1c584af63529bd1592b67f2',
-            'signer': '0x497c19a8157f2c839ec57bf6fb0f26c44fa51203',
-            'enode': 'enode://840f6fbc0650bc100daec33dd6707a3ad7672204e849de83a20c3b5b8a3a3705c974f6801e3d26af22b26c9b0194c9fcd804144dc1a4e2da2f6b10b09b707258@110.42.225.146:30311',
-            'since': '20250319',
-            'coreId': 4,
-            },
-    {
-            'owner': 'Menger',
-            'type': 'miner',
-            'ip': '62.234.21.37',
-            'id': '16376be08813c07d06cdf5e073916f97846c67ec08f1f9c3be4ac5d894ab4670',
-            'signer': '0x3fc084c968e77f264803ef5af09e6d6f05228bea',
-            'enode': 'enode://72ced57bb2a447947d7bf6378ee927fb04954eba69063571bec3cd3e3cf8d5e660ffb3e62a2cf073045f949a592b2a2c66a1d5bf700a00f069531239749a8382@62.234.21.37:30311',
-            'since': '20231027',
-            'coreId': 5,
-            },
-    {
-            'owner': 'li17',
-            'type': 'miner',
-            'ip': '47.100.5.124',
-            'id': 'ffd502a7cebcaad58aff75d9dfde768067d3e78baf31870a7f4debf353107581',
-            'signer': '0x002ed4ea787fd611f44a8277b5e204aad5c81717',
-            'enode': 'enode://b7055440d2792887e10ca12192d5d30200a4d9352d9de560732589014e26e5b6c587c5ae201441597795f33b2af6afecadb31193bf6f467024e3144ba40f6d2b@47.100.5.124:30311',
-            'since': '20240107',
-            'coreId': 6,
-            },
-    {
-            'owner': '明海云',
-            'type': 'miner',
-            'ip': '129.204.236.149',
-            'id': 'cfae8e5f430c68db93d8d85987fa7dc20f17da1bb478f90477ff880f68452024',
-            'signer': '0xf3b67b1e625a8ffe7af9645e9e1432d145f2046a',
-            'enode': 'enode://7d2f86c4a16a46aa62674c713c44d9b1c2a0bbcee4e4315c1a9eed47e87c3dfe59916f971bfe5f8b71acd2b5165a89b858569a18a8d12e51bd12273ffc485cbf@129.204.236.149:30311',
-            'since': '20240118',
-            'coreId': 7,
-            },
-        {
-            'owner': 'Jacky',
-            'type': 'miner',
-            'ip': '47.94.93.119',
-            'id': 'e88e333abc2dce665fd9c35bef4a0383249b1670955cefac4c582092fa34fbcb',
-            'signer': '0x28D314d2B00EED89041843d4Cd7b9de91170f37a',
-            'enode': 'enode://be96ad65107a3d520943f761d00a79a6e08bd4acc5b008b58ff8406761e5ca7e923bcb310654089b1ab364579f70ebe042f2baf9c9adbfa8482052f31c6766f1@47.94.93.119:30311',
-            'since': '20230529',
-            'coreId': 9,
-            },
-    {
-            'owner': '火星',
-            'type': 'miner',
-            'ip': '122.51.70.192',
-            'id': 'eee09cee70c41c21c6ab1ae71236f3e96660d5f7a50b9cc69a276b67d375032f',
-            'signer': '0x87d973cAD9fE24252F5E4bFbd43B66bF31718886',
-            'enode': 'enode://1ac2352580896800012fb5461ebafcea10289d07dcf8adaf4d45bb4da57eaf71c650b58030e27d1d0c71096c638b416b70547511e22d6f9716c06236e1785a78@47.100.127.191:30311',
-            'since': '20240219',
-            'coreId': 17,
-            },
-        {
-            'owner': '谢勇', #稳清活
-            'type': 'miner',
-            'ip': '82.157.251.101',
-            'id': '6f0ef352cc2536d91f0a55efbec480c8e2b76a11fc5c30830167e026327f0a18',
-            'signer': '0x93196aeEb56fe0F5672d84b8F50C123b5dA50329',
-            'enode': 'enode://c43fa0ea62dfc0e09906f67a8b730918cbe567a3f53322470780ecdc569efda1a2dd9e4707ac65e3b558e9bf8a025a22da33b1ad08211290211b8c5ed0ed1671@82.157.251.101:30311',
-            'since': '20240119',
-            'coreId': 18,
-            },
-        {
-            'owner': '教链',
-            'type': 'miner',
-            'ip': '82.157.210.13',
-            'id': '61cb546c70e6a470e8ee64c4ff5fbef138d9afe116fb24147636802d6ffac30b',
-            'signer': '0x85db5D64BD1a2652A75C4A7e12Eeba2f43c57bC4',
-            'enode': 'enode://d667d09c38706d40fa1c15cde8dc28c117087cdf55d41d402d70b0817636c6f65e6a6463e81ab178ad9a896ea93c37b479a01ff19dfe13cd4276ea2c64575c76@81.68.150.141:30311',
-            'since': '20230524',
-            'coreId': 25,
-            },
-    {
-            'owner': '严光红',
-            'type': 'miner',
-            'ip': '106.53.60.230',
-            'id': 'f92367cc2a9b02c68d6f024b7630bdfa6060d0ce70fc676696633a59eef3ae39',
-            'signer': '0xcce6cc1ba66c6b9af2c7b20d78155c74ed9aad6f',
-            'enode': 'enode://94b45bc3705c8abebeda0ee9b31a76188b59c0c69397362e96accd39b15a56668775204d4f2e3e7ddb2b14df0b640b5bb9cd4dcb60c252ef80268f1af815f623@106.53.60.230:30311',
-            'since': '20240109',
-            'coreId': 26,
-            },
-    {
-            'owner': 'Jeff',
-            'type': 'miner',
-            'ip': '47.120.35.41',
-            'id': '58871675d4f24d7c916b4c3ccad303b3b862abfe125b1650b0177bd8be09e896',
-            'signer': '0x0ac52a05a4f87404b03dd58a7ac1427429522222',
-            'enode': 'enode://db1d084eaf12722b04600084a9bd5dcdbbff89facedff931629354ac396acf3564082fbae5a933f1bf4332a174bf9374941dc1caa1527f32c909589a26796014@47.120.35.41:30311',
-            'since': '20240113',
-            'coreId': 29,
-            },
-
-    # 241103
-    {
-            'owner': 'kylin',
-            'type': 'miner',
-            'ip': '110.40.130.38',
-            'id': '4c1caaabecd77700cbe29f5ffda48370dbddaf9def2ebafdb1471736b27d1e8b',
-            'signer': '0x08c1938546708f0b3c6f49703d1c19f79d90ac04',
-            'enode': 'enode://2e4104827d8fe8344b10d9ec10705e7cba11ef8476f68d0b5d7ceafe747373f03b2074e5901ba3c5d25c0436a24c03504cb75334e5503a65a1dc6929e0bd2346@110.40.130.38:30311',
-            'since': '20241103',
-            'coreId': 31,
-            },
-
-    # 241117
-    {
-            'owner': '煜歌',
-            'type': 'miner',
-            'ip': '110.42.247.135',
-            'id': '40516132d629c367140578751bb341fc774c7b84e9983eb4e605e9f1bf052479',
-            'signer': '0xa3F01Afa1dDfB6D07cac35210d5AFdfe6f0982E8',
-            'enode': 'enode://4dae7c25cc4f3d379911c3386f2a50f07142a0a8b5ba953d26ffc5ea9b3a8bd8b858ae18ab1b56887708c29b39949e9745fb65c9427de61ae6e20c74593373a2@110.42.247.135:30311',
-            'since': '20241117',
-            'coreId': 33,
-            },
-
-        {
-            'owner': 'cijin', 
-            'type': 'miner',
-            'ip': '43.136.103.133',
-            'id': 'bd872df0367eafd723691769eff10a255840ad16ebaebed534d8340be43358d8',
-            'signer': '0x6c1094955e6d5ffd62729f642ee78b8237f82d7c',
-            'enode': 'enode://ddac0bd477a9562a781171680fdfe61596d4f207c8642eb8bec8c74852b4a059f139676a158cadda58f812c31596b2fa65839637b0d034987fb40c17185f8df5@43.136.103.133:30311',
-            'since': '20250311',
-            'coreId': 34,
-            },
-
-    # 241113
-    {
-            'owner': '剪云为裳',
-            'type': 'miner',
-            'ip': '106.54.199.222',
-            'id': '4c108deb46bbe44e5960b509d1afd625cbeba13033fd92759ba8cc59b52d3a2f',
-            'signer': '0x5bC3930448cE53C970AcD41C1f80AbA6ab3c523f',
-            'enode': 'enode://2f151d76573e56ee0f57f5598176a5efe1a7fa3f154f66f5674257fe565138d0d4e80b3cba9cc12db0322a9bfd9ef1dc48e79f12cad9233d483f6c3d7d5d9b71@106.54.199.222:30311',
-            'since': '20241113',
-            'coreId': 37,
-            },
-
-    # 241115
-    {
-            'owner': '微尘',
-            'type': 'miner',
-            'ip': '47.94.33.72',
-            'id': '5c488a3f6e2a73da519a6b761164492fd3e9881d5d2537f8ebecbc5718549014',
-            'signer': '0xff42f7a9fd1afdeed1568805fa8dce67e3dbc188',
-            'enode': 'enode://a1224775395a3d283ac745ab6960b24dd8c432cba108be82331c7eeb8c2a8c361387446e64c4ff99c91e89fd730a0c56a7b29927771291006d02a023eabfa63b@1.92.102.75:30311',
-            'since': '20241115', # update 250817
-            'coreId': 53,
-            },
-    {
-            'owner': 'Koant',
-            'type': 'witness',
-            'ip': '111.230.23.83', # bootnode-koant.jnsdao.com
-            'id': '9ff3da439fbb25670e95f0063f7cad9409e66f3283c57fcae0a1e1af9d09cf81',
-            'enode': 'enode://b8163bedb4b8e3adf27d94bb8349892f9c8fa14602d2e48bd3083790edc76a26b0ac4d61a44c0a27b2ec46adce2a58249e77b9276530f5116028b355429a9b89@111.230.23.83:30311',
-            'since': '20240220',
-            'coreId': 0,
-            },
-        {
-            'owner': '楼兰渔夫',
-            'type': 'witness',
-            'ip': '43.138.211.245',
-            'id': '5a61991be2c59c55e9f3b38eb4c0e0e732274728e5afedb185a6019c686ae016',
-            'enode': 'enode://43437ed005d29afed89efe87be782f7565286d5b26b7d91566b69b0324bf158cf926315b7393a2976347fe018831fe626557fb62629c4692c63abed4a5866f83@43.138.211.245:30311',
-            'since': '20251201',
-            'coreId': 4,
-            },
-    {
-            'owner': 'li17.eth',
-            'type': 'witness',
-            'ip': '111.229.136.60',
-            'id': '94e08ab29e8dfcdb79e93fb9d69bad0ff7179508f76fef3d70cea901e17591d0',
-            'enode': 'enode://55b8cbf1e0776d4094e8b06b64b0545ce468290deda8c6830e6c3eeb5e06d3929a19a1f507591e3e6d985ad2f84c56327ffbd7f704ac00b84a2800b3de7277d7@111.229.136.60:30311',
-            'since': '20240120',
-            'coreId': 6,
-            },
-    {
-            'owner': '明海云',
-            'type': 'witness',
-            'ip': '43.139.249.74',
-            'id': 'ea8bcbf9ec92291e54472d3390de4c5231b03661609c46087298b5b451543b02',
-            'enode': 'enode://256ec7a9357908270c02c39bec8ba1852a71a4892c9fab95de89fe1a78a6839504f2b4ab1c12e877b8f7d3f6646fbc816ff56d707cc56d49de6158e4cc39ba93@43.139.249.74:30311',
-            'since': '20240111',
-            'coreId': 7,
-            },
-# 20240429
-{
-            'owner': 'ucanfilm (机构) ',
-            'type': 'witness',
-            'ip': '139.129.20.205',
-            'id': '88bfd5ab83bee2a2c25e7a15911cf780cd0ccac86acd928867e784fcdf47df8c',
-            'enode': 'enode://fbb54beade25d2c70ea03422e219ea5ec0d322b6b2a3bfe94eba5bc101c5cbfeba090e5f54014ef1ffa56e537c526730ae668b6e7e0b510565eb6ff6307d4e93@139.129.20.205:30311',
-            'since': '20240429',
-            'coreId': 14,
-            },
-    {
-            'owner': '火星',
-            'type': 'witness',
-            'ip': '118.89.117.135',
-            'id': '9bfbcdd542f8f7af28a9b3c50dc5dbd1bff8085311b9b216716a7106880ad6f2',
-            'enode': 'enode://5fe23cce534e7a49a0a6f79203fec02e84391ada79cf8fc0dc8ef2901ddc5620beea52dbab009c6ecb2bdc127ae084a252ffbf5c9221f733d096f346d3f25cf9@101.32.170.145:30311',
-            'since': '20230524',
-            'coreId': 17,
-            },
-    {
-            'owner': '谢勇',
-            'type': 'witness',
-            'ip': '120.26.11.88', # bootnode-wenqinghuo.jnsdao.com
-            'id': 'cc99492e1e2d2f9b125b8e1faae3c8d0d47eeadc63ac3ac7e58b0767bfde2726',
-            'enode': 'enode://b7908693bf2268db08c4fa868d8ea88298e9844a5892681eb63cb4a1a4b254356b5936f6a006dcc709212043b8da325ab72beb3cc2c26cc98843dc301914c961@120.26.11.88:30311',
-            'since': '20240119',
-            'coreId': 18,
-            },
-        {
-            'owner': 'gwendol', 
-            'type': 'witness',
-            'ip': '119.29.222.90',
-            'id': 'f633f834ce3f7593d6a67fc3c8b333ec165c7c6e003700d538d1bc8e89c4e817',
-            'enode': 'enode://0ee2ca0d4a0ba11221077b4ce05be53d0604e2540414b5e1d266bd6203ca44b32e4ebd76b8df194878f37d69de76e7008007a4b1cea6d761c5847c0ee4a9929f@119.29.222.90:30311',
-            'since': '20250820',
-            'coreId': 24,
-            },
-
-        {
-            'owner': 'JNSDAO',
-            'type': 'witness',
-            'ip': '101.32.253.192', # bootnode.jnsdao.com
-            'id': '2379e2c19b8a0e4a76d011b07e41493902c1f274abc5adce3e20fe60f0cabac6',
-            'enode': 'enode://19dc6b15744e8ad73f860d6ca7bf7b1acf37497ef8a720a88d64449ec837af460535fcf01662907aaece6bde0c2ff539a9d79e353d043769134666a1586fa4e0@43.134.121.187:30311',
-            'since': '20230529',
-            'coreId': 25, # maintainer JVCore #id. 尚未获得则删去该字段.
-            },
-    {
-            'owner': '严光红',
-            'type': 'witness',
-            'ip': '1.14.111.74', # bootnode-ygh.jnsdao.com
-            'id': '65e0dc09479950368c2edaa0d7f3dd30af33ebd0187b31f0ad5df55535905f01',
-            'enode': 'enode://b3eca38a3d18a789a0ca4e0e871c77fbf98fbe82cb8ed577895be8be14599abd07df88fe5fcf5fa11a63843b25bbc69b28da9a68bc0fcf42b01583329d4e0006@1.14.111.74:30311',
-            'since': '20231014',
-            'coreId': 26,
-            },
-    {
-            'owner': '狮子猫',
-            'type': 'witness',
-            'ip': '123.206.109.17',
-            'id': 'e97fcd7f8aed3881648f6d2859ed5da1a589ba9e25c43106c5ff51a14e1994e1',
-            'enode': 'enode://efc01ff491d277c73394095de99e8d62d25b5b981e03a4de5419d9bbf5bf6dd1ef6b89e169d376970c1a7af4fc73c90fd2d34b954f02c5367e0150911944cc41@123.206.109.17:30311',
-            'since': '20240112',
-            'coreId': 27,
-            },
-        {
-            'owner': 'Jeff',
-            'type': 'witness',
-            'ip': '43.136.53.164', # bootnode-jeff.jnsdao.com
-            'id': '36d1c18a197fea99e9b55b111b03ab03866367838b3017ae91984e0648e3f677',
-            'enode': 'enode://f3e4e524d89b4cdb9ee390d9485cee4d6a5e9a260f5673cab118505cc3e69fe8365bc00434222d27fe4082ca798b13ad8e7e139d1315f635fd0e46dbe96fa809@43.136.53.164:30311',
-            'since': '20240115',
-            'coreId': 29,
-            },
-    # 240120
-    {
-            'owner': 'kylin',
-            'type': 'witness',
-            'ip': '39.104.90.26',
-            'id': '278adeb4cba45bbdce929d78048b016aef23569a52d0565fabdb20d8dddf08c5',
-            'enode': 'enode://a682649ff17be55986dbc9ed2cf54bb66c0fff4f5ef4c81f23adbc41e82f91d7f1590f38616c619b1151692e8373dc764edd40819bcd45cb1416b8e4c0af229e@39.104.90.26:30311',
-            'since': '20240120',
-            'coreId': 31,
-            },
-        {
-            'owner': '煜歌', 
-            'type': 'witness',
-            'ip': '42.193.109.237',
-            'id': 'c0a15305660cdb54249dc6779625e3004c74cbfa4fd369e7ce549e5b3c13208e',
-            'enode': 'enode://2ff621a918f56499f6d7c2a220b9fe5b0db61ca0360b8915f4553bdb0c7f600ff065beb5499da4ac4afaa2861144197f4d01764a679070a71edb6402f3bd6c11@42.193.109.237:30311',
-            'since': '20250316',
-            'coreId': 33,
-            },
-    {
-            'owner': 'cijin',
-            'type': 'witness',
-            'ip': '106.53.39.89',
-            'id': '73741045125ed13335ab0440857a745473d43edc5bd5667f92f44e021aa9bf01',
-            'enode': 'enode://662cbf6b247cd57069c219cdcc23c279af0b0b9679d1161051a999659aef4cf4d5d4f36ee921c60bd52136133d066626f9d7a91e8c2e52f4152d78464ffe9021@106.53.39.89:30311',
-            'since': '20240114',
-            'coreId': 34,
-            },
-
-# 20240307
-    {
-            'owner': '花开的声音',
-            'type': 'witness',
-            'ip': '42.192.22.155',
-            'id': 'c035d24a2ee04451b482b48aff6bd58a51ee9bdd92854487e224828a4c4dd468',
-            'enode': 'enode://187997b8ea894fb9574968d264baf0c5eab64a1104cabcf4e4d65102d7c73895e0501e4af08690a876490939e50eaf86b45370ab18f02d0a6c9e11e104a40075@42.192.22.155:30311',
-            'since': '20240307',
-            'coreId': 39,
-            },
-    {
-            'owner': '米高', #240314 update
-            'type': 'witness',
-            'ip': '175.24.131.36',
-            'id': '873df9bf006162e49b051a3edfdd9fc1d938609e6ef130687376a90645b0dd14',
-            'enode': 'enode://2b508101e03ea070e67dc39bd3662c19d3dcc31c2a7564ffe636408d421ef7dc287b7f23d7b39dd11e584cab162ced987ea056a53a1e79ff15e43033a6c9989a@175.24.131.36:30311',
-            'since': '20240313',
-            'coreId': 42,
-            },
-
-    {
-            'owner': 'Ted',
-            'type': 'witness',
-            'ip': '36.134.89.81',
-            'id': '1e416260cd36231d299160e8a8c24014a02eb4ba1494ad43011d6432b02fc7ef',
-            'enode': 'enode://64e36ff9563dd1e50adbc4ebea15b564eddc557f80e4ff1f19da417413d905fc95323a1bd807c8b5108d83a9587e5ead044bb2d2e9c818d9ccc7e407b5ca56c8@36.134.89.81:30311',
-            'since': '20240313',
-            'coreId': 43,
-            },
-
-#20240319
-{
-            'owner': '团子',
-            'type': 'witness',
-            'ip': '49.235.152.212',
-            'id': '6fc886c96d3862531db85eb7ba62461970106c7abe543e9663e9c16ec6f0d26b',
-            'enode': 'enode://bf6a39a59f320c74dc59883f144550a3059a6b7cde84d21acb0f87b546503f014d8c893335557c8e18c940d1d3418b4b6b630c50c786ad69b1fa4fd5a638386b@49.235.152.212:30311',
-            'since': '20240319',
-            'coreId': 44,
-            },
-# 240313
-    {
-            'owner': '杨敦鹏', # lastupdate 240402
-            'type': 'witness',
-            'ip': '115.159.190.129',
-            'id': 'cbeb747a862d38b8dc1a5f67a27a542f0e3bbb4b80ea9fcfa4c4b4e217728f80',
-            'enode': 'enode://34513e0eb5f5613c51f2fb8648138f2cef59bd047ae197be8c28a2808718584d284b5ab02e7a430fa7ad9a1374b23048cd91fa9ad616afa5cb2f4da70f6016bc@115.159.190.129:30311',
-            'since': '20240313',
-            'coreId': 45,
-            },
-
-        {
-            'owner': 'xiangwang',
-            'type': 'witness',
-            'ip': '129.211.62.162',
-            'id': 'dd8a74f988b7016416fa6e5bf29bfeec2a5792700174f923b4a4647ec07cf8c2',
-            'enode': 'enode://0fa16459d712d5f6ea6b5cab25a56ebb357ca4bd90733efe34db6ce44699ba175a7e43d3e2f4a814beffe6d162715851fb73d32b4d6f08f7658653adf2ec74a8@129.211.62.162:30311',
-            'since': '20240319', # 2nd, 20250326
-            'coreId': 46,
-            },
-{
-            'owner': '邱泳渼',
-            'type': 'witness',
-            'ip': '124.222.52.62',
-            'id': 'c5aaafa61992ef49d76c3bd84e493afac61aa082e83d49fb6d4a80834b005a76',
-            'enode': 'enode://979dcadb3ce38e9569da7e9d47c9d99869bfbe62a64e6e36f76755aacc044cacf5cdd3fea96d2863414b164271412ff966adc95b037858bf095d66952c2618e8@124.222.52.62:30311',
-            'since': '20240319',
-            'coreId': 47,
-            },
-
-# 20240402
-{
-            'owner': '星语欣愿',
-            'type': 'witness',
-            'ip': '122.51.194.8',
-            'id': '1c4e3d16f493c29a33dd7779d83780136691add1151698b740bffaf044419c7d',
-            'enode': 'enode://a1f164a376d59b7a8903fdaf1d10687523cbdacc298a625a5d31ad0a3615f0539a6f54243b2d304d66f1d3f3079ef0a1a3196342bdcaa12f034c0a83468e2f80@122.51.194.8:30311',
-            'since': '20240402',
-            'coreId': 49,
-            },
-# 20240509
-{
-            'owner': '相瑾',
-            'type': 'witness',
-            'ip': '101.43.23.92',
-            'id': 'bda5a83e2f7c70a33d31a998f285d50da8a09448af9805a5e069d8a780407989',
-            'enode': 'enode://620113e75c0cf4a645b9bfe938a147211cbbf84b2f36405f69dfaa359e58032519e7eababe033214966a10579517a588d25060e71e6399459a227c8ef2ecda00@101.43.23.92:30311',
-            'since': '20240509',
-            'coreId': 51,
-            },
-        {
-            'owner': '盛美',
-            'type': 'witness',
-            'ip': '117.72.113.123',
-            'id': '68617066980c00985b7fc331487d193e22258badbaeec6bf619d3e7cbc255ae8',
-            'enode': 'enode://9fcb694d575cac90db04e4afd4611145b21b01282ce06097bec90e806f3819656bbc4ce3ea9c41b91f62a4a6fc4300758df0e829e38b708563cf43e5a159ba31@117.72.113.123:30311',
-            'since': '20240623',
-            'coreId': 52,
-            },
-
-# 20240719
-{
-            'owner': '微尘',
-            'type': 'witness',
-            'ip': '81.70.93.66',
-            'id': '81abaac1ce9838730115e271d14da9d0a437475334a1a9efd4e1b4f1e7696f88',
-            'enode': 'enode://c4bb52660680595ffb3a1b7dd4db696c74f69bc9fa29fb93ff46e4d69f32fd6fc06b7470605fe0b1d7e19b30f54dc17170df4865fc668f19f8d842ada83f8867@81.70.93.66:30311',
-            'since': '20240719',
-            'coreId': 53,
-            },
-
-
-{
-            'owner': 'Simon',
-            'type': 'witness',
-            'ip': '139.224.209.54',
-            'id': 'b9ee64eeca1fcedad05629a41665df21e395900de11e8d84f785d773b4ccbcec',
-            'enode': 'enode://bfda1116bba6ac01a61479acf917fc45b667d9bed824f21d6e1acfc04e546c8d2ce1b629e2c924797eb43243188586544de5618f6aadc97c70916d31e10b7fff@139.224.209.54:30311',
-            'since': '20240927',
-            'coreId': 54,
-            },
-
-# 20240908
-{
-            'owner': 'TIGER',
-            'type': 'witness',
-            'ip': '117.72.152.237',
-            'id': '13b01d9329bbae324a581153eee384d148170bdcb5dc0ff43e2b5749224d483e',
-            'enode': 'enode://3abea1f6928c8400900c554fceb6a63a79120214e72bfde6a9ff10f60b147a616585f4b433e25cbac8b37a3efbb5eff36b0dc73961c09858ee15790a2732a3a2@162.14.111.59:30311'
-            ,'since': '20240908',
-            'coreId': 57,
-            },
-
-# 20240831
-{
-            'owner': 'sing2011',
-            'type': 'witness',
-            'ip': '117.72.147.245',
-            'id': '6b0da4e2b295d5479d6f856be3b2264bb57c443a23b568d76c40aa0f7774ae1e',
-            'enode': 'enode://d8cc45697a68aed642a2f4747d0829716d08b83c8384d3a0f9dc1705f0804efb33216afc11cfd4296b306a2ad18be1984366326d1920a584aa62d9d120896d82@101.126.79.130:30311'
-            ,'since': '20240831',
-            'coreId': 58,
-            },
-{
-            'owner': '潇先生',
-            'type': 'witness',
-            'ip': '117.72.157.230',
-            'id': '5a7147dbbfb3481999095253015cd0bba34aef5d275c8778dcaefc6868fd815b',
-            'enode': 'enode://70ee7da8aee656dd87087a90d9b89d5aec786b11d6d08979588640a57defcb9cb1fb0da4c1c536b8adac84e717885d5b34e641768c6d129478e4f3652ef82d19@101.126.91.91:30311'
-            ,'since': '20240908',
-            'coreId': 59,
-            },
-
-# 20240825
-{
-            'owner': '蓝叶子-node',
-            'type': 'witness',
-            'ip': '1.92.122.1',
-            'id': 'bb341e65ad7fdac57853cd6e016207c99eb6ea07c758d8264fccffee63f0654a',
-            'enode': 'enode://f08af9f5fa587deee8b1adb8f14f14918d9cd21c592ab1a7975228a611839f6709d8bc4ef4839c582cc169234e599a9236fa53e7984210bbcf3a7fde691dc070@1.92.122.1:30311'
-            ,'since': '20240825',
-            'coreId': 60,
-            },
-
-# 20240925
-{
-            'owner': '彩彩',
-            'type': 'witness',
-            'ip': '81.70.161.150',
-            'id': '1519723d38021e865a05454ca2b1c8f42a47ebe79eb5d7f5756608bb17c153f5',
-            'enode': 'enode://d391c5ce8898eece6d7aaaf23ebcd7caa342c9bc9406645f9be617fa3e405af07cd80beb56dcabb12317f8b46bb57cf67e8a6f631ddc09f8b9733c5041e74516@101.126.156.22:30311'
-            ,'since': '20240925',
-            'coreId': 61,
-            },
-        {
-            'owner': '王伟龙',
-            'type': 'witness',
-            'ip': '118.25.157.8',
-            'id': '06117bc75a4e81a3557089dac3efe879ff2c0bd5c7e21a535512ea120ed6ebbb',
-            'enode': 'enode://85c7c5a7ab42e587bcf53d2f8e7e1ba84ec568d461da7651b5861f0aeb82ea9f249eb2613c377388d24eb66dad1019f516c49bf058b92145c42f85683587333a@118.25.157.8:30311',
-            'since': '20251201',
-            'coreId': 65
-            },
-        {
-            'owner': '元神道（机构）', 
-            'type': 'witness',
-            'ip': '49.233.62.105',
-            'id': '7ee0f8e16164ffc13d80a8eb155e7bd00bba520447aab29a144837f3b9375c72',
-            'enode': 'enode://625a60ec8b7a5c66ef44419b5c76cc63661f62ea2f06c48f8a38adfd60f2fe5305e90421bb7cea6ccb62138894383b7cec0456a218c7264909d78815d0ce5b16@49.233.62.105:30311',
-            'since': '20250403',
-            'coreId': 66,
-            },
-
-]
-
-# JVCore 合约 ABI
-jvcore_abi = [
-    {
-        "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
-        "name": "isLiveness",
-        "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
-        "stateMutability": "view",
-        "type": "function"
-    },
-	{
-		"inputs": [
-			{
-				"internalType": "uint256",
-				"name": "tokenId",
-				"type": "uint256"
-			}
-		],
-		"name": "tokenURI",
-		"outputs": [
-			{
-				"internalType": "string",
-				"name": "",
-				"type": "string"
-			}
-		],
-		"stateMutability": "view",
-		"type": "function"
-	}
-]
-
-# JVCore 合约地址
-jvcore_address = "0x8d214415b9c5F5E4Cf4CbCfb4a5DEd47fb516392"
+
+import audit_probe
+import audit_propagation
+import audit_publish
+import audit_reach
+import audit_registry
+import audit_report
+import audit_status
+import audit_checkin
+import audit_store
+import audit_cassette
+import audit_headers
+import audit_metrics
+import audit_trace
+import audit_uptime
+import audit_watch
+from jsonrpc import IPCClient, Web3Client, unwrap
+
+# 核心节点信息: nodes.json, loaded into an audit_registry.Registry by main()
+core_nodes = None
+
+# sinks of the report, audit_publish config of --publish loaded by main()
+publish_config = None
+
+## windows of the block rate section, see audit_headers.parse_window
+BLOCK_RATE_WINDOWS = ['24h', '7d', 'month']
+
+## settings a network profile of --networks may set, each like its command line option.
+## the others (probe pool size, timeouts, backend) are shared by all networks of the process.
+PROFILE_KEYS = ['name', 'geth_ipc', 'registry', 'jvcore_address', 'rpc_port', 'valid_lag', 'stall_seconds', 'db', 'peer_state',
+        'probe_state', 'checkin_index', 'checkin_event', 'headers_dir', 'metrics_textfile']
+PROFILE_PATHS = ['geth_ipc', 'registry', 'db', 'peer_state', 'probe_state', 'checkin_index', 'headers_dir', 'metrics_textfile']
+## state written by a run, one of each per network
+PROFILE_STATE = ['db', 'peer_state', 'probe_state', 'checkin_index', 'headers_dir', 'metrics_textfile']
 
 ## parse command line argument /path/to/geth.ipc
-parser = argparse.ArgumentParser('audit_network')
-parser.add_argument('geth_ipc', help='path to geth.ipc file to be attached to')
-args = parser.parse_args()
-geth_ipc = args.geth_ipc
-
-## try to attach
-w3 = Web3(Web3.IPCProvider(geth_ipc))
-if not w3.is_connected():
-    raise Exception('cannot attach to geth ipc: ', geth_ipc)
-
-w3.middleware_onion.inject(geth_poa_middleware, layer=0) #otherwise cannot get_block
-
-## 创建 JVCore 合约实例
-jvcore_contract = w3.eth.contract(address=jvcore_address, abi=jvcore_abi)
-
-## get id of this node (as audit node)
-audit_node_id = w3.geth.admin.node_info().id
-
-## restructure node data
-all_peers = w3.geth.admin.peers()
-all_connected_ids = functools.reduce(lambda ids, n: ids+[n.id], all_peers, [])
-
-all_nodes = {} #nodes indexed by id
-all_miners = {} #miner nodes indexed by lc(signer address)
-
-for node in core_nodes:
-    all_nodes[node['id']] = node
-    if node['type'] == 'miner':
-        all_miners[node['signer'].lower()] = node
-
-    ## add peers in case if not
-    if node['id'] == audit_node_id:
-        all_nodes[node['id']]['status'] = 'connected'
-        all_nodes[node['id']]['type'] = 'witness(a)'
-    elif node['id'] in all_connected_ids:
-        all_nodes[node['id']]['status'] = 'connected'
-    else:
-        all_nodes[node['id']]['status'] = 'disconnected'
-        print('disconnected. trying to add peer:', node['ip'], node['type'], node['owner'])
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser('audit_network')
+    parser.add_argument('geth_ipc', nargs='?', help='path to geth.ipc file to be attached to')
+    parser.add_argument('--registry', default=audit_registry.DEFAULT_PATH, help='node registry (json), reloaded in daemon mode when it changes. default nodes.json next to this script')
+    parser.add_argument('--networks', help='audit several networks at once: json list of network profiles (name, geth_ipc, registry, jvcore_address, ...), options given here are their defaults')
+    parser.add_argument('--jvcore-address', default=audit_checkin.JVCORE_ADDRESS, help='address of the JVCore contract') # JVCore 合约地址
+    parser.add_argument('--rpc-port', type=int, default=audit_probe.RPC_PORT, help='rpc port of the witnesses')
+    parser.add_argument('--valid-lag', type=int, default=audit_store.VALID_LAG, help='a witness is alive if less than this many blocks behind the audit node')
+    parser.add_argument('--stall-seconds', type=int, default=audit_watch.STALL_SECONDS, help='the chain is stalled after this long without a new block')
+    parser.add_argument('--probe-workers', type=int, default=32, help='max number of witness rpc probes running at the same time')
+    parser.add_argument('--probe-connect-timeout', type=float, default=3.0, help='seconds to wait for a witness rpc connection')
+    parser.add_argument('--probe-read-timeout', type=float, default=5.0, help='seconds to wait for a witness rpc response')
+    parser.add_argument('--probe-budget', type=float, default=30.0, help='global deadline in seconds for probing all witnesses')
+    parser.add_argument('--probe-state', help='keep the circuit breakers of failing witnesses in this json file, across runs')
+    parser.add_argument('--reach-timeout', type=float, default=3.0, help='seconds to wait for the devp2p port of a disconnected node')
+    parser.add_argument('--discv4', action='store_true', help='also ping disconnected nodes on their discv4 udp port')
+    parser.add_argument('--peer-state', help='keep the add_peer backoff of unreachable nodes in this json file, across runs')
+    parser.add_argument('--db', help='record results of this run to the audit result store (sqlite) at this path')
+    parser.add_argument('--checkin-batch-size', type=int, default=100, help='max number of tokenURI calls per json-rpc batch')
+    parser.add_argument('--checkin-index', help='track check-ins by scanning JVCore logs incrementally, index kept in this json file')
+    parser.add_argument('--checkin-event', default=audit_checkin.CHECKIN_EVENT, help='signature of the JVCore check-in event, used with --checkin-index')
+    parser.add_argument('--headers-dir', help='keep an incremental block header index here and report block rates over 24h/7d/month')
+    parser.add_argument('--headers-per-run', type=int, default=audit_headers.HEADERS_PER_RUN, help='max blocks added to the header index by one run, the rest by the next runs')
+    parser.add_argument('--metrics-textfile', help='write prometheus metrics of every run to this file, for the node_exporter textfile collector')
+    parser.add_argument('--metrics-port', type=int, help='daemon mode: serve prometheus metrics of the latest run at http://:PORT/metrics')
+    parser.add_argument('--metrics-addr', default='', help='daemon mode: address for --metrics-port to listen on, default all')
+    parser.add_argument('--trace', action='store_true', help='time every phase and rpc call, print a timing summary after the report')
+    parser.add_argument('--trace-file', help='write the spans as a chrome trace (json) to this file, implies --trace')
+    parser.add_argument('--profile', action='store_true', help='run under cProfile and print the top functions to stderr')
+    parser.add_argument('--record', metavar='CASSETTE', help='record all rpc traffic and clock readings of the run to this file')
+    parser.add_argument('--replay', metavar='CASSETTE', help='run from a recorded cassette instead of the network, writing nothing to --db, --headers-dir or --checkin-index')
+    parser.add_argument('--backend', choices=['raw', 'web3'], default='raw', help='json-rpc transport: built-in raw client (fast startup) or web3')
+    parser.add_argument('--daemon', action='store_true', help='keep running: audit every --check-interval, report daily at --report-at')
+    parser.add_argument('--check-interval', type=int, default=3600, help='daemon mode: seconds between two audit runs')
+    parser.add_argument('--report-at', default='06:15', help='daemon mode: HH:MM local time to emit the daily report')
+    parser.add_argument('--watch', action='store_true', help='follow new heads and alert on missed signer turns and chain stalls. runs alongside --daemon, or alone')
+    parser.add_argument('--missed-turns', type=int, default=3, help='watch: alert when a signer misses this many turns in a row')
+    parser.add_argument('--alert-webhook', help='watch: also POST alerts as json to this url')
+    parser.add_argument('--alert-file', help='watch: also append alerts as json lines to this file')
+    parser.add_argument('--sample-interval', type=int, default=60, help='daemon mode: seconds between two admin_peers samples for connection uptime, 0 to turn off')
+    parser.add_argument('--uptime-file', help='daemon mode: keep the connection uptime samples in this file across restarts')
+    parser.add_argument('--report-file', help='daemon mode: also write the daily report to this file')
+    parser.add_argument('--output', action='append', metavar='FORMAT:PATH', help='also write the report as jsonl, csv or html to PATH, e.g. html:/var/www/html/index.html. may be repeated, {network} in PATH is the network name')
+    parser.add_argument('--publish', metavar='CONFIG', help='deliver the report to the file, mail and git sinks of this json config, see audit_publish. daily report in --daemon mode')
+    parser.add_argument('--propagation', action='store_true', help='measure block propagation lag to every witness on each new head. daily report in --daemon mode, or alone for --propagation-duration')
+    parser.add_argument('--propagation-interval', type=float, default=0.2, help='propagation: seconds between two polls of a witness')
+    parser.add_argument('--propagation-duration', type=float, default=600, help='propagation without --daemon: seconds to measure for')
+    parser.add_argument('--propagation-file', help='daemon mode: keep the propagation lags of the latest 24h in this file across restarts')
+    parser.set_defaults(network=None) # name of the network profile
+    args = parser.parse_args(argv)
+    for spec in args.output or []:
+        try:
+            audit_report.parse_output(spec)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.networks:
+        if args.geth_ipc:
+            parser.error('--networks takes the geth_ipc of every network from the profiles')
+        if args.daemon or args.watch or args.propagation or args.record or args.replay or args.profile:
+            parser.error('--networks is for a single run, not --daemon, --watch, --propagation, --record, --replay or --profile')
+        return args
+    if args.geth_ipc is None and not args.replay:
+        parser.error('geth_ipc is required')
+    if (args.daemon or args.watch or args.propagation) and (args.record or args.replay):
+        parser.error('--record and --replay are for a single run, not --daemon, --watch or --propagation')
+    if args.publish and (args.replay or args.profile or (args.watch and not args.daemon) or (args.propagation and not args.daemon)):
+        parser.error('--publish is for the report of a run or of --daemon, not --replay, --profile, --watch or --propagation alone')
+    return args
+
+## try to attach. the connection is kept and reused by every audit run of a daemon.
+def attach(geth_ipc, backend='raw'):
+    rpc = Web3Client.ipc(geth_ipc) if backend == 'web3' else IPCClient(geth_ipc)
+    try:
+        rpc.call('web3_clientVersion')
+    except Exception:
+        raise Exception('cannot attach to geth ipc: ', geth_ipc)
+    return rpc
+
+## update the header index of --headers-dir and read the per-signer block rates of BLOCK_RATE_WINDOWS
+## up to ts from it. returns (block rates, seconds indexed of the windows only partly indexed).
+def header_block_rates(rpc, args, ts):
+    index = audit_headers.HeaderIndex(args.headers_dir)
+    with audit_trace.span('header index'):
+        audit_headers.update(rpc, index, max_blocks=args.headers_per_run)
+    block_rates = {}
+    block_rate_spans = {}
+    for window in BLOCK_RATE_WINDOWS:
+        (start, end) = audit_headers.parse_window(window, ts)
+        block_rates[window] = index.block_rates(start, end)
+        span = index.span(start, end)
+        if span is not None:
+            block_rate_spans[window] = span
+    return (block_rates, block_rate_spans)
+
+## run all checks once and return the results. nothing is printed but add_peer attempts.
+## the nodes are those of the registry given, by default the one loaded by main().
+def audit(rpc, args, registry=None):
+    if registry is None:
+        registry = core_nodes
+    ## get id of this node (as audit node), peers, clique status and the latest block in one round trip
+    calls = [('admin_nodeInfo', []), ('admin_peers', []), ('clique_status', []), ('eth_getBlockByNumber', ['latest', False])]
+    with audit_trace.span('node status'):
+        (node_info, all_peers, clique_status, last_block) = [unwrap(r, m) for (r, (m, p)) in zip(rpc.batch(calls), calls)]
+    audit_node_id = node_info['id']
+
+    ## status of this run, apart from the registry
+    table = audit_status.StatusTable(registry)
+    table.audit = registry.index.get(audit_node_id, audit_status.NONE)
+    for peer in all_peers:
+        i = registry.index.get(peer['id'])
+        if i is not None:
+            table.connected[i] = 1
+    if table.audit != audit_status.NONE:
+        table.connected[table.audit] = 1
+    disconnected = [node for (i, node) in enumerate(registry.nodes) if not table.connected[i]]
+
+    ## check which disconnected nodes can be reached at all, only those are added as peers
+    reach_state = audit_reach.load_state(args.peer_state, args.network)
+    recorded = audit_cassette.value(['reach state'], lambda: copy.deepcopy(reach_state))
+    if audit_cassette.replaying():
+        reach_state = recorded
+    for node_id in list(reach_state):
+        i = registry.index.get(node_id)
+        if i is not None and table.connected[i]:
+            del reach_state[node_id]
+    with audit_trace.span('reachability'):
+        reach = audit_reach.check_nodes(disconnected, reach_state, workers=args.probe_workers,
+                timeout=args.reach_timeout, discv4=args.discv4)
+    if not audit_cassette.replaying():
+        audit_reach.save_state(args.peer_state, reach_state)
+
+    to_add_peer = []
+    for node in disconnected:
+        table.set_reach(registry.index[node['id']], reach[node['id']])
+        if reach[node['id']]['reach'] == audit_reach.REACHABLE:
+            print('disconnected. trying to add peer:', node['ip'], node['type'], node['owner'])
+            to_add_peer.append(node)
+        elif reach[node['id']]['reach'] == audit_reach.BACKOFF:
+            print('disconnected. unreachable, backing off:', node['ip'], node['type'], node['owner'])
+        else:
+            print('disconnected. unreachable, not adding peer:', node['ip'], node['type'], node['owner'])
+
+    ## add peers, pipelined
+    with audit_trace.span('add_peer'):
+        responses = rpc.pipeline([('admin_addPeer', [node['enode']]) for node in to_add_peer])
+    for (node, resp) in zip(to_add_peer, responses):
         try:
-            w3.geth.admin.add_peer(node['enode'])
+            unwrap(resp, 'admin_addPeer')
         except Exception as e:
             print('failed to add peer:', node['ip'], node['type'], node['owner'], str(e))
 
-## update all_miners with information from clique.status
-clique_status = w3.provider.make_request('clique_status', [])['result']
-for (addr, n) in clique_status['sealerActivity'].items():
-    if addr.lower() in all_miners:
-        all_miners[addr.lower()]['block_rate'] = n / clique_status['numBlocks']
-
-## get latest block info
-last_block_n = w3.eth.get_block_number()
-last_block = w3.eth.get_block(last_block_n)
-last_block_t = datetime.fromtimestamp(last_block.timestamp)
-current_t = datetime.now()
-diff_t = current_t - last_block_t
-
-## update all nodes status (miners + witness) and count
-count = count_miner = count_witness = 0
-for (id, node) in all_nodes.items():
-    node_type = node['type']
-    if node_type == 'miner':
-        node['block_rate'] = all_miners[node['signer'].lower()].get('block_rate') or -1 
-        if node['block_rate'] > 0:
-            count_miner += 1
-            count += 1
-    elif node_type == 'miner*':
-        node['block_rate'] = 0
-    elif node_type in ['witness', 'witness(a)']:
-        #node['block_height'] = 0
-        # check witness node's rpc 8501 and block height
-        ww3 = Web3(Web3.HTTPProvider('http://' + node['ip'] + ':8501'))
-        if ww3.is_connected():
-            node['block_height'] = ww3.eth.get_block_number()
+    ## blocks sealed recently per lc(signer address), from clique.status
+    sealer_activity = {addr.lower(): n for (addr, n) in clique_status['sealerActivity'].items()}
+
+    ## latest block info
+    last_block_n = int(last_block['number'], 16)
+    last_block_ts = int(last_block['timestamp'], 16)
+    last_block_t = datetime.fromtimestamp(last_block_ts)
+    current_t = audit_cassette.now()
+    diff_t = current_t - last_block_t
+
+    ## block rates of the miners, witnesses to probe (the audit node too)
+    all_witnesses = []
+    for (i, node) in enumerate(registry.nodes):
+        node_type = table.node_type(i)
+        if node_type == 'miner':
+            n = sealer_activity.get(node['signer'].lower())
+            table.block_rate[i] = n / clique_status['numBlocks'] if n else -1
+        elif node_type in ['witness', 'witness(a)']:
+            all_witnesses.append(node)
+
+    ## canonical block the witnesses are checked against for forks
+    reference_n = max(0, last_block_n - audit_probe.REFERENCE_DEPTH)
+    reference_block = rpc.call('eth_getBlockByNumber', [hex(reference_n), False])
+    reference = (reference_n, reference_block['hash']) if reference_block else None
+
+    ## circuit breakers of the witness probes, replayed as they were when recording
+    breakers = audit_probe.load_breakers(args.probe_state, args.network)
+    recorded = audit_cassette.value(['probe breakers'], lambda: copy.deepcopy(breakers))
+    if audit_cassette.replaying():
+        breakers = recorded
+
+    ## check witness nodes' rpc 8501, block height, fork, sync state and peers, all at once.
+    ## witnesses failing for a while are left out until their backoff is over.
+    t0 = audit_cassette.now()
+    with audit_trace.span('witness probes'):
+        probe_results = audit_probe.probe_witnesses(all_witnesses,
+                workers=args.probe_workers,
+                connect_timeout=args.probe_connect_timeout,
+                read_timeout=args.probe_read_timeout,
+                budget=args.probe_budget,
+                backend=args.backend,
+                reference=reference,
+                breakers=breakers,
+                now=current_t.timestamp(),
+                port=args.rpc_port)
+    probe_t = audit_cassette.now() - t0
+    if not audit_cassette.replaying():
+        audit_probe.save_breakers(args.probe_state, breakers)
+
+    for node in all_witnesses:
+        table.set_probe(registry.index[node['id']], probe_results[node['id']])
+
+    ## count alive nodes and group them for the report, in one pass. a witness at the right
+    ## height but on another chain is not alive for the network.
+    summary = table.summarize(last_block_n, args.valid_lag)
+
+    ## resolve check-in info of all coreIds in one go, pinned to the latest block
+    all_core_ids = list(registry.by_core_id)
+    month_start_timestamp = audit_checkin.get_month_start()
+    with audit_trace.span('check-ins'):
+        if args.checkin_index:
+            ## or mostly from the check-in index, kept up to date from JVCore logs
+            ## replayed as it was when recording, and left as it is on disk
+            index = audit_checkin.load_index(args.checkin_index)
+            recorded = audit_cassette.value(['checkin index'], lambda: copy.deepcopy(index))
+            if audit_cassette.replaying():
+                index = audit_checkin.parse_index(recorded)
+            seed = audit_checkin.update_index(rpc, index, all_core_ids, last_block_n, args.jvcore_address, args.checkin_event)
+            token_infos = audit_checkin.indexed_checkins(rpc, index, all_core_ids, last_block_n, month_start_timestamp,
+                    args.jvcore_address, chunk_size=args.checkin_batch_size, fresh=seed)
+            if not audit_cassette.replaying():
+                audit_checkin.save_index(args.checkin_index, index)
         else:
-            node['block_height'] = 0
-
-        diff_blocks = abs(node['block_height'] - last_block_n)
-        if diff_blocks < 10:
-            count_witness += 1
-            count += 1
+            token_infos = audit_checkin.resolve_checkins(rpc, args.jvcore_address, all_core_ids, last_block_n,
+                    chunk_size=args.checkin_batch_size)
+
+    ## per-signer block rates over longer windows, from the header index.
+    ## replayed as they were when recording, without updating the index.
+    block_rates = {}
+    block_rate_spans = {} # window -> seconds of it indexed, for the windows only partly indexed
+    if args.headers_dir:
+        (block_rates, block_rate_spans) = audit_cassette.value(['block rates'],
+                lambda: header_block_rates(rpc, args, current_t.timestamp()))
+
+    return {
+            'network': args.network,
+            'audit_node_id': audit_node_id,
+            'table': table,
+            'groups': summary['groups'],
+            'notices': summary['notices'],
+            'last_block_n': last_block_n,
+            'last_block_ts': last_block_ts,
+            'last_block_t': last_block_t,
+            'current_t': current_t,
+            'diff_t': diff_t,
+            'stall_seconds': args.stall_seconds,
+            'valid_lag': args.valid_lag,
+            'count': summary['count'],
+            'count_miner': summary['count_miner'],
+            'count_witness': summary['count_witness'],
+            'probe_results': probe_results,
+            'probe_t': probe_t,
+            'reference_n': reference_n,
+            'token_infos': token_infos,
+            'block_rates': block_rates,
+            'block_rate_spans': block_rate_spans,
+            'month_start_timestamp': month_start_timestamp,
+            }
 
 ## output report
-print('Jouleverese Network Audit Report')
-print('===============================================')
-print('Report Time:', datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S %z"))
-print('------------- blockchain status ---------------')
-
-if diff_t < timedelta(seconds=60):
-	print('Blockchain Status: 🟢')
-else:
-	print('Blockchain Status: 🔴')
-
-print('Latest Block Height:', last_block_n)
-print('Latest Block Time:', last_block_t.astimezone())
-
-## reporting node counts
-print('Network Size: ', count, ' nodes (', count_miner, ' miners, ', count_witness, ' witnesses, miner*s excluded)')
-
-## reporting node status
-print('---------------- nodes status -----------------')
-print('TYPE', 'SINCE', 'IP', 'CONNECTED', 'STATUS', 'ACTIVITY', 'LIVENESS', 'CORE-ID', 'OWNER', 'CHECK-IN')
-print('-----------------------------------------------')
-
-no_check_in_list = []
-no_kyc_list = []
-
-def formatTokenURI(data_str):
-    import json
-    if 'application/json;base64' in data_str and ',' in data_str:
-        data_str = data_str.split(',')[1]
-        json_str = base64.b64decode(data_str).decode('utf-8')
-        data_obj = json.loads(json_str)
-        return data_obj
-    return None
-
-def get_month_start():
-    now = datetime.now()
-    return int(datetime(now.year, now.month, 1).timestamp())
-
-## helper: reporting func
-def report(node):
-    enode_connected = '🟢' if node['status'] == 'connected' else '🟡'
-    if node['type'] == 'miner' and node['block_rate'] > 0:
-        node_liveness = '🟩'
-        node_activity = node['block_rate']
-    elif node['type'] in ['witness', 'witness(a)'] and node['block_height'] > 0:
-        node_liveness = '🟩'
-        node_activity = node['block_height']
+def print_report(run, model=None):
+    table = run['table']
+    if model is None:
+        model = audit_report.build(run, audit_cassette.now())
+
+    print('Jouleverese Network Audit Report')
+    print('===============================================')
+    if model['network']:
+        print('Network:', model['network'])
+    print('Report Time:', datetime.fromisoformat(model['report_time']).strftime("%Y-%m-%d %H:%M:%S %z"))
+    print('------------- blockchain status ---------------')
+
+    if model['chain'] == 'ok':
+        print('Blockchain Status: 🟢')
     else:
-        node_liveness = '🟥'
-        node_activity = -1
-
-    # 获取节点的 check-in 状态
-    core_id = node.get('coreId')  # 获取 coreId，可能为 None
-    if core_id is not None:
-        
-        # check_in_status = jvcore_contract.functions.isLiveness(core_id).call()
-        # check_in_status_display = '👍' if check_in_status else '❌'
-        
-        check_in_status = False 
-        check_in_status_display = '❌' 
-        token_info = jvcore_contract.functions.tokenURI(core_id).call()
-        if token_info:
-            token_info = formatTokenURI(token_info)
-            if token_info:
-                month_start_timestamp = get_month_start() 
-                last_checkin_time = int(token_info['lastCheckInTime'] or 0)
-                if last_checkin_time and last_checkin_time > month_start_timestamp:
-                    check_in_status = True
-                    check_in_status_display = '✅' 
-                
-        if not check_in_status and node['owner'] not in no_check_in_list:
-            no_check_in_list.append(node['owner'])
+        print('Blockchain Status: 🔴')
+
+    print('Latest Block Height:', run['last_block_n'])
+    print('Latest Block Time:', run['last_block_t'].astimezone())
+
+    ## reporting node counts
+    print('Network Size: ', run['count'], ' nodes (', run['count_miner'], ' miners, ', run['count_witness'], ' witnesses, miner*s excluded)')
+    print('Witness Probes:', model['probes'], '(%.1fs)' % run['probe_t'].total_seconds())
+
+    ## reporting node status: miners, miner*s, witnesses alive, then witnesses suspicious to not
+    ## alive anymore. the audit node is reported with the witnesses if it answered its own probe.
+    print('---------------- nodes status -----------------')
+    print('TYPE', 'SINCE', 'IP', 'CONNECTED', 'STATUS', 'ACTIVITY', 'LIVENESS', 'CORE-ID', 'OWNER', 'CHECK-IN')
+    print('-----------------------------------------------')
+    connected_mark = {'connected': '🟢', 'unreachable': '🔴', 'disconnected': '🟡'}
+    liveness_mark = {'ok': '🟩', 'forked': '🟥', 'down': '🟥', 'not-probed': '⏸'}
+    check_in_mark = {True: '✅', False: '❌', None: '❓'} # ❓: no coreId
+    for row in model['nodes']:
+        core_id = '--' if row['coreId'] is None else row['coreId']
+        print(row['type'], row['since'], row['ip'], connected_mark[row['status']], row['status'], row['activity'],
+                liveness_mark[row['liveness']], f'J-{core_id}', f'"{row["owner"]}"', check_in_mark[row['check_in']])
+
+
+    notices = model['notices']
+    if any(notices.values()):
+        print('---------------- notice -----------------')
+        labels = {
+                'unreachable': '🚫 UNREACHABLE (p2p port):',
+                'not peered': '🔗 REACHABLE, NOT PEERED:',
+                'forked': '🔀 FORKED (block hash at %d differs):' % run['reference_n'],
+                'syncing': '⏳ SYNCING:',
+                'no peers': '🔌 NO PEERS:',
+                'backoff': '⏸ NOT PROBED THIS RUN (backoff after repeated failures):',
+                'no check-in': '❌ NO CHECK-IN:',
+                'no kyc': '❓ NO KYC:',
+                }
+        for notice in audit_report.NOTICES:
+            if notices[notice]:
+                print(labels[notice], ','.join(notices[notice]))
+
+    ## changes since the day before, from the store
+    changes = model['changes']
+    if changes is not None:
+        print('------ changes since', datetime.fromtimestamp(changes['since']).strftime('%Y-%m-%d %H:%M'), '------')
+        labels = {
+                'down': '⬇️ DOWN:',
+                'recovered': '⬆️ RECOVERED:',
+                'lost check-in': '❌ LOST CHECK-IN:',
+                'block rate band': '📊 BLOCK RATE BAND:',
+                'new': '🆕 NEW:',
+                'removed': '➖ REMOVED:',
+                }
+        for (change, label) in labels.items():
+            if changes[change]:
+                print(label, ','.join('%s %s→%s' % tuple(c) if change == 'block rate band' else c for c in changes[change]))
+        if not any(changes[change] for change in labels):
+            print('no changes')
+
+    ## reporting connection uptime from the admin_peers samples of the daemon
+    if run.get('uptime'):
+        print('------------- connection uptime ---------------')
+        print('TYPE', 'IP', 'OWNER', '24H', '30D')
+        for (i, node) in enumerate(table.nodes):
+            uptimes = ['%.1f%%' % (u * 100) if u is not None else '--' for u in run['uptime'][node['id']]]
+            print(table.node_type(i), node['ip'], f'"{node["owner"]}"', *uptimes)
+
+    ## reporting miner block rates over longer windows
+    if run['block_rates']:
+        print('------------- miner block rate ----------------')
+        spans = run['block_rate_spans']
+        print('OWNER', 'SIGNER', *[w.upper() + ('(%s)' % audit_headers.format_span(spans[w]) if w in spans else '') for w in BLOCK_RATE_WINDOWS])
+        for i in run['groups'][audit_status.MINERS]:
+            node = table.nodes[i]
+            signer = node['signer'].lower()
+            rates = ['%.3f' % run['block_rates'][w].get(signer, 0) for w in BLOCK_RATE_WINDOWS]
+            print(f'"{node["owner"]}"', signer, *rates)
+        if spans:
+            print('(...): only that much of the window is in the header index yet')
+
+## store samples of the nodes of a run
+def run_samples(run):
+    samples = []
+    table = run['table']
+    for i in range(len(table)):
+        node = table.row(i)
+        core_id = node.get('coreId')
+        check_in = None
+        if core_id is not None:
+            check_in = 1 if audit_checkin.is_checked_in(run['token_infos'].get(core_id), run['month_start_timestamp']) else 0
+        samples.append(audit_store.node_sample(node, run['last_block_n'], check_in))
+    return samples
+
+## changes since the day before, from the store
+def run_changes(run, db):
+    store = audit_store.open_store(db)
+    changes = audit_report.diff_from_store(store, run, run_samples(run))
+    store.close()
+    return changes
+
+## record results of a run
+def record(run, db):
+    samples = run_samples(run)
+    store = audit_store.open_store(db)
+    stored = audit_store.stored_valid_lag(store)
+    if stored is not None and stored != run['valid_lag']:
+        print('warning: valid lag %d of this run is not the %d of the rollups of %s, which still count by %d. '
+                'to change it, run: audit_store.py rebuild %s --valid-lag %d' % (run['valid_lag'], stored, db, stored, db, run['valid_lag']),
+                file=sys.stderr, flush=True)
+    audit_store.record_run(store, int(run['current_t'].timestamp()), run['last_block_n'], run['last_block_ts'], run['audit_node_id'], samples,
+            run['valid_lag'])
+    store.close()
+
+## reporting monthly availability from the rollups, one lookup per node
+def print_availability(run, db):
+    month = run['current_t'].strftime('%Y-%m')
+    (month_start, month_end) = audit_store.month_range(month)
+    store = audit_store.open_store(db)
+    month_rollups = audit_store.period_rollups(store, 'month', month_start)
+    store.close()
+
+    print('----------- monthly availability --------------')
+    print('Month:', month, ' SLA: >=', audit_store.required_hours(month_start, month_end), 'valid hours of', (month_end - month_start) // 3600)
+    print('TYPE', 'OWNER', 'VALID-HOURS', 'CHECKED-HOURS', 'AVAILABILITY', 'MEAN-LAG', 'MEAN-RATE')
+    table = run['table']
+    for (i, node) in enumerate(table.nodes):
+        row = month_rollups.get(node['id'])
+        if row is None:
+            continue
+        availability = '%.2f%%' % (100 * row['valid_hours'] / row['hours']) if row['hours'] else '--'
+        mean_lag = '%.1f' % (row['lag_sum'] / row['lag_n']) if row['lag_n'] else '--'
+        mean_rate = '%.3f' % (row['rate_sum'] / row['rate_n']) if row['rate_n'] else '--'
+        print(table.node_type(i), f'"{node["owner"]}"', row['valid_hours'], row['hours'], availability, mean_lag, mean_rate)
+
+## reporting block propagation lag per witness, slowest first
+def print_propagation(run):
+    print('------------ block propagation ----------------')
+    names = {node['id']: (node['ip'], node['owner']) for node in run['table'].nodes}
+    audit_propagation.print_stats(run['propagation'], names)
+
+## audit, report and record once: what a cron run does
+def audit_and_report(rpc, args, sampler=None, meter=None):
+    audit_trace.reset()
+    with audit_trace.span('audit'):
+        run = audit(rpc, args)
+    if sampler:
+        run['uptime'] = sampler.uptimes(run['table'].index)
+    if meter:
+        run['propagation'] = meter.stats()
+    report_and_record(run, args)
+    print_trace(args)
+
+## the report of a run, recorded to --db and exported as metrics. a replayed run is not recorded.
+def report_and_record(run, args):
+    with audit_trace.span('report'):
+        if args.db:
+            run['changes'] = run_changes(run, args.db)
+        model = audit_report.build(run, audit_cassette.now())
+        print_report(run, model)
+        if run.get('propagation'):
+            print_propagation(run)
+        for spec in args.output or []:
+            (fmt, path) = audit_report.parse_output(spec)
+            audit_report.write(model, fmt, path.replace('{network}', run['network'] or ''))
+    if args.db:
+        with audit_trace.span('record'):
+            if not audit_cassette.replaying():
+                record(run, args.db)
+            print_availability(run, args.db)
+    export_metrics(run, args)
+
+def print_trace(args):
+    if audit_trace.enabled():
+        audit_trace.print_summary()
+        if args.trace_file:
+            audit_trace.write_chrome_trace(args.trace_file)
+
+## stdout of each thread to its own buffer if it set one, e.g. one per network audited at once
+class ThreadStdout:
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, s):
+        return getattr(self.local, 'buffer', self.stream).write(s)
+
+    def flush(self):
+        getattr(self.local, 'buffer', self.stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+## the per-network args of a --networks file: the options of the command line, overridden by the profile
+def load_networks(args):
+    with open(args.networks, encoding='utf-8') as f:
+        profiles = json.load(f)
+    if not isinstance(profiles, list) or not profiles:
+        raise ValueError('not a list of network profiles')
+    networks = []
+    for (i, profile) in enumerate(profiles):
+        unknown = sorted(set(profile) - set(PROFILE_KEYS))
+        if unknown:
+            raise ValueError('network %d: unknown %s' % (i, ', '.join(unknown)))
+        if not profile.get('name') or not profile.get('geth_ipc'):
+            raise ValueError('network %d: name and geth_ipc are required' % i)
+        network = argparse.Namespace(**vars(args))
+        for (key, value) in profile.items():
+            setattr(network, 'network' if key == 'name' else key, os.path.expanduser(value) if key in PROFILE_PATHS else value)
+        networks.append(network)
+    names = [network.network for network in networks]
+    if len(set(names)) < len(names):
+        raise ValueError('network names are not unique')
+    for key in PROFILE_STATE: # written by each network's thread, so not shared
+        paths = [getattr(network, key) for network in networks if getattr(network, key)]
+        if len(set(paths)) < len(paths):
+            raise ValueError('networks share a %s, give each profile its own' % key)
+    return networks
+
+## audit several networks at once, one thread each. the witness probes and reach checks of all
+## of them run on the one probe pool, over the one set of keep-alive rpc clients, so the run takes
+## about as long as the slowest network. reports are printed one section per network, in order.
+## returns the number of networks that failed.
+def audit_networks(networks, registries):
+    stdout = sys.stdout
+    sys.stdout = ThreadStdout(stdout)
+
+    def audit_one(network, registry):
+        out = sys.stdout.local.buffer = io.StringIO()
+        try:
+            rpc = attach(network.geth_ipc, network.backend)
+            try:
+                with audit_trace.span('audit', network=network.network):
+                    run = audit(rpc, network, registry)
+                report_and_record(run, network)
+            finally:
+                rpc.close()
+            return (out.getvalue(), True)
+        except Exception:
+            traceback.print_exc(file=out)
+            return (out.getvalue(), False)
+
+    audit_trace.reset()
+    try:
+        with ThreadPoolExecutor(max_workers=len(networks), thread_name_prefix='network') as pool:
+            sections = list(pool.map(audit_one, networks, registries))
+    finally:
+        sys.stdout = stdout
+    failed = 0
+    for (i, (network, (text, ok))) in enumerate(zip(networks, sections)):
+        if i:
+            print()
+        print(text, end='')
+        if not ok:
+            print('❗ audit of network', network.network, 'failed', flush=True)
+            failed += 1
+    print_trace(networks[0])
+    return failed
+
+## the report text to the sinks of --publish, retrying the spool. returns the number of failed deliveries
+def publish(text):
+    if publish_config is None:
+        return 0
+    return audit_publish.publish(publish_config, text)
+
+## metrics from the results of the run, no extra rpc
+def export_metrics(run, args):
+    if args.metrics_textfile:
+        audit_metrics.write_textfile(run, args.metrics_textfile)
+    if args.metrics_port:
+        audit_metrics.publish(run)
+
+## next HH:MM local time after now, as unix time
+def next_time_of_day(hhmm, now):
+    (h, m) = [int(x) for x in hhmm.split(':')]
+    t = datetime.fromtimestamp(now).replace(hour=h, minute=m, second=0, microsecond=0)
+    if t.timestamp() <= now:
+        t += timedelta(days=1)
+    return t.timestamp()
+
+## daemon mode: one resident process with warm connections instead of a cold start per cron run.
+## audits every check_interval (aligned to it, e.g. at the top of every hour) and records to --db,
+## emits the full report once a day at report_at.
+def run_daemon(rpc, args, meter=None, watch=None):
+    global core_nodes
+    now = time.time()
+    next_check = now # first check right away
+    next_report = next_time_of_day(args.report_at, now)
+    if args.metrics_port:
+        audit_metrics.serve(args.metrics_port, args.metrics_addr)
+
+    ## connection uptime, sampled in between the checks
+    sampler = None
+    next_sample = float('inf')
+    audit_node_id = rpc.call('admin_nodeInfo')['id']
+    if args.sample_interval:
+        sampler = audit_uptime.PeerSampler(args.sample_interval, path=args.uptime_file)
+        next_sample = now
+    print('audit daemon started. checking every', args.check_interval, 's, reporting daily at', args.report_at, flush=True)
+
+    ## stopped by a signal (systemctl stop, ctrl-c): keep the samples taken since the last save
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(max(0, min(next_check, next_report, next_sample) - time.time()))
+            now = time.time()
+
+            ## pick up edits of the registry, e.g. a node onboarded, without a restart
+            registry = audit_registry.reload_if_changed(core_nodes)
+            if registry is not core_nodes:
+                core_nodes = registry
+                if watch:
+                    watch.names = signer_names()
+                if meter:
+                    meter.update_witnesses(propagation_witnesses(audit_node_id))
+
+            if now >= next_sample:
+                next_sample = now - now % args.sample_interval + args.sample_interval
+                try:
+                    audit_uptime.poll(rpc, sampler, [node['id'] for node in core_nodes], audit_node_id, now)
+                except Exception:
+                    traceback.print_exc()
+                    sys.stderr.flush()
+                if now < next_check and now < next_report:
+                    continue
+            try:
+                if now >= next_report:
+                    next_report = next_time_of_day(args.report_at, now)
+                    out = io.StringIO()
+                    with contextlib.redirect_stdout(out):
+                        audit_and_report(rpc, args, sampler, meter)
+                    print(out.getvalue(), end='', flush=True)
+                    if args.report_file:
+                        with open(args.report_file, 'w') as f:
+                            f.write(out.getvalue())
+                    publish(out.getvalue())
+                elif now >= next_check:
+                    audit_trace.reset()
+                    with audit_trace.span('audit'):
+                        run = audit(rpc, args)
+                    if args.db:
+                        record(run, args.db)
+                    if sampler:
+                        run['uptime'] = sampler.uptimes(run['table'].index)
+                    if meter:
+                        run['propagation'] = meter.stats()
+                    export_metrics(run, args)
+                    print(datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S %z"), 'audit done: block', run['last_block_n'],
+                            run['count'], 'nodes alive', flush=True)
+            except Exception:
+                # keep the daemon alive, e.g. geth restarting. try again at the next slot
+                traceback.print_exc()
+                sys.stderr.flush()
+
+            ## the samples so far, after the report as after a check, and even if it failed
+            if sampler:
+                try:
+                    sampler.save()
+                except Exception:
+                    traceback.print_exc()
+                    sys.stderr.flush()
+
+            if now >= next_check:
+                next_check = now - now % args.check_interval + args.check_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if sampler:
+            sampler.save()
+
+## probe subcommand: the checks of the nodes matching one key only, e.g. a node being onboarded.
+## one batch to geth for its status and the check-ins, then the reach checks and the witness
+## probes at once, so it takes about one round trip to the node.
+
+PROBE_EXIT_OK = 0
+PROBE_EXIT_FAILED = 1 # a check failed
+PROBE_EXIT_NOT_FOUND = 2
+
+## node id -> [(check, ok, detail)], ok None for a check that tells nothing either way
+def probe_nodes(rpc, nodes, args):
+    core_ids = sorted({node['coreId'] for node in nodes if node.get('coreId') is not None})
+    calls = [('admin_nodeInfo', []), ('admin_peers', []), ('clique_status', []), ('eth_getBlockByNumber', ['latest', False])]
+    calls += [('eth_call', [{'to': args.jvcore_address, 'data': audit_checkin.encode_token_uri(core_id)}, 'latest']) for core_id in core_ids]
+    responses = rpc.batch(calls)
+    (node_info, all_peers, clique_status, last_block) = [unwrap(r, m) for (r, (m, p)) in zip(responses, calls[:4])]
+    token_infos = {core_id: audit_checkin.decode_token_info(resp) for (core_id, resp) in zip(core_ids, responses[4:])}
+    last_block_n = int(last_block['number'], 16)
+    reference_n = max(0, last_block_n - audit_probe.REFERENCE_DEPTH)
+    reference_block = rpc.call('eth_getBlockByNumber', [hex(reference_n), False])
+    reference = (reference_n, reference_block['hash']) if reference_block else None
+
+    audit_node_id = node_info['id']
+    connected_ids = {peer['id'] for peer in all_peers}
+    disconnected = [node for node in nodes if node['id'] != audit_node_id and node['id'] not in connected_ids]
+    witnesses = [node for node in nodes if node['type'] == 'witness' and node['id'] != audit_node_id]
+
+    ## reach checks alongside the witness probes, no backoff state: always check
+    reach = {}
+    reach_thread = threading.Thread(target=lambda: reach.update(audit_reach.check_nodes(disconnected, {},
+            timeout=args.reach_timeout, discv4=args.discv4)), name='reach')
+    reach_thread.start()
+    probes = audit_probe.probe_witnesses(witnesses, connect_timeout=args.probe_connect_timeout,
+            read_timeout=args.probe_read_timeout, budget=args.probe_connect_timeout + args.probe_read_timeout,
+            reference=reference, port=args.rpc_port)
+    reach_thread.join()
+
+    to_add_peer = [node for node in disconnected if reach[node['id']]['reach'] == audit_reach.REACHABLE] if args.add_peer else []
+    added = {}
+    for (node, resp) in zip(to_add_peer, rpc.pipeline([('admin_addPeer', [node['enode']]) for node in to_add_peer])):
+        try:
+            added[node['id']] = bool(unwrap(resp, 'admin_addPeer'))
+        except Exception as e:
+            added[node['id']] = str(e)
+
+    sealer_activity = {addr.lower(): n for (addr, n) in clique_status['sealerActivity'].items()}
+    month_start_timestamp = audit_checkin.get_month_start()
+    results = {}
+    for node in nodes:
+        checks = results[node['id']] = []
+        if node['id'] == audit_node_id:
+            checks.append(('p2p', True, 'this is the audit node'))
+        elif node['id'] in connected_ids:
+            checks.append(('p2p', True, 'connected'))
+        else:
+            r = reach[node['id']]
+            detail = 'disconnected, %s' % r['reach']
+            if r['discv4'] is not None:
+                detail += ', discv4 %s' % ('pong' if r['discv4'] else 'no pong')
+            if node['id'] in added:
+                detail += ', add_peer %s' % ('sent' if added[node['id']] is True else 'failed: %s' % added[node['id']])
+            checks.append(('p2p', r['reach'] == audit_reach.REACHABLE, detail))
+
+        if node['type'] == 'miner':
+            n = sealer_activity.get(node['signer'].lower())
+            if n is None:
+                checks.append(('blocks', None, 'not a signer (yet)'))
+            else:
+                checks.append(('blocks', n > 0, '%d of the last %d blocks' % (n, clique_status['numBlocks'])))
+        elif node['id'] in probes:
+            r = probes[node['id']]
+            if r['outcome'] != audit_probe.PROBE_OK:
+                checks.append(('rpc', False, '%s after %d ms' % (r['outcome'], r['latency'] * 1000)))
+            else:
+                lag = last_block_n - r['block_height']
+                detail = 'head %d (lag %d)' % (r['block_height'], lag)
+                if r['fork'] is not None:
+                    detail += ', block %d %s' % (reference_n, 'differs, forked' if r['fork'] else 'matches')
+                detail += ', %d ms' % (r['latency'] * 1000)
+                checks.append(('rpc', abs(lag) < args.valid_lag and not r['fork'], detail))
+
+        core_id = node.get('coreId')
+        if core_id is None:
+            checks.append(('check-in', None, 'no coreId'))
+        else:
+            checked_in = audit_checkin.is_checked_in(token_infos.get(core_id), month_start_timestamp)
+            checks.append(('check-in', checked_in, 'J-%d %s' % (core_id, 'checked in this month' if checked_in else 'not checked in this month')))
+    return results
+
+def print_probe(nodes, results):
+    mark = {True: '✅', False: '❌', None: '❓'}
+    for node in nodes:
+        print(node['type'], node['ip'], f'"{node["owner"]}"', node['id'])
+        for (check, ok, detail) in results[node['id']]:
+            print('   ', check, mark[ok], detail)
+
+def probe_main(argv):
+    parser = argparse.ArgumentParser('audit_network probe', description='run the checks of one node only, e.g. when onboarding it. exit code 0 if all of them pass, 1 if one fails, 2 if no node matches')
+    parser.add_argument('geth_ipc', help='path to geth.ipc file to be attached to')
+    parser.add_argument('key', help='owner, node id, coreId or enode of the node, as registered')
+    parser.add_argument('--registry', default=audit_registry.DEFAULT_PATH, help='node registry (json)')
+    parser.add_argument('--jvcore-address', default=audit_checkin.JVCORE_ADDRESS, help='address of the JVCore contract')
+    parser.add_argument('--rpc-port', type=int, default=audit_probe.RPC_PORT, help='rpc port of the witnesses')
+    parser.add_argument('--valid-lag', type=int, default=audit_store.VALID_LAG, help='a witness is alive if less than this many blocks behind the audit node')
+    parser.add_argument('--probe-connect-timeout', type=float, default=3.0, help='seconds to wait for a witness rpc connection')
+    parser.add_argument('--probe-read-timeout', type=float, default=5.0, help='seconds to wait for a witness rpc response')
+    parser.add_argument('--reach-timeout', type=float, default=3.0, help='seconds to wait for the devp2p port of a disconnected node')
+    parser.add_argument('--discv4', action='store_true', help='also ping a disconnected node on its discv4 udp port')
+    parser.add_argument('--no-add-peer', dest='add_peer', action='store_false', help='do not add a reachable disconnected node as peer')
+    parser.add_argument('--json', action='store_true', help='print the results as json, one object per node')
+    args = parser.parse_args(argv)
+
+    try:
+        registry = audit_registry.load(args.registry)
+    except (OSError, audit_registry.RegistryError) as e:
+        sys.exit('cannot load the node registry: ' + str(e))
+    nodes = registry.find(args.key)
+    if not nodes:
+        print('no registered node matches', args.key, file=sys.stderr)
+        sys.exit(PROBE_EXIT_NOT_FOUND)
+    rpc = attach(args.geth_ipc)
+    t0 = time.monotonic()
+    results = probe_nodes(rpc, nodes, args)
+    rpc.close()
+    if args.json:
+        for node in nodes:
+            checks = results[node['id']]
+            print(json.dumps({'id': node['id'], 'owner': node['owner'], 'type': node['type'], 'ip': node['ip'],
+                    'ok': all(ok is not False for (check, ok, detail) in checks),
+                    'checks': {check: {'ok': ok, 'detail': detail} for (check, ok, detail) in checks}}, ensure_ascii=False))
     else:
-        core_id = '--'
-        check_in_status_display = '❓'  # 缺失 coreId，显示为未知状态
-        if node['owner'] not in no_kyc_list:
-            no_kyc_list.append(node['owner'])
-
-    core_id_display = f'J-{core_id}'
-    owner_display = f'"{node["owner"]}"'
-    print(node['type'], node['since'], node['ip'], enode_connected, node['status'], node_activity, node_liveness, core_id_display, owner_display, check_in_status_display)
-
-## reporting miner status first
-for (id, node) in all_nodes.items():
-    if node['type'] == 'miner':
-        report(node)
-
-## reporting this audit node
-# report(all_nodes[audit_node_id])
-
-## reporting miner*
-for (id, node) in all_nodes.items():
-    if node['type'] == 'miner*':
-        report(node)
-
-## reporting witness alive
-for (id, node) in all_nodes.items():
-    if (node['type'] == 'witness' or node['type'] == 'witness(a)') and node['block_height'] > 0:
-        report(node)
-
-## reporting witness suspicious to not alive anymore
-for (id, node) in all_nodes.items():
-    if node['type'] == 'witness' and node['block_height'] == 0:
-        report(node)
-
-
-if no_check_in_list or no_kyc_list:
-    print('---------------- notice -----------------')
-
-    if no_check_in_list:
-        print("❌ NO CHECK-IN:", ','.join(no_check_in_list))
-
-    if no_kyc_list:
-        print("❓ NO KYC:", ','.join(no_kyc_list))
-
-
-
-
-
-
-
-
+        print_probe(nodes, results)
+        print('(%.2fs)' % (time.monotonic() - t0))
+    failed = any(ok is False for checks in results.values() for (check, ok, detail) in checks)
+    sys.exit(PROBE_EXIT_FAILED if failed else PROBE_EXIT_OK)
+
+## streaming watchdog, signers named after their owners in the registry
+def watchdog(args):
+    alerter = audit_watch.Alerter(args.alert_webhook, args.alert_file)
+    return audit_watch.Watchdog(args.geth_ipc, alerter, signer_names(), missed_turns=args.missed_turns,
+            stall_seconds=args.stall_seconds)
+
+## lc(signer address) -> owner of the registered miners
+def signer_names():
+    return {signer: node['owner'] for (signer, node) in core_nodes.by_signer.items() if node['type'] == 'miner'}
+
+## the registered witnesses but the audit node itself
+def propagation_witnesses(audit_node_id):
+    return [node for node in core_nodes if node['type'] == 'witness' and node['id'] != audit_node_id]
+
+## block propagation meter over those witnesses
+def propagation_meter(rpc, args):
+    witnesses = propagation_witnesses(rpc.call('admin_nodeInfo')['id'])
+    return audit_propagation.PropagationMeter(witnesses, interval=args.propagation_interval,
+            connect_timeout=args.probe_connect_timeout, read_timeout=args.probe_read_timeout,
+            backend=args.backend, path=args.propagation_file if args.daemon else None, port=args.rpc_port)
+
+def main():
+    global core_nodes, publish_config
+    if sys.argv[1:2] == ['probe']:
+        probe_main(sys.argv[2:])
+    args = parse_args()
+    if args.publish:
+        try:
+            publish_config = audit_publish.load_config(args.publish)
+        except (OSError, ValueError, audit_publish.PublishError) as e:
+            sys.exit('cannot load the publish config: ' + str(e))
+    if args.networks:
+        audit_trace.enable(args.trace or bool(args.trace_file))
+        try:
+            networks = load_networks(args)
+            registries = [audit_registry.load(network.registry) for network in networks]
+        except (OSError, ValueError) as e: # RegistryError is a ValueError
+            sys.exit('cannot load the networks: ' + str(e))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out): # the sections of all networks, as one report
+            failed = audit_networks(networks, registries)
+        print(out.getvalue(), end='', flush=True)
+        failed += publish(out.getvalue())
+        sys.exit(1 if failed else 0)
+    try:
+        core_nodes = audit_registry.load(args.registry)
+    except (OSError, audit_registry.RegistryError) as e:
+        sys.exit('cannot load the node registry: ' + str(e))
+    audit_trace.enable(args.trace or bool(args.trace_file))
+    if args.record:
+        audit_cassette.record(args.record)
+    elif args.replay:
+        audit_cassette.replay(args.replay)
+    rpc = attach(args.geth_ipc, args.backend)
+    if args.watch and not args.daemon:
+        watchdog(args).run()
+    elif args.daemon:
+        watch = None
+        if args.watch:
+            watch = watchdog(args)
+            threading.Thread(target=watch.run, name='watch', daemon=True).start()
+        meter = None
+        if args.propagation:
+            meter = propagation_meter(rpc, args)
+            threading.Thread(target=meter.run, args=(args.geth_ipc,), name='propagation', daemon=True).start()
+        run_daemon(rpc, args, meter, watch)
+    elif args.propagation:
+        meter = propagation_meter(rpc, args)
+        stop = threading.Event()
+        threading.Thread(target=meter.run, args=(args.geth_ipc, stop), name='propagation', daemon=True).start()
+        time.sleep(args.propagation_duration)
+        stop.set()
+        names = {node['id']: (node['ip'], node['owner']) for node in core_nodes}
+        audit_propagation.print_stats(meter.stats(), names)
+        rpc.close()
+    elif args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(audit_and_report, rpc, args)
+        finally:
+            audit_cassette.save()
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+        rpc.close()
+    else:
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out if publish_config else sys.stdout):
+                audit_and_report(rpc, args)
+        finally:
+            print(out.getvalue(), end='', flush=True)
+            audit_cassette.save() # also the traffic of a failed run, to debug it
+        rpc.close()
+        if publish(out.getvalue()):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+# Concurrent rpc probes for witness nodes.
+#
+# Every witness is probed in parallel on a bounded thread pool. Each probe has its own
+# connect/read timeouts, and the whole fan-out has a global budget, so one blackholed
+# host can no longer stall the audit run.
+#
+# A probe is a single json-rpc batch: head, sync state, peer count, and the block at a reference
+# height a little behind the audit node's head. Its hash is compared with the canonical one of
+# the audit node, so a witness stuck on a fork at the right height is caught too.
+#
+# The pool and the per-witness rpc clients (with their keep-alive connections) are kept at
+# module level and reused by every run of a long running daemon.
+#
+# Witnesses dead for weeks would cost a full probe every run, so each has a circuit breaker:
+# after BREAKER_FAILURES failed probes in a row it opens, and the witness is not probed until
+# its backoff is over (2h, doubling up to a day). Then it gets one cheap half-open probe, a
+# single eth_blockNumber with short timeouts: if that answers the breaker closes and the full
+# probe runs right away, else it opens again for twice as long. Results of witnesses not
+# probed in a run say so (outcome 'backoff').
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import audit_cassette
+from jsonrpc import HTTPClient, Web3Client, RPCTimeout, RPCConnectionError, unwrap
+
+## probe outcomes
+PROBE_OK = 'ok'
+PROBE_TIMEOUT = 'timeout'
+PROBE_REFUSED = 'refused'
+PROBE_BAD_RESPONSE = 'bad response'
+PROBE_BACKOFF = 'backoff' # not probed this run, its circuit breaker is open
+
+PROBE_OUTCOMES = [PROBE_OK, PROBE_TIMEOUT, PROBE_REFUSED, PROBE_BAD_RESPONSE, PROBE_BACKOFF]
+
+RPC_PORT = 8501
+
+## blocks behind the audit node's head for the fork check. deep enough to be final, and within
+## the lag a valid witness is allowed (less than 10 blocks), so that a valid witness has the block.
+REFERENCE_DEPTH = 10
+
+BREAKER_FAILURES = 3
+BREAKER_MIN = 7200
+BREAKER_MAX = 86400
+HALF_OPEN_CONNECT_TIMEOUT = 1.0
+HALF_OPEN_READ_TIMEOUT = 2.0
+
+_lock = threading.Lock()
+_pool = None
+_pool_workers = 0
+_clients = {} # (backend, ip, port, timeouts) -> rpc client
+
+def get_pool(workers):
+    global _pool, _pool_workers
+    with _lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='probe')
+            _pool_workers = workers
+        return _pool
+
+def get_client(ip, port, connect_timeout, read_timeout, backend='raw'):
+    key = (backend, ip, port, connect_timeout, read_timeout)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            if backend == 'web3':
+                client = Web3Client.http(ip, port, connect_timeout, read_timeout)
+            else:
+                client = HTTPClient(ip, port, connect_timeout, read_timeout)
+            _clients[key] = client
+        return client
+
+## probe a single witness with one json-rpc batch on rpc 8501: its head, its hash at the
+## reference height (number, canonical hash) of the audit node, sync state and peer count.
+## a witness on a fork at the right height shows up as a hash mismatch.
+def probe_witness(ip, port=RPC_PORT, connect_timeout=3.0, read_timeout=5.0, backend='raw', reference=None):
+    client = get_client(ip, port, connect_timeout, read_timeout, backend)
+    calls = [('eth_blockNumber', []), ('eth_syncing', []), ('net_peerCount', [])]
+    if reference:
+        calls.append(('eth_getBlockByNumber', [hex(reference[0]), False]))
+
+    result = {'block_height': 0, 'fork': None, 'syncing': None, 'peer_count': None}
+    t0 = audit_cassette.monotonic()
+    try:
+        responses = client.batch(calls)
+        result['block_height'] = int(unwrap(responses[0], 'eth_blockNumber'), 16)
+        result['outcome'] = PROBE_OK
+    except RPCTimeout:
+        result['outcome'] = PROBE_TIMEOUT
+    except RPCConnectionError:
+        result['outcome'] = PROBE_REFUSED
+    except Exception:
+        result['outcome'] = PROBE_BAD_RESPONSE
+    result['latency'] = audit_cassette.monotonic() - t0
+
+    ## the rest is optional, e.g. the net api may not be exposed
+    if result['outcome'] == PROBE_OK:
+        (syncing, peer_count) = (responses[1], responses[2])
+        if syncing and 'result' in syncing:
+            result['syncing'] = bool(syncing['result'])
+        if peer_count and isinstance(peer_count.get('result'), str):
+            result['peer_count'] = int(peer_count['result'], 16)
+        if reference:
+            block = responses[3].get('result') if responses[3] else None
+            if block: # none if the witness is behind the reference height
+                result['fork'] = block['hash'] != reference[1]
+    return result
+
+## circuit breakers: node id -> {'failures', 'backoff', 'open_until'}, witnesses probing fine have none
+
+_breakers = {} # network name -> breakers, without a state file, e.g. in daemon mode, kept in memory
+
+def load_breakers(path, network=None):
+    if not path:
+        return _breakers.setdefault(network, {})
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_breakers(path, breakers):
+    if not path:
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(breakers, f)
+    os.replace(tmp, path)
+
+def record_probe(breakers, node_id, ok, now):
+    if ok:
+        breakers.pop(node_id, None)
+        return
+    entry = breakers.setdefault(node_id, {'failures': 0, 'backoff': 0, 'open_until': 0})
+    entry['failures'] += 1
+    if entry['failures'] >= BREAKER_FAILURES:
+        entry['backoff'] = min(BREAKER_MAX, entry['backoff'] * 2 or BREAKER_MIN)
+        entry['open_until'] = now + entry['backoff']
+
+## half-open: a single eth_blockNumber with short timeouts, the full probe only if that answers
+def probe_half_open(ip, port=RPC_PORT, connect_timeout=3.0, read_timeout=5.0, backend='raw', reference=None):
+    client = get_client(ip, port, min(connect_timeout, HALF_OPEN_CONNECT_TIMEOUT), min(read_timeout, HALF_OPEN_READ_TIMEOUT), backend)
+    t0 = audit_cassette.monotonic()
+    try:
+        int(client.call('eth_blockNumber'), 16)
+    except Exception as e:
+        outcome = PROBE_TIMEOUT if isinstance(e, RPCTimeout) else PROBE_REFUSED if isinstance(e, RPCConnectionError) else PROBE_BAD_RESPONSE
+        return {'outcome': outcome, 'block_height': 0, 'latency': audit_cassette.monotonic() - t0,
+                'fork': None, 'syncing': None, 'peer_count': None}
+    return probe_witness(ip, port, connect_timeout, read_timeout, backend, reference)
+
+## probe all witnesses concurrently. returns results indexed by node id.
+## probes still running when the budget is used up are recorded as timeout.
+## with breakers, witnesses whose breaker is open are not probed, and the breakers are updated.
+def probe_witnesses(nodes, workers=32, connect_timeout=3.0, read_timeout=5.0, budget=30.0, backend='raw', reference=None,
+        breakers=None, now=None, port=None):
+    results = {}
+    if not nodes:
+        return results
+
+    t0 = audit_cassette.monotonic()
+    port = port or RPC_PORT
+    pool = get_pool(workers)
+    futures = {}
+    for node in nodes:
+        entry = (breakers or {}).get(node['id'])
+        if entry and entry['open_until'] > now:
+            results[node['id']] = {
+                    'outcome': PROBE_BACKOFF,
+                    'block_height': 0,
+                    'latency': None,
+                    'fork': None,
+                    'syncing': None,
+                    'peer_count': None,
+                    'retry_at': entry['open_until'],
+                    }
+            continue
+        probe = probe_half_open if entry and entry['failures'] >= BREAKER_FAILURES else probe_witness
+        f = pool.submit(probe, node['ip'], port, connect_timeout, read_timeout, backend, reference)
+        futures[f] = node['id']
+
+    done, not_done = wait(futures, timeout=budget)
+    for f in done:
+        results[futures[f]] = f.result()
+    for f in not_done:
+        f.cancel() # don't wait for stragglers, running ones are bounded by their own socket timeouts anyway
+        results[futures[f]] = {
+                'outcome': PROBE_TIMEOUT,
+                'block_height': 0,
+                'latency': audit_cassette.monotonic() - t0,
+                'fork': None,
+                'syncing': None,
+                'peer_count': None,
+                }
+
+    if breakers is not None:
+        for node_id in futures.values():
+            record_probe(breakers, node_id, results[node_id]['outcome'] == PROBE_OK, now)
+    return results
+
+## e.g. '38 ok, 2 timeout, 1 refused, 0 bad response, 5 backoff', then forked / syncing / no peers if any
+def summarize(results):
+    counts = dict.fromkeys(PROBE_OUTCOMES, 0)
+    for r in results.values():
+        counts[r['outcome']] += 1
+    summary = ', '.join(str(counts[o]) + ' ' + o for o in PROBE_OUTCOMES)
+    flags = {
+            'forked': sum(1 for r in results.values() if r.get('fork')),
+            'syncing': sum(1 for r in results.values() if r.get('syncing')),
+            'no peers': sum(1 for r in results.values() if r.get('peer_count') == 0),
+            }
+    if any(flags.values()):
+        summary += ', ' + ', '.join('%d %s' % (n, flag) for (flag, n) in flags.items() if n)
+    return summary
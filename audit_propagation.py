@@ -0,0 +1,284 @@
+# Block propagation lag from the audit node to every witness.
+#
+# The witness probe tells whether a witness is within 10 blocks of the audit node, not how fast
+# new blocks get to it. The meter follows the new heads of the audit node (newHeads on geth.ipc),
+# and on every head polls eth_blockNumber of all witnesses concurrently every interval, until
+# each of them reports that height or max_lag is over. The lag of a witness is the time from the
+# audit node seeing the head to the witness first reporting it, taken at the middle of the round
+# trip of that poll, so it is as precise as the poll interval. There is at most one poller per
+# witness: a head arriving while a witness is still polled for earlier ones is simply added to
+# its pending heads.
+#
+# Lags are kept in one float array per witness, aligned with the array of heads, NaN where the
+# witness never reported the head in time, for the latest 24h. Percentiles are computed over
+# all arrays at once, with numpy if it is installed.
+#
+# Usage:
+# $ python3 audit_propagation.py ~/data/mainnet/geth.ipc 1.2.3.4 5.6.7.8 [--duration 600] [--interval 0.2] [--port 8501]
+
+import argparse
+import array
+import base64
+import bisect
+import json
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import audit_probe
+from jsonrpc import HTTPClient, Web3Client, IPCSubscription, RPCError
+
+WINDOW = 86400
+MAX_LAG = 30.0 # seconds, a witness not reporting a head by then missed it
+PERCENTILES = [50, 95, 99]
+
+NAN = float('nan')
+
+## p-th percentile of sorted values, interpolated linearly like numpy does by default
+def _percentile(values, p):
+    k = (len(values) - 1) * p / 100
+    f = math.floor(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+class PropagationMeter:
+    def __init__(self, witnesses, interval=0.2, max_lag=MAX_LAG, window=WINDOW, connect_timeout=3.0, read_timeout=5.0,
+            backend='raw', path=None, port=audit_probe.RPC_PORT):
+        self.interval = interval
+        self.port = port # rpc port of the witnesses
+        self.max_lag = max_lag
+        self.window = window
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.backend = backend
+        self.ips = {node['id']: node['ip'] for node in witnesses}
+        self.clients = {node_id: self._client(ip) for (node_id, ip) in self.ips.items()}
+        # one poller per witness at most, so polls never queue behind each other
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.ips)), thread_name_prefix='propagation')
+
+        self.base = 0 # absolute index of the first head kept
+        self.numbers = array.array('q') # heads of the audit node
+        self.times = array.array('d')   # unix time the audit node saw each head
+        self.lags = {node_id: array.array('d') for node_id in self.ips} # seconds, aligned with the heads
+        self._pending = {node_id: {} for node_id in self.ips} # number -> (absolute index, monotonic time seen)
+        self._busy = set()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _client(self, ip):
+        if self.backend == 'web3':
+            return Web3Client.http(ip, self.port, self.connect_timeout, self.read_timeout)
+        return HTTPClient(ip, self.port, self.connect_timeout, self.read_timeout)
+
+    ## the registry changed: measure new witnesses from the next head on, forget removed ones
+    def update_witnesses(self, witnesses):
+        ips = {node['id']: node['ip'] for node in witnesses}
+        with self._lock:
+            for node_id in set(self.ips) - set(ips):
+                del self.lags[node_id]
+                del self._pending[node_id]
+                del self.clients[node_id]
+            for (node_id, ip) in ips.items():
+                if node_id not in self.lags:
+                    self.lags[node_id] = array.array('d', [NAN]) * len(self.numbers)
+                    self._pending[node_id] = {}
+                if self.ips.get(node_id) != ip:
+                    self.clients[node_id] = self._client(ip)
+            grown = len(ips) > len(self.ips)
+            self.ips = ips
+        if grown:
+            old = self.pool
+            self.pool = ThreadPoolExecutor(max_workers=len(ips), thread_name_prefix='propagation')
+            old.shutdown(wait=False) # pollers running on it finish there
+
+    def _load(self):
+        with open(self.path) as f:
+            saved = json.load(f)
+        self.numbers = array.array('q', base64.b64decode(saved['numbers']))
+        self.times = array.array('d', base64.b64decode(saved['times']))
+        for (node_id, lags) in saved['lags'].items():
+            if node_id in self.lags:
+                self.lags[node_id] = array.array('d', base64.b64decode(lags))
+        for lags in self.lags.values(): # witnesses registered since
+            if len(lags) != len(self.numbers):
+                lags[:] = array.array('d', [NAN]) * len(self.numbers)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            saved = {
+                    'numbers': base64.b64encode(self.numbers.tobytes()).decode(),
+                    'times': base64.b64encode(self.times.tobytes()).decode(),
+                    'lags': {node_id: base64.b64encode(lags.tobytes()).decode() for (node_id, lags) in self.lags.items()},
+                    }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp, self.path)
+
+    ## drop heads older than the window, with the lags measured for them
+    def _trim(self, now):
+        k = bisect.bisect_left(self.times, now - self.window)
+        if k:
+            del self.numbers[:k]
+            del self.times[:k]
+            for lags in self.lags.values():
+                del lags[:k]
+            self.base += k
+
+    ## a new head of the audit node, seen at monotonic time t and unix time ts
+    def on_head(self, head, t, ts):
+        number = int(head['number'], 16)
+        start = []
+        with self._lock:
+            if self.numbers and number <= self.numbers[-1]:
+                return # reorg to a sibling, that height is measured already
+            self._trim(ts)
+            index = self.base + len(self.numbers)
+            self.numbers.append(number)
+            self.times.append(ts)
+            for (node_id, lags) in self.lags.items():
+                lags.append(NAN)
+                self._pending[node_id][number] = (index, t)
+                if node_id not in self._busy:
+                    self._busy.add(node_id)
+                    start.append(node_id)
+        for node_id in start:
+            self.pool.submit(self._poll, node_id)
+
+    ## poll one witness until it reported all its pending heads, or they are given up on
+    def _poll(self, node_id):
+        with self._lock:
+            client = self.clients.get(node_id)
+            pending = self._pending.get(node_id)
+        while True:
+            with self._lock:
+                if pending is None or self._pending.get(node_id) is not pending:
+                    self._busy.discard(node_id)
+                    return # removed from the registry meanwhile
+                now = time.monotonic()
+                for (number, (index, t)) in list(pending.items()):
+                    if now - t > self.max_lag:
+                        del pending[number] # missed, stays NaN
+                if not pending:
+                    self._busy.discard(node_id)
+                    return
+            t1 = time.monotonic()
+            try:
+                height = int(client.call('eth_blockNumber'), 16)
+            except (RPCError, ValueError, TypeError):
+                # down, no point in polling it again before the next head
+                with self._lock:
+                    pending.clear()
+                    self._busy.discard(node_id)
+                return
+            t2 = time.monotonic()
+            seen = (t1 + t2) / 2
+            with self._lock:
+                lags = self.lags.get(node_id)
+                for (number, (index, t)) in list(pending.items()):
+                    if number <= height:
+                        del pending[number]
+                        if lags is not None and index >= self.base:
+                            lags[index - self.base] = max(0.0, seen - t)
+            time.sleep(max(0, self.interval - (t2 - t1)))
+
+    ## per witness over the window: heads, heads seen in time, and the lag percentiles (seconds,
+    ## None if no head was seen). heads younger than max_lag may still be polled, so left out.
+    def stats(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            first = bisect.bisect_left(self.times, now - self.window)
+            n = max(0, bisect.bisect_left(self.times, now - self.max_lag) - first)
+            node_ids = list(self.lags)
+            rows = [self.lags[node_id][first:first + n] for node_id in node_ids] # copies, the arrays keep growing
+
+        if numpy is not None and rows and n:
+            matrix = numpy.array([numpy.frombuffer(row, dtype=numpy.float64) for row in rows]).reshape(len(rows), n)
+            seen = numpy.count_nonzero(~numpy.isnan(matrix), axis=1)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning) # all-NaN rows
+                quantiles = numpy.nanpercentile(matrix, PERCENTILES, axis=1)
+            return {node_id: {
+                        'heads': n,
+                        'seen': int(seen[i]),
+                        'percentiles': [None if math.isnan(q) else float(q) for q in quantiles[:, i]],
+                        } for (i, node_id) in enumerate(node_ids)}
+
+        result = {}
+        for (node_id, row) in zip(node_ids, rows):
+            values = sorted(x for x in row if not math.isnan(x))
+            result[node_id] = {
+                    'heads': n,
+                    'seen': len(values),
+                    'percentiles': [_percentile(values, p) if values else None for p in PERCENTILES],
+                    }
+        return result
+
+    ## follow new heads until stop is set, resubscribing after errors (e.g. geth restarting)
+    def run(self, geth_ipc, stop=None, save_every=100):
+        stop = stop or threading.Event()
+        heads = 0
+        while not stop.is_set():
+            try:
+                for head in IPCSubscription(geth_ipc, 'newHeads', timeout=1.0):
+                    if stop.is_set():
+                        break
+                    if head is None:
+                        continue
+                    self.on_head(head, time.monotonic(), time.time())
+                    heads += 1
+                    if heads % save_every == 0:
+                        self.save()
+            except RPCError:
+                traceback.print_exc()
+                sys.stderr.flush()
+                stop.wait(5)
+        self.save()
+
+## one line per witness, slowest p95 first. names: node id -> (ip, owner)
+def print_stats(stats, names):
+    def key(item):
+        p95 = item[1]['percentiles'][1]
+        return (p95 is None, -(p95 or 0))
+
+    print('IP', 'OWNER', 'HEADS', 'SEEN', *['P%d' % p for p in PERCENTILES])
+    for (node_id, s) in sorted(stats.items(), key=key):
+        (ip, owner) = names.get(node_id, (node_id, ''))
+        print(ip, f'"{owner}"', s['heads'], s['seen'], *['%.2fs' % q if q is not None else '--' for q in s['percentiles']])
+
+def main():
+    parser = argparse.ArgumentParser('audit_propagation')
+    parser.add_argument('geth_ipc', help='path to geth.ipc file to be attached to')
+    parser.add_argument('witness', nargs='+', help='ips of the witnesses to measure')
+    parser.add_argument('--duration', type=float, default=600, help='seconds to measure for')
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between two polls of a witness')
+    parser.add_argument('--max-lag', type=float, default=MAX_LAG, help='seconds after which a witness missed a head')
+    parser.add_argument('--port', type=int, default=audit_probe.RPC_PORT, help='rpc port of the witnesses')
+    parser.add_argument('--backend', choices=['raw', 'web3'], default='raw', help='json-rpc transport')
+    args = parser.parse_args()
+
+    witnesses = [{'id': ip, 'ip': ip} for ip in args.witness]
+    meter = PropagationMeter(witnesses, interval=args.interval, max_lag=args.max_lag, backend=args.backend, port=args.port)
+    stop = threading.Event()
+    threading.Thread(target=meter.run, args=(args.geth_ipc, stop), daemon=True).start()
+    time.sleep(args.duration)
+    stop.set()
+    # heads of the last max_lag seconds are left out of the stats
+    print_stats(meter.stats(), {ip: (ip, '') for ip in args.witness})
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+# Publish stage of the daily report: file, mail and git sinks, instead of a shell pipeline.
+#
+# The cron line used to pipe the report through tee, mail (one message to the whole list) and
+# sed, then git pull/add/commit/push, one process after another: a hanging mail or git lost the
+# report with no retry. Here the report text is delivered to all sinks of a json config at once,
+# each on its own thread with its own timeout and a few retries. Sinks:
+#   - file: write the text to a path
+#   - smtp: one connection, the recipients sent to in batches (one message per batch)
+#   - git:  write the text to a file of a local clone, commit, and pull --rebase / push if wanted
+# IPs are redacted in memory for the sinks with "redact" (git by default), the middle two
+# octets masked like the sed of the cron line did. A delivery still failing after its retries
+# is written to the spool directory, and retried before the next report is published; for
+# smtp only the batches that failed are spooled. The deliveries to one sink, spooled ones first,
+# are made one after the other, so they never race on its file or repo. A newer report
+# supersedes the spooled ones of a file or git sink: the file gets the newest only, and spooled
+# git reports still failing are dropped once a newer one is committed.
+#
+# Config:
+# {
+#   "subject": "jouleverse network audit report - {date}",
+#   "spool": "/home/lighthouse/data/spool",
+#   "sinks": [
+#     {"type": "file", "path": "/home/lighthouse/data/daily-report.txt"},
+#     {"type": "smtp", "host": "localhost", "port": 25, "from": "audit@example.com", "to": ["a@example.com", "b@example.com"]},
+#     {"type": "git", "repo": "/home/lighthouse/network-status", "path": "daily-report.txt", "push": true}
+#   ]
+# }
+# Optional per sink: name, redact, timeout (seconds, default 60), retries (default 3); smtp:
+# batch (recipients per message, default 50), starttls, user and password_file; git: message,
+# pull and push (default false).
+#
+# Usage:
+# $ python3 audit_network.py ~/data/mainnet/geth.ipc --publish publish.json
+# $ python3 audit_publish.py send publish.json report.txt
+# $ python3 audit_publish.py retry publish.json
+# $ python3 audit_publish.py fake-smtp --port 8025 --dir /tmp/mails [--fail 2] [--fail-data 1] [--drop 1]
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import smtplib
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from email.message import EmailMessage
+
+SINK_TYPES = ['file', 'smtp', 'git']
+TIMEOUT = 60
+RETRIES = 3
+RETRY_DELAY = 2 # seconds, doubling after every failed attempt
+SMTP_BATCH = 50
+SUBJECT = 'jouleverse network audit report - {date}'
+
+## 1.23.45.67 -> 1.*.*.67, like sed -r 's/\.[0-9]+\.[0-9]+\./.*.*./g'
+IP_MIDDLE = re.compile(r'\.[0-9]+\.[0-9]+\.')
+
+def redact(text):
+    return IP_MIDDLE.sub('.*.*.', text)
+
+class PublishError(Exception):
+    pass
+
+def load_config(path):
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    for (i, sink) in enumerate(config.get('sinks', [])):
+        if sink.get('type') not in SINK_TYPES:
+            raise PublishError('sink %d: type is not one of %s' % (i, ', '.join(SINK_TYPES)))
+        missing = [k for k in {'file': ['path'], 'smtp': ['host', 'from', 'to'], 'git': ['repo', 'path']}[sink['type']] if not sink.get(k)]
+        if missing:
+            raise PublishError('sink %d: missing %s' % (i, ', '.join(missing)))
+        same_type = [s for s in config['sinks'][:i] if s['type'] == sink['type']]
+        sink.setdefault('name', sink['type'] + ('-%d' % (len(same_type) + 1) if same_type else ''))
+    return config
+
+## sinks, each delivering text once or raising. returns the part not delivered for a partial
+## failure (the recipients of the smtp batches that failed), None when all of it was.
+
+def deliver_file(sink, subject, text):
+    path = os.path.expanduser(sink['path'])
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def deliver_smtp(sink, subject, text):
+    recipients = sink['to']
+    batch = sink.get('batch', SMTP_BATCH)
+    failed = []
+    errors = []
+    with smtplib.SMTP(sink['host'], sink.get('port', 25), timeout=sink.get('timeout', TIMEOUT)) as smtp:
+        if sink.get('starttls'):
+            smtp.starttls()
+        if sink.get('user'):
+            with open(os.path.expanduser(sink['password_file'])) as f:
+                smtp.login(sink['user'], f.read().strip())
+        for i in range(0, len(recipients), batch):
+            to = recipients[i:i + batch]
+            msg = EmailMessage()
+            msg['Subject'] = subject
+            msg['From'] = sink['from']
+            msg['To'] = ', '.join(to)
+            msg.set_content(text)
+            try:
+                refused = smtp.send_message(msg, to_addrs=to)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                failed += to
+                errors.append(str(e))
+                with contextlib.suppress(OSError): # if the connection is gone, the next batch finds out
+                    smtp.rset()
+                continue
+            except OSError as e: # disconnected partway: this batch and the ones after it are not sent
+                failed += recipients[i:]
+                errors.append(str(e) or type(e).__name__)
+                break
+            for (addr, (code, reason)) in refused.items():
+                print('publish %s: recipient refused: %s %d %s' % (sink['name'], addr, code, reason), file=sys.stderr, flush=True)
+    if failed:
+        if len(failed) == len(recipients):
+            raise PublishError('; '.join(errors))
+        return dict(sink, to=failed)
+    return None
+
+def _git(repo, *args, timeout=TIMEOUT):
+    result = subprocess.run(['git', '-C', repo] + list(args), capture_output=True, text=True, timeout=timeout,
+            stdin=subprocess.DEVNULL, env=dict(os.environ, GIT_TERMINAL_PROMPT='0'))
+    if result.returncode != 0:
+        raise PublishError('git %s: %s' % (args[0], (result.stderr or result.stdout).strip()))
+    return result.stdout
+
+def deliver_git(sink, subject, text):
+    repo = os.path.expanduser(sink['repo'])
+    timeout = sink.get('timeout', TIMEOUT)
+    deliver_file({'path': os.path.join(repo, sink['path'])}, subject, text)
+    _git(repo, 'add', '--', sink['path'], timeout=timeout)
+    if _git(repo, 'status', '--porcelain', '--', sink['path'], timeout=timeout).strip():
+        _git(repo, 'commit', '-q', '-m', sink.get('message', subject), '--', sink['path'], timeout=timeout)
+    if sink.get('pull'):
+        _git(repo, 'pull', '-q', '--rebase', timeout=timeout)
+    if sink.get('push'):
+        _git(repo, 'push', '-q', timeout=timeout)
+
+DELIVER = {'file': deliver_file, 'smtp': deliver_smtp, 'git': deliver_git}
+
+## deliver with retries. returns None if delivered, else the part not delivered and the last error
+def deliver(sink, subject, text):
+    retries = sink.get('retries', RETRIES)
+    if sink.get('redact', sink['type'] == 'git'):
+        text = redact(text)
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+        try:
+            left = DELIVER[sink['type']](sink, subject, text)
+        except (OSError, smtplib.SMTPException, subprocess.SubprocessError, PublishError) as e:
+            error = '%s: %s' % (type(e).__name__, e)
+            continue
+        if left is None:
+            return None
+        (sink, error) = (left, 'not delivered to part of it') # retry the part that failed
+    return (sink, error)
+
+## a spooled delivery not made because a newer one to the same file or git sink was
+SUPERSEDED = 'superseded'
+
+## deliver the jobs (sink, subject, text, spool file) of one sink one after the other, oldest
+## first. returns the result of each: None if delivered, SUPERSEDED, or what deliver() returned.
+def deliver_all(jobs):
+    results = []
+    for (i, (sink, subject, text, path)) in enumerate(jobs):
+        if sink['type'] == 'file' and i < len(jobs) - 1:
+            results.append(SUPERSEDED) # overwritten by the next one anyway
+            continue
+        results.append(deliver(sink, subject, text))
+        if results[-1] is None and sink['type'] in ['file', 'git']:
+            results[:-1] = [None if r is None else SUPERSEDED for r in results[:-1]]
+    return results
+
+## spool: one json file per delivery that failed, {'sink', 'subject', 'text', 'created'}
+
+def spool(directory, sink, subject, text):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '%d-%s-%d.json' % (time.time() * 1000, sink['name'], threading.get_ident()))
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'sink': sink, 'subject': subject, 'text': text, 'created': int(time.time())}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+def spooled(directory):
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.json'))
+
+## deliver text to all sinks of the config at once, after what is in the spool for each. every
+## sink gets its timeout and retries, what still fails is spooled. returns the number of failures.
+## the text is spooled unredacted, so that it is redacted as its sink says when retried.
+def publish(config, text=None, subject=None):
+    directory = os.path.expanduser(config['spool']) if config.get('spool') else None
+    queues = {} # sink name -> jobs (sink, subject, text, spool file), oldest first
+    for path in spooled(directory):
+        with open(path, encoding='utf-8') as f:
+            entry = json.load(f)
+        queues.setdefault(entry['sink']['name'], []).append((entry['sink'], entry['subject'], entry['text'], path))
+    if text is not None:
+        subject = subject or config.get('subject', SUBJECT).format(date=datetime.now().strftime('%Y%m%d'))
+        for sink in config['sinks']:
+            queues.setdefault(sink['name'], []).append((sink, subject, text, None))
+    if not queues:
+        return 0
+
+    failed = 0
+    pool = ThreadPoolExecutor(max_workers=len(queues), thread_name_prefix='publish')
+    futures = {pool.submit(deliver_all, jobs): jobs for jobs in queues.values()}
+    # a sink stuck past all its attempts counts as failed. its thread is left to end on its own
+    deadline = max(sum((sink.get('timeout', TIMEOUT) + RETRY_DELAY) * (sink.get('retries', RETRIES) + 1) * 2 for (sink, s, t, p) in jobs)
+            for jobs in queues.values())
+    done, not_done = wait(futures, timeout=deadline)
+    pool.shutdown(wait=False)
+    results = []
+    for (f, jobs) in futures.items():
+        results += zip(jobs, f.result() if f in done else [(sink, 'timed out') for (sink, s, t, p) in jobs])
+    for ((sink, subject, text, path), result) in results:
+        if result == SUPERSEDED:
+            print('spooled report for %s dropped, a newer one was published' % sink['name'], flush=True)
+            os.unlink(path)
+            continue
+        if result is None:
+            print('published to', sink['name'] + (' (spooled)' if path else ''), flush=True)
+            if path:
+                os.unlink(path)
+            continue
+        failed += 1
+        (left, error) = result
+        if path: # keep it, with what is left of it
+            if left is not sink:
+                spool(directory, left, subject, text)
+                os.unlink(path)
+            print('publish to %s failed again, kept in the spool: %s' % (sink['name'], error), file=sys.stderr, flush=True)
+        elif directory:
+            print('publish to %s failed, spooled to %s: %s' % (sink['name'], spool(directory, left, subject, text), error), file=sys.stderr, flush=True)
+        else:
+            print('publish to %s failed: %s' % (sink['name'], error), file=sys.stderr, flush=True)
+    return failed
+
+## local stand-in smtp server for dry runs: accepts everything and writes each message to a
+## file of the directory. the first `fail` connections are turned away with 421, and the first
+## `fail_data` messages with 451, e.g. to fail one batch of a delivery. the connection the
+## `drop`th message comes in on is closed right after it, e.g. to cut a delivery partway.
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            turn_away = server.connections <= server.fail
+        if turn_away:
+            self.reply('421 try again later')
+            return
+        self.reply('220 fake-smtp ready')
+        (mail_from, rcpt) = (None, [])
+        while True:
+            line = self.rfile.readline().decode('utf-8', 'replace').rstrip('\r\n')
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in ['EHLO', 'HELO']:
+                self.reply('250 fake-smtp')
+            elif command == 'MAIL':
+                (mail_from, rcpt) = (line[10:].strip(), [])
+                self.reply('250 ok')
+            elif command == 'RCPT':
+                rcpt.append(line[8:].strip().strip('<>'))
+                self.reply('250 ok')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                data = []
+                while True:
+                    l = self.rfile.readline().decode('utf-8', 'replace')
+                    if l.rstrip('\r\n') == '.' or not l:
+                        break
+                    data.append(l[1:] if l.startswith('..') else l)
+                with server.lock:
+                    server.data += 1
+                    refuse = server.data <= server.fail_data
+                if refuse:
+                    self.reply('451 try again later')
+                    continue
+                with server.lock:
+                    server.messages += 1
+                    path = os.path.join(server.directory, 'mail-%d.json' % server.messages)
+                    drop = server.messages == server.drop
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump({'from': mail_from, 'to': rcpt, 'data': ''.join(data)}, f, ensure_ascii=False)
+                self.reply('250 queued')
+                if drop:
+                    return
+            elif command in ['RSET', 'NOOP']:
+                self.reply('250 ok')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+## a fake smtp server on (addr, port), port 0 for any free one, not serving yet
+def fake_smtp_server(addr, port, directory, fail=0, fail_data=0, drop=0):
+    os.makedirs(directory, exist_ok=True)
+    server = FakeSMTPServer((addr, port), FakeSMTPHandler)
+    server.directory = directory
+    server.fail = fail
+    server.fail_data = fail_data
+    server.drop = drop
+    server.connections = 0
+    server.data = 0
+    server.messages = 0
+    server.lock = threading.Lock()
+    return server
+
+def fake_smtp(args):
+    server = fake_smtp_server(args.addr, args.port, args.dir, args.fail, args.fail_data, args.drop)
+    print('fake smtp on port', args.port, 'writing to', args.dir, flush=True)
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser('audit_publish')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('send', help='publish a report to the sinks of a config, and retry the spool')
+    p.add_argument('config', help='publish config (json)')
+    p.add_argument('report', help='report text file, - for stdin')
+    p.add_argument('--subject', help='mail subject, default the one of the config')
+
+    p = subparsers.add_parser('retry', help='retry the deliveries in the spool')
+    p.add_argument('config', help='publish config (json)')
+
+    p = subparsers.add_parser('fake-smtp', help='local stand-in smtp server writing messages to a directory')
+    p.add_argument('--port', type=int, default=8025)
+    p.add_argument('--addr', default='127.0.0.1')
+    p.add_argument('--dir', required=True, help='directory to write the messages to')
+    p.add_argument('--fail', type=int, default=0, help='turn away this many connections first, with 421')
+    p.add_argument('--fail-data', type=int, default=0, help='refuse this many messages first, with 451')
+    p.add_argument('--drop', type=int, default=0, help='close the connection right after this many messages, once')
+
+    args = parser.parse_args()
+    if args.command == 'fake-smtp':
+        fake_smtp(args)
+        return
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError, PublishError) as e:
+        sys.exit('cannot load the publish config: ' + str(e))
+    if args.command == 'send':
+        if args.report == '-':
+            text = sys.stdin.read()
+        else:
+            with open(args.report, encoding='utf-8') as f:
+                text = f.read()
+        failed = publish(config, text, args.subject)
+    else:
+        failed = publish(config)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# Reachability of the devp2p endpoints of disconnected nodes, and add_peer with backoff.
+#
+# The enode of every disconnected node is checked with a tcp connect to its host:port, all
+# at once on the probe pool, optionally with a discv4 ping on its udp port as well. Only
+# reachable nodes are handed to admin_addPeer. An unreachable node is not checked again before
+# its backoff is over, which doubles with every consecutive failure (10 minutes .. 1 day).
+# The backoff state is kept in a small json file, so it also spans cron runs.
+#
+# Usage:
+# $ python3 audit_reach.py enode://...@1.2.3.4:30311 [--discv4]
+
+import argparse
+import ipaddress
+import json
+import os
+import socket
+import time
+from concurrent.futures import wait
+from urllib.parse import urlparse, parse_qs
+
+import audit_cassette
+import audit_probe
+import ethcrypto
+
+REACHABLE = 'reachable'
+UNREACHABLE = 'unreachable'
+BACKOFF = 'backoff'
+
+BACKOFF_MIN = 600
+BACKOFF_MAX = 86400
+
+## enode://<node id>@host:port[?discport=udp port] -> (node id, host, tcp port, udp port)
+def parse_enode(enode):
+    url = urlparse(enode)
+    if url.scheme != 'enode' or not url.username or not url.hostname:
+        raise ValueError('invalid enode', enode)
+    tcp_port = url.port or 30303
+    udp_port = int(parse_qs(url.query).get('discport', [tcp_port])[0])
+    return (url.username, url.hostname, tcp_port, udp_port)
+
+def tcp_check(host, port, timeout=3.0):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+## discv4
+
+PING = 1
+PONG = 2
+
+def _endpoint(host, udp_port, tcp_port):
+    return [ipaddress.ip_address(host).packed, udp_port, tcp_port]
+
+## hash || signature || packet type || rlp packet data
+def encode_packet(secret, packet_type, data):
+    payload = bytes([packet_type]) + ethcrypto.rlp_encode(data)
+    sig = ethcrypto.sign(ethcrypto.keccak256(payload), secret)
+    return ethcrypto.keccak256(sig + payload) + sig + payload
+
+## does host:udp_port answer a discv4 ping with a pong signed by node_id?
+def discv4_ping(node_id, host, udp_port, tcp_port, timeout=3.0, secret=None):
+    secret = secret or ethcrypto.new_private_key()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.bind(('', 0))
+        local_port = sock.getsockname()[1]
+        deadline = time.monotonic() + timeout
+        try:
+            ping = encode_packet(secret, PING, [4, _endpoint('0.0.0.0', local_port, 0), _endpoint(host, udp_port, tcp_port), int(time.time()) + 20])
+            sock.sendto(ping, (host, udp_port))
+            while time.monotonic() < deadline:
+                sock.settimeout(max(0.01, deadline - time.monotonic()))
+                (data, addr) = sock.recvfrom(1280)
+                # hash(32) sig(65) type(1) data, a pong carries the hash of the ping it answers
+                if len(data) < 98 or data[97] != PONG or ping[:32] not in data[98:]:
+                    continue # e.g. the ping the node sends back to check our endpoint
+                if ethcrypto.keccak256(data[32:]) != data[:32]:
+                    continue
+                pubkey = ethcrypto.recover_pubkey(ethcrypto.keccak256(data[97:]), data[32:97])
+                return pubkey.hex() == node_id.lower()
+        except (OSError, ValueError):
+            pass
+    return False
+
+## backoff state: node id -> {'failures', 'next_try', 'last_reachable'}
+
+_state = {} # network name -> state, without a state file, e.g. in daemon mode, kept in memory
+
+def load_state(path, network=None):
+    if not path:
+        return _state.setdefault(network, {})
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(path, state):
+    if not path:
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def in_backoff(state, node_id, now):
+    return state.get(node_id, {}).get('next_try', 0) > now
+
+def record_result(state, node_id, reachable, now):
+    entry = state.setdefault(node_id, {'failures': 0, 'next_try': 0})
+    if reachable:
+        entry.update(failures=0, next_try=0, last_reachable=now)
+    else:
+        entry['failures'] += 1
+        entry['next_try'] = now + min(BACKOFF_MAX, BACKOFF_MIN * 2 ** (entry['failures'] - 1))
+
+## check the enodes of nodes concurrently. returns node id -> {'reach', 'discv4'}, with reach
+## one of reachable / unreachable / backoff, and discv4 True/False (None if not pinged).
+def check_nodes(nodes, state, workers=32, timeout=3.0, discv4=False, now=None):
+    now = now or audit_cassette.now().timestamp()
+    results = {}
+    futures = {}
+    pool = audit_probe.get_pool(workers)
+    secret = ethcrypto.new_private_key() if discv4 else None
+
+    def check(node):
+        (node_id, host, tcp_port, udp_port) = parse_enode(node['enode'])
+        pong = discv4_ping(node_id, host, udp_port, tcp_port, timeout, secret) if discv4 else None
+        return (tcp_check(host, tcp_port, timeout), pong)
+
+    def recorded_check(node):
+        return audit_cassette.value(['reach', node['enode'], discv4], lambda: check(node))
+
+    for node in nodes:
+        if in_backoff(state, node['id'], now):
+            results[node['id']] = {'reach': BACKOFF, 'discv4': None}
+        else:
+            futures[pool.submit(recorded_check, node)] = node['id']
+
+    wait(futures)
+    for (f, node_id) in futures.items():
+        try:
+            (reachable, pong) = f.result()
+        except (ValueError, KeyError): # bad enode in the registry, or not in the cassette
+            (reachable, pong) = (False, None)
+        record_result(state, node_id, reachable, now)
+        results[node_id] = {'reach': REACHABLE if reachable else UNREACHABLE, 'discv4': pong}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser('audit_reach')
+    parser.add_argument('enode', nargs='+', help='enode urls to check')
+    parser.add_argument('--timeout', type=float, default=3.0, help='seconds to wait for a tcp connection or a pong')
+    parser.add_argument('--discv4', action='store_true', help='also send a discv4 ping')
+    args = parser.parse_args()
+
+    nodes = [{'id': parse_enode(e)[0], 'enode': e} for e in args.enode]
+    results = check_nodes(nodes, {}, timeout=args.timeout, discv4=args.discv4)
+    for node in nodes:
+        (node_id, host, tcp_port, udp_port) = parse_enode(node['enode'])
+        r = results[node['id']]
+        print(host + ':' + str(tcp_port), r['reach'], 'discv4 pong' if r['discv4'] else ('no discv4 pong' if args.discv4 else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# Registry of the core nodes of the network, kept in nodes.json next to the scripts.
+#
+# Onboarding a node is an edit of the data file, not of the script. The file is a json list of
+# nodes: owner, type (miner, miner* or witness), ip, id, enode, since, coreId (the maintainer's
+# JVCore token id, left out until there is one), signer (miners only) and an optional note.
+#
+# It is loaded into a Registry with indexes by node id, lowercase signer, coreId, owner and enode
+# host, and validated on load. Duplicate ids, signers or enodes, a node id that doesn't match
+# its enode, or a missing field are errors, and the file is not used. An enode host other than
+# the ip, or a node without coreId, is a warning. In daemon mode the file is reloaded when it
+# changes; an edit that doesn't validate is reported and the previous registry kept.
+#
+# A loaded registry is immutable: its nodes are read-only mappings, in a tuple. What a run finds
+# out about them is kept apart, see audit_status.
+#
+# Usage:
+# $ python3 audit_registry.py check nodes.json
+# $ python3 audit_registry.py show nodes.json <node id | enode | signer | coreId | owner | host>
+
+import argparse
+import json
+import os
+import re
+import sys
+from types import MappingProxyType
+
+import ethcrypto
+from audit_reach import parse_enode
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nodes.json')
+
+NODE_TYPES = ['miner', 'miner*', 'witness']
+REQUIRED = ['owner', 'type', 'ip', 'id', 'enode', 'since']
+
+class RegistryError(ValueError):
+    pass
+
+## errors and warnings of a list of nodes, as messages
+def validate(nodes):
+    errors = []
+    warnings = []
+    seen = {'id': {}, 'signer': {}, 'enode': {}}
+    for (i, node) in enumerate(nodes):
+        where = 'node %d (%s)' % (i, node.get('owner', '?'))
+        missing = [k for k in REQUIRED + (['signer'] if node.get('type') == 'miner' else []) if not node.get(k)]
+        if missing:
+            errors.append('%s: missing %s' % (where, ', '.join(missing)))
+            continue
+        if node['type'] not in NODE_TYPES:
+            errors.append('%s: unknown type %s' % (where, node['type']))
+        if not re.fullmatch('[0-9a-f]{64}', node['id']):
+            errors.append('%s: id is not 32 bytes of lowercase hex' % where)
+        try:
+            (pubkey, host, tcp_port, udp_port) = parse_enode(node['enode'])
+            if ethcrypto.keccak256(bytes.fromhex(pubkey)).hex() != node['id']:
+                errors.append('%s: id does not match the enode' % where)
+            if host != node['ip']:
+                warnings.append('%s: enode host %s is not the ip %s' % (where, host, node['ip']))
+        except ValueError:
+            errors.append('%s: invalid enode %s' % (where, node['enode']))
+        if node.get('coreId') is None:
+            warnings.append('%s: no coreId' % where)
+        for key in seen:
+            value = node.get(key)
+            if value is None:
+                continue
+            value = value.lower()
+            if value in seen[key]:
+                errors.append('%s: same %s as node %d' % (where, key, seen[key][value]))
+            seen[key][value] = i
+    return (errors, warnings)
+
+class Registry:
+    def __init__(self, nodes, path=None, stamp=None):
+        self.nodes = tuple(MappingProxyType(dict(node)) for node in nodes)
+        self.index = {node['id']: i for (i, node) in enumerate(self.nodes)} # node id -> ordinal
+        self.path = path
+        self.stamp = stamp # (mtime_ns, size) of the file loaded
+        self.warnings = []
+        self.rejected = None # stamp of a newer file that didn't load, reported once
+        self.by_id = {}
+        self.by_signer = {}  # lowercase signer -> miner
+        self.by_core_id = {} # coreId -> nodes, e.g. the miner and the witness of one maintainer
+        self.by_owner = {}   # owner -> nodes
+        self.by_host = {}    # enode host -> nodes
+        for node in self.nodes:
+            self.by_id[node['id']] = node
+            if node.get('signer'):
+                self.by_signer[node['signer'].lower()] = node
+            if node.get('coreId') is not None:
+                self.by_core_id.setdefault(node['coreId'], []).append(node)
+            self.by_owner.setdefault(node['owner'], []).append(node)
+            self.by_host.setdefault(parse_enode(node['enode'])[1], []).append(node)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    ## nodes matching a node id, enode, signer, coreId, owner or enode host
+    def find(self, key):
+        if key.startswith('enode://'):
+            try:
+                node_id = ethcrypto.keccak256(bytes.fromhex(parse_enode(key)[0])).hex()
+            except ValueError:
+                return []
+            node = self.by_id.get(node_id)
+            return [node] if node else []
+        if key in self.by_id:
+            return [self.by_id[key]]
+        if key.lower() in self.by_signer:
+            return [self.by_signer[key.lower()]]
+        if key.isdigit() and int(key) in self.by_core_id:
+            return self.by_core_id[int(key)]
+        return self.by_owner.get(key) or self.by_host.get(key) or []
+
+def _stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+## load and validate a registry file. raises RegistryError listing the errors, the warnings are
+## kept in registry.warnings
+def load(path=DEFAULT_PATH):
+    stamp = _stamp(path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            nodes = json.load(f)
+    except ValueError as e:
+        raise RegistryError('%s: %s' % (path, e))
+    if not isinstance(nodes, list) or not all(isinstance(n, dict) for n in nodes):
+        raise RegistryError('%s: not a list of nodes' % path)
+    (errors, warnings) = validate(nodes)
+    if errors:
+        raise RegistryError('%s:\n  %s' % (path, '\n  '.join(errors)))
+    registry = Registry(nodes, path, stamp)
+    registry.warnings = warnings
+    return registry
+
+def print_warnings(registry):
+    for w in registry.warnings:
+        print('registry warning:', w, file=sys.stderr, flush=True)
+
+## the registry reloaded from its file if that changed, else the same one. a file that
+## doesn't load is reported and the current registry kept.
+def reload_if_changed(registry):
+    if registry.path is None:
+        return registry
+    try:
+        stamp = _stamp(registry.path)
+        if stamp in [registry.stamp, registry.rejected]:
+            return registry
+        reloaded = load(registry.path)
+    except (OSError, RegistryError) as e:
+        registry.rejected = stamp if isinstance(e, RegistryError) else None
+        print('registry not reloaded, keeping the current one:', str(e), file=sys.stderr, flush=True)
+        return registry
+    print('registry reloaded:', len(registry), '->', len(reloaded), 'nodes', flush=True)
+    print_warnings(reloaded) # someone just edited it, so show them
+    return reloaded
+
+def main():
+    parser = argparse.ArgumentParser('audit_registry')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('check', help='validate a registry file')
+    p.add_argument('path', nargs='?', default=DEFAULT_PATH, help='registry file')
+
+    p = subparsers.add_parser('show', help='show the nodes matching a node id, enode, signer, coreId, owner or enode host')
+    p.add_argument('path', help='registry file')
+    p.add_argument('key', help='node id, enode, signer, coreId, owner or enode host')
+
+    args = parser.parse_args()
+    try:
+        registry = load(args.path)
+    except RegistryError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if args.command == 'check':
+        print_warnings(registry)
+        print(len(registry), 'nodes,', len(registry.by_signer), 'signers,', len(registry.by_owner), 'owners: ok')
+    else:
+        for node in registry.find(args.key):
+            print(json.dumps(dict(node), ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+# The result model of a run, its renderings, and the changes since the day before.
+#
+# build() puts together what the report shows from the run: the chain status, one row per node
+# in report order (the way it is judged, not emoji), the notice lists, and the changes since the
+# previous day if the run is recorded to a store. The text report on stdout is rendered from it,
+# and so are the other sinks, each written in one go: json lines (one record for the run, one
+# per node, one for the changes), csv (one line per node) and a static html page. Tools reading
+# the report take these instead of scraping the text.
+#
+# The changes compare the samples of this run with those of the latest stored run at least
+# DIFF_AGE ago (less DIFF_SLACK, for cron drift): nodes that went down or recovered by the
+# validity rule of the store, lost their check-in, changed block rate band, were added or removed.
+#
+# Usage:
+# $ python3 audit_network.py ~/data/mainnet/geth.ipc --db ~/data/audit.db --output jsonl:/tmp/report.jsonl --output html:/var/www/html/index.html
+
+import csv
+import html
+import json
+import os
+from datetime import datetime
+
+import audit_checkin
+import audit_probe
+import audit_reach
+import audit_status
+import audit_store
+
+FORMATS = ['jsonl', 'csv', 'html']
+
+DIFF_AGE = 86400
+DIFF_SLACK = 3600
+
+## block rate bands of a miner, by its share of the blocks against a fair share of 1 / miners
+RATE_BANDS = ['none', 'low', 'normal', 'high']
+
+## notices in report order, as in the text report
+NOTICES = ['unreachable', 'not peered', 'forked', 'syncing', 'no peers', 'backoff', 'no check-in', 'no kyc']
+
+CSV_FIELDS = ['group', 'type', 'since', 'ip', 'owner', 'coreId', 'id', 'status', 'liveness', 'activity', 'check_in',
+        'probe', 'block_height', 'block_rate', 'fork', 'syncing', 'peer_count']
+
+def rate_band(rate, miners):
+    if rate is None or rate <= 0 or not miners:
+        return 'none'
+    share = rate * miners
+    return 'low' if share < 0.5 else 'high' if share > 1.5 else 'normal'
+
+## changes from the samples of a previous run to those of this run, both indexed by node id.
+## names: node id -> owner of the registered nodes. check-ins are compared within a month only.
+def diff(prev_samples, samples, names, valid_lag, same_month=True):
+    changes = {'down': [], 'recovered': [], 'lost check-in': [], 'block rate band': [], 'new': [], 'removed': []}
+    miners = [sum(1 for s in ss.values() if s['type'] == 'miner') for ss in [prev_samples, samples]]
+    for (node_id, s) in samples.items():
+        owner = names.get(node_id, node_id[:16])
+        p = prev_samples.get(node_id)
+        if p is None:
+            changes['new'].append(owner)
+            continue
+        (was, now) = (audit_store.is_valid(p, valid_lag), audit_store.is_valid(s, valid_lag))
+        if was and not now:
+            changes['down'].append(owner)
+        elif now and not was:
+            changes['recovered'].append(owner)
+        if same_month and p['check_in'] == 1 and s['check_in'] == 0:
+            changes['lost check-in'].append(owner)
+        if s['type'] == 'miner' and p['type'] == 'miner':
+            bands = (rate_band(p['block_rate'], miners[0]), rate_band(s['block_rate'], miners[1]))
+            if bands[0] != bands[1]:
+                changes['block rate band'].append([owner, bands[0], bands[1]])
+    changes['removed'] = [names.get(node_id, node_id[:16]) for node_id in prev_samples if node_id not in samples]
+    return changes
+
+## changes since the latest run in the store at least DIFF_AGE before this one, None without one
+def diff_from_store(conn, run, samples):
+    ts = int(run['current_t'].timestamp())
+    (prev, prev_samples) = audit_store.run_before(conn, ts - DIFF_AGE + DIFF_SLACK)
+    if prev is None:
+        return None
+    names = {node['id']: node['owner'] for node in run['table'].nodes}
+    same_month = datetime.fromtimestamp(prev['ts']).strftime('%Y-%m') == run['current_t'].strftime('%Y-%m')
+    changes = diff(prev_samples, {s['node_id']: s for s in samples}, names, run['valid_lag'], same_month)
+    return dict(changes, since=prev['ts'])
+
+## the result model of a run, report_t being the time of the report
+def build(run, report_t):
+    table = run['table']
+    token_infos = run['token_infos']
+    notices = {notice: list(run['notices'].get(notice, [])) for notice in NOTICES}
+    rows = []
+    for group in audit_status.GROUPS:
+        for i in run['groups'][group]:
+            node = table.nodes[i]
+            node_type = table.node_type(i)
+            if table.connected[i]:
+                status = 'connected'
+            elif table.reach_of(i) in [audit_reach.UNREACHABLE, audit_reach.BACKOFF]:
+                status = 'unreachable'
+            else:
+                status = 'disconnected' # reachable, but not peered (yet)
+            if node_type == 'miner' and table.block_rate[i] > 0:
+                (liveness, activity) = ('ok', table.block_rate[i])
+            elif node_type in ['witness', 'witness(a)'] and table.block_height[i] > 0:
+                (liveness, activity) = ('forked' if table.fork_of(i) else 'ok', table.block_height[i])
+            elif table.probe_of(i) == audit_probe.PROBE_BACKOFF:
+                (liveness, activity) = ('not-probed', 'not-probed')
+            else:
+                (liveness, activity) = ('down', -1)
+
+            core_id = node.get('coreId')
+            check_in = None
+            if core_id is not None:
+                check_in = audit_checkin.is_checked_in(token_infos.get(core_id), run['month_start_timestamp'])
+                if not check_in and node['owner'] not in notices['no check-in']:
+                    notices['no check-in'].append(node['owner'])
+            elif node['owner'] not in notices['no kyc']:
+                notices['no kyc'].append(node['owner'])
+
+            row = table.row(i)
+            rows.append({
+                    'group': group,
+                    'type': node_type,
+                    'since': node['since'],
+                    'ip': node['ip'],
+                    'owner': node['owner'],
+                    'coreId': core_id,
+                    'id': node['id'],
+                    'signer': node.get('signer'),
+                    'status': status,
+                    'liveness': liveness,
+                    'activity': activity,
+                    'check_in': check_in,
+                    'probe': row.get('probe'),
+                    'block_height': row.get('block_height'),
+                    'block_rate': row.get('block_rate'),
+                    'fork': row.get('fork'),
+                    'syncing': row.get('syncing'),
+                    'peer_count': row.get('peer_count'),
+                    })
+    return {
+            'network': run.get('network'),
+            'report_time': report_t.astimezone().isoformat(timespec='seconds'),
+            'block_number': run['last_block_n'],
+            'block_time': run['last_block_t'].astimezone().isoformat(timespec='seconds'),
+            'chain': 'ok' if run['diff_t'].total_seconds() < run['stall_seconds'] else 'stalled',
+            'nodes_alive': {'all': run['count'], 'miner': run['count_miner'], 'witness': run['count_witness']},
+            'probes': audit_probe.summarize(run['probe_results']),
+            'probe_seconds': round(run['probe_t'].total_seconds(), 3),
+            'reference_n': run['reference_n'],
+            'nodes': rows,
+            'notices': notices,
+            'changes': run.get('changes'),
+            }
+
+## renderers, each writing the whole model to a text file
+
+def write_jsonl(model, f):
+    head = {k: v for (k, v) in model.items() if k not in ['nodes', 'changes']}
+    f.write(json.dumps(dict(head, record='run'), ensure_ascii=False) + '\n')
+    for row in model['nodes']:
+        f.write(json.dumps(dict(row, record='node'), ensure_ascii=False) + '\n')
+    if model['changes'] is not None:
+        f.write(json.dumps(dict(model['changes'], record='changes'), ensure_ascii=False) + '\n')
+
+def write_csv(model, f):
+    writer = csv.DictWriter(f, CSV_FIELDS, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(model['nodes'])
+
+HTML_STYLE = '''body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #ccc; padding: 2px 8px; text-align: left; }
+tr.down td, tr.forked td { background: #fdd; }
+tr.not-probed td { background: #eee; }
+td.connected { color: #080; } td.unreachable { color: #c00; } td.disconnected { color: #c80; }'''
+
+def write_html(model, f):
+    e = lambda value: html.escape('--' if value is None else str(value))
+    title = 'Jouleverse Network Audit Report' + (' - ' + model['network'] if model['network'] else '')
+    f.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>%s</title>\n<style>\n%s\n</style></head><body>\n' % (e(title), HTML_STYLE))
+    f.write('<h1>%s</h1>\n' % e(title))
+    f.write('<p>Report time: %s<br>Chain: %s, block %s at %s<br>Nodes alive: %s (%s miners, %s witnesses)<br>Witness probes: %s (%.1fs)</p>\n' % (
+        e(model['report_time']), e(model['chain']), e(model['block_number']), e(model['block_time']),
+        e(model['nodes_alive']['all']), e(model['nodes_alive']['miner']), e(model['nodes_alive']['witness']),
+        e(model['probes']), model['probe_seconds']))
+    f.write('<table>\n<tr>' + ''.join('<th>%s</th>' % e(k.upper()) for k in ['type', 'since', 'ip', 'status', 'activity', 'liveness', 'coreId', 'owner', 'check_in']) + '</tr>\n')
+    for row in model['nodes']:
+        check_in = {True: 'yes', False: 'no', None: '--'}[row['check_in']]
+        f.write('<tr class="%s"><td>%s</td><td>%s</td><td>%s</td><td class="%s">%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>\n' % (
+            e(row['liveness']), e(row['type']), e(row['since']), e(row['ip']), e(row['status']), e(row['status']),
+            e(row['activity']), e(row['liveness']), e(row['coreId']), e(row['owner']), check_in))
+    f.write('</table>\n')
+    notices = [(notice, owners) for (notice, owners) in model['notices'].items() if owners]
+    if notices:
+        f.write('<h2>Notice</h2>\n<ul>\n')
+        for (notice, owners) in notices:
+            f.write('<li>%s: %s</li>\n' % (e(notice), e(', '.join(owners))))
+        f.write('</ul>\n')
+    changes = model['changes']
+    if changes is not None:
+        f.write('<h2>Changes since %s</h2>\n<ul>\n' % e(datetime.fromtimestamp(changes['since']).astimezone().isoformat(timespec='minutes')))
+        for (change, owners) in changes.items():
+            if change != 'since' and owners:
+                f.write('<li>%s: %s</li>\n' % (e(change), e(', '.join('%s %s→%s' % tuple(o) if isinstance(o, list) else o for o in owners))))
+        f.write('</ul>\n')
+    f.write('</body></html>\n')
+
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv, 'html': write_html}
+
+## FORMAT:PATH of --output -> (format, path), raises ValueError
+def parse_output(spec):
+    (fmt, sep, path) = spec.partition(':')
+    if fmt not in FORMATS or not path:
+        raise ValueError('--output takes FORMAT:PATH with FORMAT one of ' + ', '.join(FORMATS))
+    return (fmt, path)
+
+def write(model, fmt, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        WRITERS[fmt](model, f)
+    os.replace(tmp, path)
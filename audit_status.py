@@ -0,0 +1,153 @@
+# Per-run status of the registered nodes, as a columnar table.
+#
+# The registry is immutable. What a run finds out about the nodes is kept apart from it, in one
+# typed array per field, indexed by the ordinal of the node in the registry: a few bytes per node
+# and field instead of a dict per node, so runs over thousands of nodes stay cheap. Fields that
+# may be unknown use NONE (-1) for it, or NaN for floats; outcomes are stored as their index in
+# REACH_OUTCOMES and audit_probe.PROBE_OUTCOMES.
+#
+# summarize() counts the alive nodes, groups the nodes in report order and collects the notice
+# lists in one pass over the arrays. row() puts one node together as a dict, the way the store
+# and the metrics take it.
+
+import array
+import math
+
+import audit_probe
+import audit_reach
+
+NONE = -1
+NAN = float('nan')
+
+REACH_OUTCOMES = [audit_reach.REACHABLE, audit_reach.UNREACHABLE, audit_reach.BACKOFF]
+
+## report groups, in report order
+MINERS = 'miners'
+MINER_STARS = 'miner*s'
+WITNESSES_ALIVE = 'witnesses alive'
+WITNESSES_DEAD = 'witnesses dead'
+GROUPS = [MINERS, MINER_STARS, WITNESSES_ALIVE, WITNESSES_DEAD]
+
+## notice lists, owners in registry order
+NOTICES = ['unreachable', 'not peered', 'forked', 'syncing', 'no peers', 'backoff']
+
+def _flag(value):
+    return NONE if value is None else int(value)
+
+def _unflag(value):
+    return None if value == NONE else bool(value)
+
+class StatusTable:
+    __slots__ = ['nodes', 'index', 'audit', 'connected', 'reach', 'discv4', 'probe', 'block_height',
+            'fork', 'syncing', 'peer_count', 'latency', 'block_rate']
+
+    def __init__(self, registry):
+        n = len(registry)
+        self.nodes = registry.nodes
+        self.index = registry.index # node id -> ordinal
+        self.audit = NONE # ordinal of the audit node
+        self.connected = bytearray(n)
+        self.reach = array.array('b', [NONE]) * n   # index in REACH_OUTCOMES, checked if disconnected only
+        self.discv4 = array.array('b', [NONE]) * n
+        self.probe = array.array('b', [NONE]) * n   # index in audit_probe.PROBE_OUTCOMES, witnesses only
+        self.block_height = array.array('q', [0]) * n
+        self.fork = array.array('b', [NONE]) * n
+        self.syncing = array.array('b', [NONE]) * n
+        self.peer_count = array.array('i', [NONE]) * n
+        self.latency = array.array('d', [NAN]) * n # seconds, None for witnesses not probed
+        self.block_rate = array.array('d', [0]) * n # share of recent blocks, -1 for miners with none
+
+    def __len__(self):
+        return len(self.nodes)
+
+    ## the type as reported: the audit node is 'witness(a)'
+    def node_type(self, i):
+        return 'witness(a)' if i == self.audit else self.nodes[i]['type']
+
+    def status(self, i):
+        return 'connected' if self.connected[i] else 'disconnected'
+
+    def reach_of(self, i):
+        return None if self.reach[i] == NONE else REACH_OUTCOMES[self.reach[i]]
+
+    def probe_of(self, i):
+        return None if self.probe[i] == NONE else audit_probe.PROBE_OUTCOMES[self.probe[i]]
+
+    def fork_of(self, i):
+        return _unflag(self.fork[i])
+
+    def set_reach(self, i, result):
+        self.reach[i] = REACH_OUTCOMES.index(result['reach'])
+        self.discv4[i] = _flag(result['discv4'])
+
+    def set_probe(self, i, result):
+        self.probe[i] = audit_probe.PROBE_OUTCOMES.index(result['outcome'])
+        self.block_height[i] = result['block_height']
+        self.fork[i] = _flag(result['fork'])
+        self.syncing[i] = _flag(result['syncing'])
+        self.peer_count[i] = NONE if result['peer_count'] is None else result['peer_count']
+        self.latency[i] = NAN if result['latency'] is None else result['latency']
+
+    ## node i as one dict: the registered fields, the reported type and what the run found out
+    def row(self, i):
+        row = dict(self.nodes[i], type=self.node_type(i), status=self.status(i))
+        if self.reach[i] != NONE:
+            row['reach'] = self.reach_of(i)
+            row['discv4'] = _unflag(self.discv4[i])
+        if self.probe[i] != NONE:
+            row['probe'] = self.probe_of(i)
+            row['probe_latency'] = None if math.isnan(self.latency[i]) else self.latency[i]
+            row['block_height'] = self.block_height[i]
+            row['fork'] = self.fork_of(i)
+            row['syncing'] = _unflag(self.syncing[i])
+            row['peer_count'] = None if self.peer_count[i] == NONE else self.peer_count[i]
+        if self.node_type(i) in ['miner', 'miner*']:
+            row['block_rate'] = self.block_rate[i]
+        return row
+
+    ## one pass over all nodes: counts of the alive ones, ordinals per report group, owners per notice.
+    ## a miner is alive if it sealed recent blocks, a witness if it is less than valid_lag blocks
+    ## away from last_block_n and not forked.
+    def summarize(self, last_block_n, valid_lag):
+        groups = {group: [] for group in GROUPS}
+        notices = {notice: [] for notice in NOTICES}
+        count_miner = count_witness = 0
+        unreachable = {REACH_OUTCOMES.index(audit_reach.UNREACHABLE), REACH_OUTCOMES.index(audit_reach.BACKOFF)}
+        reachable = REACH_OUTCOMES.index(audit_reach.REACHABLE)
+        backoff = audit_probe.PROBE_OUTCOMES.index(audit_probe.PROBE_BACKOFF)
+        for (i, node) in enumerate(self.nodes):
+            node_type = 'witness' if i == self.audit else node['type']
+            height = self.block_height[i]
+            if node_type == 'miner':
+                groups[MINERS].append(i)
+                if self.block_rate[i] > 0:
+                    count_miner += 1
+            elif node_type == 'miner*':
+                groups[MINER_STARS].append(i)
+            elif height > 0:
+                groups[WITNESSES_ALIVE].append(i)
+                if abs(height - last_block_n) < valid_lag and self.fork[i] != 1:
+                    count_witness += 1
+            elif i != self.audit:
+                groups[WITNESSES_DEAD].append(i)
+
+            owner = node['owner']
+            if self.reach[i] in unreachable:
+                notices['unreachable'].append(owner)
+            elif self.reach[i] == reachable:
+                notices['not peered'].append(owner)
+            if self.fork[i] == 1:
+                notices['forked'].append(owner)
+            if self.syncing[i] == 1:
+                notices['syncing'].append(owner)
+            if self.peer_count[i] == 0:
+                notices['no peers'].append(owner)
+            if self.probe[i] == backoff:
+                notices['backoff'].append(owner)
+        return {
+                'count': count_miner + count_witness,
+                'count_miner': count_miner,
+                'count_witness': count_witness,
+                'groups': groups,
+                'notices': notices,
+                }
@@ -0,0 +1,266 @@
+# Append-only store of audit results (sqlite).
+#
+# One row per run in `runs`, one row per node per run in `samples`. Samples are indexed
+# by (node_id, ts), so the history of one node over a month is a range scan of that
+# node's rows only.
+#
+# Hourly/daily/monthly counters per node are kept in `rollups` and updated in the same
+# transaction as each run, so the monthly availability of all nodes is one lookup per node
+# no matter how long the history is. If the validity rule changes, rebuild them from raw samples.
+#
+# Usage:
+# $ python3 audit_store.py history audit.db <node id> [--month 2024-01]
+# $ python3 audit_store.py rebuild audit.db [--valid-lag 10]
+
+import argparse
+import math
+import sqlite3
+from datetime import datetime
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,             -- unix time of the run
+    block_number INTEGER NOT NULL,   -- latest block seen by the audit node
+    block_time INTEGER NOT NULL,
+    audit_node_id TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    ts INTEGER NOT NULL,
+    node_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    connected INTEGER NOT NULL,      -- enode peered with the audit node
+    probe TEXT,                      -- rpc probe outcome, witnesses only. 'backoff': not probed
+    block_height INTEGER,
+    head_lag INTEGER,                -- blocks behind the audit node, witnesses only
+    block_rate REAL,                 -- from clique_status, miners only
+    latency REAL,                    -- rpc probe latency in seconds
+    check_in INTEGER,                -- 1 checked in this month, 0 not, NULL no coreId
+    fork INTEGER                     -- 1 block hash at its height differs from the audit node's, witnesses only
+);
+CREATE INDEX IF NOT EXISTS samples_node_ts ON samples (node_id, ts);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id);
+CREATE INDEX IF NOT EXISTS runs_ts ON runs (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    period TEXT NOT NULL,            -- 'hour', 'day' or 'month'
+    bucket INTEGER NOT NULL,         -- unix time the period starts at, local time
+    node_id TEXT NOT NULL,
+    valid INTEGER NOT NULL,          -- valid samples
+    total INTEGER NOT NULL,          -- all samples
+    valid_hours INTEGER NOT NULL,    -- hours with at least one valid sample
+    hours INTEGER NOT NULL,          -- hours with at least one sample
+    lag_sum INTEGER NOT NULL,        -- sum of abs(head_lag), witnesses only
+    lag_n INTEGER NOT NULL,
+    rate_sum REAL NOT NULL,          -- sum and sum of squares of block_rate, miners only
+    rate_sq REAL NOT NULL,
+    rate_n INTEGER NOT NULL,
+    rate_min REAL,
+    rate_max REAL,
+    PRIMARY KEY (period, bucket, node_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+## a witness is valid if its rpc returned a block height less than VALID_LAG blocks away from the audit node,
+## on the same chain
+VALID_LAG = 10
+
+ROLLUP_PERIODS = ['hour', 'day', 'month']
+
+UPSERT_ROLLUP = '''
+INSERT INTO rollups (period, bucket, node_id, valid, total, valid_hours, hours, lag_sum, lag_n, rate_sum, rate_sq, rate_n, rate_min, rate_max)
+VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (period, bucket, node_id) DO UPDATE SET
+    valid = valid + excluded.valid,
+    total = total + 1,
+    valid_hours = valid_hours + excluded.valid_hours,
+    hours = hours + excluded.hours,
+    lag_sum = lag_sum + excluded.lag_sum,
+    lag_n = lag_n + excluded.lag_n,
+    rate_sum = rate_sum + excluded.rate_sum,
+    rate_sq = rate_sq + excluded.rate_sq,
+    rate_n = rate_n + excluded.rate_n,
+    rate_min = min(coalesce(rate_min, excluded.rate_min), coalesce(excluded.rate_min, rate_min)),
+    rate_max = max(coalesce(rate_max, excluded.rate_max), coalesce(excluded.rate_max, rate_max))
+'''
+
+SAMPLE_FIELDS = ['node_id', 'type', 'connected', 'probe', 'block_height', 'head_lag', 'block_rate', 'latency', 'check_in', 'fork']
+
+## columns added to samples since the first schema, added to stores created before them
+ADDED_COLUMNS = [('fork', 'INTEGER')]
+
+def open_store(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(samples)')]
+    for (name, decl) in ADDED_COLUMNS:
+        if name not in columns:
+            conn.execute('ALTER TABLE samples ADD COLUMN %s %s' % (name, decl))
+    return conn
+
+## the valid lag the rollups are built with, None for a store without one yet
+def stored_valid_lag(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'valid_lag'").fetchone()
+    return int(row['value']) if row else None
+
+def get_valid_lag(conn):
+    valid_lag = stored_valid_lag(conn)
+    return VALID_LAG if valid_lag is None else valid_lag
+
+## the validity rule of a single check. a witness not probed because its circuit breaker is open
+## (probe 'backoff') is not valid, like the failed probes that opened it, nor is a forked one.
+def is_valid(sample, valid_lag):
+    if sample['type'] in ['witness', 'witness(a)']:
+        return (sample['probe'] == 'ok' and sample['head_lag'] is not None and abs(sample['head_lag']) < valid_lag
+                and not sample.get('fork'))
+    if sample['type'] == 'miner':
+        return sample['block_rate'] is not None and sample['block_rate'] > 0
+    return bool(sample['connected'])
+
+## start of the hour, day and month ts falls in, local time
+def period_buckets(ts):
+    t = datetime.fromtimestamp(ts)
+    return {
+            'hour': int(t.replace(minute=0, second=0, microsecond=0).timestamp()),
+            'day': int(datetime(t.year, t.month, t.day).timestamp()),
+            'month': int(datetime(t.year, t.month, 1).timestamp()),
+            }
+
+## add one sample to the hour, day and month counters of its node
+def rollup_sample(conn, ts, sample, valid_lag):
+    buckets = period_buckets(ts)
+    node_id = sample['node_id']
+    valid = 1 if is_valid(sample, valid_lag) else 0
+
+    hour = conn.execute("SELECT valid FROM rollups WHERE period = 'hour' AND bucket = ? AND node_id = ?",
+            (buckets['hour'], node_id)).fetchone()
+    new_hour = 1 if hour is None else 0
+    new_valid_hour = 1 if valid and (hour is None or hour['valid'] == 0) else 0
+
+    lag = sample.get('head_lag')
+    (lag_sum, lag_n) = (abs(lag), 1) if lag is not None else (0, 0)
+    rate = sample.get('block_rate')
+    if rate is not None:
+        rate = max(rate, 0) # -1: not seen in clique_status at all
+        (rate_sum, rate_sq, rate_n) = (rate, rate * rate, 1)
+    else:
+        (rate_sum, rate_sq, rate_n) = (0, 0, 0)
+
+    for period in ROLLUP_PERIODS:
+        conn.execute(UPSERT_ROLLUP, (period, buckets[period], node_id, valid, new_valid_hour, new_hour,
+            lag_sum, lag_n, rate_sum, rate_sq, rate_n, rate, rate))
+
+## append one audit run and its per-node samples, and update the rollups, in a single transaction.
+## the rollups are counted by the valid lag stored with them, only changed by rebuild_rollups();
+## valid_lag sets it for a store that has none yet. returns the run id.
+def record_run(conn, ts, block_number, block_time, audit_node_id, samples, valid_lag=VALID_LAG):
+    with conn:
+        if stored_valid_lag(conn) is None:
+            conn.execute("INSERT INTO meta (key, value) VALUES ('valid_lag', ?)", (str(valid_lag),))
+        valid_lag = get_valid_lag(conn)
+        cur = conn.execute('INSERT INTO runs (ts, block_number, block_time, audit_node_id) VALUES (?, ?, ?, ?)',
+                (ts, block_number, block_time, audit_node_id))
+        run_id = cur.lastrowid
+        rows = [[run_id, ts] + [s.get(f) for f in SAMPLE_FIELDS] for s in samples]
+        conn.executemany('INSERT INTO samples (run_id, ts, ' + ', '.join(SAMPLE_FIELDS) + ') VALUES (?, ?' + ', ?' * len(SAMPLE_FIELDS) + ')', rows)
+        for s in samples:
+            rollup_sample(conn, ts, dict(zip(SAMPLE_FIELDS, [s.get(f) for f in SAMPLE_FIELDS])), valid_lag)
+    return run_id
+
+## recompute all rollups from raw samples, e.g. after the validity rule changed
+def rebuild_rollups(conn, valid_lag=VALID_LAG):
+    with conn:
+        conn.execute('DELETE FROM rollups')
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('valid_lag', ?)", (str(valid_lag),))
+        count = 0
+        for row in conn.execute('SELECT * FROM samples ORDER BY ts'):
+            rollup_sample(conn, row['ts'], dict(row), valid_lag)
+            count += 1
+    return count
+
+## rollups of all nodes for one period, indexed by node id
+def period_rollups(conn, period, bucket):
+    rows = conn.execute('SELECT * FROM rollups WHERE period = ? AND bucket = ?', (period, bucket)).fetchall()
+    return {row['node_id']: row for row in rows}
+
+## number of valid hourly checks a node needs in a month, e.g. 736 of 744 hours for 99%
+def required_hours(month_start, month_end, sla=0.99):
+    return math.ceil((month_end - month_start) / 3600 * sla)
+
+## all samples of one node in [start, end)
+def node_history(conn, node_id, start, end):
+    return conn.execute('SELECT * FROM samples WHERE node_id = ? AND ts >= ? AND ts < ? ORDER BY ts',
+            (node_id, start, end)).fetchall()
+
+## the latest run at or before ts and its samples indexed by node id, (None, {}) if there is none
+def run_before(conn, ts):
+    run = conn.execute('SELECT * FROM runs WHERE ts <= ? ORDER BY ts DESC LIMIT 1', (ts,)).fetchone()
+    if run is None:
+        return (None, {})
+    rows = conn.execute('SELECT * FROM samples WHERE run_id = ?', (run['id'],)).fetchall()
+    return (run, {row['node_id']: dict(row) for row in rows})
+
+## [start, end) unix time of a month given as 'YYYY-MM', local time like get_month_start()
+def month_range(month):
+    start = datetime.strptime(month, '%Y-%m')
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+## build the sample of a node after a run of audit_network.py
+def node_sample(node, last_block_n, check_in):
+    sample = {
+            'node_id': node['id'],
+            'type': node['type'],
+            'connected': 1 if node['status'] == 'connected' else 0,
+            'check_in': check_in,
+            }
+    if node.get('probe') == 'backoff': # not probed, nothing measured
+        sample['probe'] = node['probe']
+    elif 'probe' in node:
+        sample['probe'] = node['probe']
+        sample['latency'] = node['probe_latency']
+        sample['block_height'] = node['block_height']
+        if node['block_height'] > 0:
+            sample['head_lag'] = last_block_n - node['block_height']
+        if node.get('fork') is not None:
+            sample['fork'] = int(node['fork'])
+    if node['type'] == 'miner':
+        sample['block_rate'] = node['block_rate']
+    return sample
+
+def history(conn, args):
+    (start, end) = month_range(args.month)
+    print('TIME', 'TYPE', 'CONNECTED', 'PROBE', 'BLOCK-HEIGHT', 'HEAD-LAG', 'BLOCK-RATE', 'LATENCY', 'CHECK-IN', 'FORK')
+    for row in node_history(conn, args.node_id, start, end):
+        latency = '%.3f' % row['latency'] if row['latency'] is not None else None
+        print(datetime.fromtimestamp(row['ts']).strftime('%Y-%m-%d %H:%M'), row['type'], row['connected'], row['probe'],
+                row['block_height'], row['head_lag'], row['block_rate'], latency, row['check_in'], row['fork'])
+
+def rebuild(conn, args):
+    count = rebuild_rollups(conn, args.valid_lag)
+    print('rebuilt rollups from', count, 'samples, valid lag <', args.valid_lag, 'blocks')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('audit_store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('history', help='show all samples of one node in a month')
+    p.add_argument('db', help='path to the audit result store')
+    p.add_argument('node_id', help='node id (enode id) to show history of')
+    p.add_argument('--month', default=datetime.now().strftime('%Y-%m'), help='YYYY-MM, default this month')
+    p.set_defaults(func=history)
+
+    p = subparsers.add_parser('rebuild', help='recompute hourly/daily/monthly rollups from raw samples')
+    p.add_argument('db', help='path to the audit result store')
+    p.add_argument('--valid-lag', type=int, default=VALID_LAG, help='a witness is valid if less than this many blocks behind')
+    p.set_defaults(func=rebuild)
+
+    args = parser.parse_args()
+    conn = open_store(args.db)
+    args.func(conn, args)
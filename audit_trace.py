@@ -0,0 +1,85 @@
+# Timed spans for the phases of an audit run and for every json-rpc round trip.
+#
+# Tracing is off by default and a span costs next to nothing then. When on, spans are kept
+# in memory and can be printed as a timing summary, or written as a Chrome trace file
+# (open it in chrome://tracing or https://ui.perfetto.dev).
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_events = [] # (name, cat, start, duration, thread id, args)
+_lock = threading.Lock()
+_t0 = time.perf_counter()
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+def enabled():
+    return _enabled
+
+## forget recorded spans, e.g. at the start of every daemon cycle
+def reset():
+    global _t0
+    with _lock:
+        _events.clear()
+        _t0 = time.perf_counter()
+
+@contextlib.contextmanager
+def span(name, cat='phase', **args):
+    if not _enabled:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        dur = time.perf_counter() - t
+        with _lock:
+            _events.append((name, cat, t, dur, threading.get_ident(), args))
+
+def print_summary(slowest=5):
+    with _lock:
+        events = list(_events)
+    if not events:
+        return
+
+    stats = {} # (cat, name) -> [count, total, max]
+    for (name, cat, t, dur, tid, args) in events:
+        s = stats.setdefault((cat, name), [0, 0.0, 0.0])
+        s[0] += 1
+        s[1] += dur
+        s[2] = max(s[2], dur)
+
+    print('------------------- timing --------------------')
+    print('SPAN', 'COUNT', 'TOTAL(ms)', 'MAX(ms)')
+    for cat in ['phase', 'rpc']:
+        for ((c, name), (count, total, longest)) in sorted(stats.items(), key=lambda x: -x[1][1]):
+            if c == cat:
+                print(name, count, '%.1f' % (total * 1000), '%.1f' % (longest * 1000))
+
+    rpcs = sorted((e for e in events if e[1] == 'rpc'), key=lambda e: -e[3])[:slowest]
+    if rpcs:
+        print('slowest rpc:', ', '.join('%s %s %.1fms' % (e[0], e[5].get('endpoint', ''), e[3] * 1000) for e in rpcs))
+
+## chrome trace event format, complete events ('X') in microseconds
+def write_chrome_trace(path):
+    with _lock:
+        events = list(_events)
+        t0 = _t0
+    trace = {'traceEvents': [{
+        'name': name,
+        'cat': cat,
+        'ph': 'X',
+        'ts': round((t - t0) * 1e6),
+        'dur': round(dur * 1e6),
+        'pid': os.getpid(),
+        'tid': tid,
+        'args': args,
+        } for (name, cat, t, dur, tid, args) in events]}
+    with open(path, 'w') as f:
+        json.dump(trace, f)
@@ -0,0 +1,118 @@
+# Connection uptime of every node, from frequent admin_peers samples (daemon mode).
+#
+# The daily report used to show one admin_peers snapshot, so a node flapping all day but
+# connected at 06:15 looked healthy. The sampler polls admin_peers every interval and keeps
+# one bit per node per sample in a fixed size ring (30 days by default), plus one bit per
+# sample telling whether that sample was taken at all (the daemon may have been down, or
+# geth not answering). Uptime over a window is the share of taken samples the node was
+# connected in. 30 days at one sample a minute is about 5 KB per node.
+#
+# The ring is saved to a file now and then, so a restart of the daemon doesn't lose it.
+
+import base64
+import json
+import os
+
+WINDOW_24H = 86400
+WINDOW_30D = 30 * 86400
+
+def _popcount(x):
+    return bin(x).count('1')
+
+class PeerSampler:
+    def __init__(self, interval=60, span=WINDOW_30D, path=None):
+        self.interval = interval
+        self.capacity = span // interval
+        self.path = path
+        self.last_slot = None # absolute slot (time // interval) of the latest sample
+        self.sampled = bytearray((self.capacity + 7) // 8)
+        self.bits = {} # node id -> connected bits, same layout as sampled
+        self.first = {} # node id -> first slot it was sampled in, earlier bits mean nothing
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path) as f:
+            saved = json.load(f)
+        if saved['interval'] != self.interval or saved['capacity'] != self.capacity:
+            return # sampled differently, start over
+        self.last_slot = saved['last_slot']
+        self.sampled = bytearray(base64.b64decode(saved['sampled']))
+        self.bits = {node_id: bytearray(base64.b64decode(b)) for (node_id, b) in saved['nodes'].items()}
+        self.first = saved['first']
+
+    def save(self):
+        if not self.path:
+            return
+        saved = {
+                'interval': self.interval,
+                'capacity': self.capacity,
+                'last_slot': self.last_slot,
+                'sampled': base64.b64encode(self.sampled).decode(),
+                'nodes': {node_id: base64.b64encode(b).decode() for (node_id, b) in self.bits.items()},
+                'first': self.first,
+                }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _set(bits, pos, on):
+        if on:
+            bits[pos >> 3] |= 1 << (pos & 7)
+        else:
+            bits[pos >> 3] &= ~(1 << (pos & 7)) & 0xff
+
+    ## one sample at unix time ts: node_ids are the registered nodes, connected_ids the connected ones
+    def sample(self, node_ids, connected_ids, ts):
+        slot = int(ts // self.interval)
+        if self.last_slot is not None and slot <= self.last_slot:
+            return # one sample per slot
+        # slots skipped since the latest sample were not sampled
+        start = slot if self.last_slot is None else max(self.last_slot + 1, slot - self.capacity + 1)
+        for s in range(start, slot):
+            self._set(self.sampled, s % self.capacity, False)
+        pos = slot % self.capacity
+        self._set(self.sampled, pos, True)
+        connected_ids = set(connected_ids)
+        for node_id in node_ids:
+            bits = self.bits.get(node_id)
+            if bits is None:
+                bits = self.bits[node_id] = bytearray(len(self.sampled))
+                self.first[node_id] = slot
+            self._set(bits, pos, node_id in connected_ids)
+        self.last_slot = slot
+
+    ## ring positions [a, b) of the latest `window` seconds since first_slot, split where the ring wraps
+    def _ranges(self, window, first_slot):
+        n = min(self.capacity, window // self.interval, self.last_slot - first_slot + 1)
+        first = (self.last_slot - n + 1) % self.capacity
+        if first + n <= self.capacity:
+            return [(first, first + n)]
+        return [(first, self.capacity), (0, first + n - self.capacity)]
+
+    @staticmethod
+    def _count(bits, a, b):
+        return _popcount((int.from_bytes(bits, 'little') >> a) & ((1 << (b - a)) - 1))
+
+    ## share of the samples in the latest `window` seconds the node was connected, None if no samples
+    def uptime(self, node_id, window):
+        if self.last_slot is None or node_id not in self.bits:
+            return None
+        sampled = connected = 0
+        bits = self.bits[node_id]
+        both = bytes(x & y for (x, y) in zip(bits, self.sampled))
+        for (a, b) in self._ranges(window, self.first[node_id]):
+            sampled += self._count(self.sampled, a, b)
+            connected += self._count(both, a, b)
+        return connected / sampled if sampled else None
+
+    ## node id -> (24h uptime, 30d uptime)
+    def uptimes(self, node_ids):
+        return {node_id: (self.uptime(node_id, WINDOW_24H), self.uptime(node_id, WINDOW_30D)) for node_id in node_ids}
+
+## poll admin_peers once. the audit node counts as connected to itself.
+def poll(rpc, sampler, node_ids, audit_node_id, ts):
+    peers = rpc.call('admin_peers')
+    sampler.sample(node_ids, [p['id'] for p in peers] + [audit_node_id], ts)
@@ -0,0 +1,281 @@
+# Multi-vantage auditing: probe workers at several places, and a coordinator merging their views.
+#
+# From one audit node, a routing problem between that VM and a witness looks exactly like the
+# witness being down. Any node operator can run a worker: it probes the witnesses in the
+# registry from where it runs (the same single-batch rpc probe as the audit), takes its own geth
+# peers if it has a geth.ipc, and publishes the result as a compact bundle, signed with an
+# HMAC-SHA256 key it shares with the coordinator. The coordinator fetches the bundles of all
+# vantages concurrently (http urls or files), drops the ones not verifying or too old, and merges
+# them into one view per node: "up from 4/5 vantages". Nodes down from a minority of the vantages
+# only are listed per vantage, which points at the vantage's network rather than the node.
+#
+# A bundle is gzipped json: {'body': <json text>, 'hmac': <hex>}, the body holding the vantage
+# name, time, head, and per node one array of BUNDLE_FIELDS.
+#
+# Usage:
+# $ python3 audit_vantage.py worker --name shanghai --key-file vantage.key --out /var/www/bundle.json.gz [--geth-ipc ~/data/mainnet/geth.ipc]
+# $ python3 audit_vantage.py worker --name shanghai --key-file vantage.key --serve 8599 --interval 3600
+# $ python3 audit_vantage.py merge --keys vantage-keys.json http://1.2.3.4:8599/bundle /data/bundles/beijing.json.gz
+
+import argparse
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import audit_probe
+import audit_registry
+from audit_store import VALID_LAG
+from jsonrpc import IPCClient, unwrap
+
+BUNDLE_VERSION = 1
+BUNDLE_FIELDS = ['connected', 'probe', 'block_height', 'fork', 'latency_ms'] # per node, None where not known
+MAX_AGE = 2 * 3600 # seconds, older bundles are left out of the merge
+
+UP = 'up'
+SPLIT = 'split'
+DOWN = 'down'
+
+## worker
+
+## one probe cycle from this vantage. returns the bundle body.
+def probe_cycle(registry, name, rpc=None, workers=32, connect_timeout=3.0, read_timeout=5.0, budget=30.0, port=audit_probe.RPC_PORT):
+    own_id = None
+    connected = None
+    head = None
+    reference = None
+    if rpc:
+        calls = [('admin_nodeInfo', []), ('admin_peers', []), ('eth_getBlockByNumber', ['latest', False])]
+        (node_info, peers, last_block) = [unwrap(r, m) for (r, (m, p)) in zip(rpc.batch(calls), calls)]
+        own_id = node_info['id']
+        connected = {peer['id'] for peer in peers} | {own_id}
+        head = int(last_block['number'], 16)
+        reference_n = max(0, head - audit_probe.REFERENCE_DEPTH)
+        reference_block = rpc.call('eth_getBlockByNumber', [hex(reference_n), False])
+        reference = (reference_n, reference_block['hash']) if reference_block else None
+
+    witnesses = [node for node in registry if node['type'] == 'witness' and node['id'] != own_id]
+    probes = audit_probe.probe_witnesses(witnesses, workers=workers, connect_timeout=connect_timeout,
+            read_timeout=read_timeout, budget=budget, reference=reference, port=port)
+    if head is None: # no geth of its own, the highest witness is the head
+        head = max([r['block_height'] for r in probes.values()] or [0])
+
+    nodes = {}
+    for node in registry:
+        r = probes.get(node['id'])
+        is_connected = None if connected is None else int(node['id'] in connected)
+        if r is None:
+            nodes[node['id']] = [is_connected, None, None, None, None]
+        else:
+            fork = None if r['fork'] is None else int(r['fork'])
+            nodes[node['id']] = [is_connected, r['outcome'], r['block_height'], fork, round(r['latency'] * 1000)]
+    return {'version': BUNDLE_VERSION, 'vantage': name, 'ts': int(time.time()), 'head': head, 'fields': BUNDLE_FIELDS, 'nodes': nodes}
+
+def sign(body, key):
+    text = json.dumps(body, separators=(',', ':'), sort_keys=True)
+    mac = hmac.new(key, text.encode('utf-8'), hashlib.sha256).hexdigest()
+    return gzip.compress(json.dumps({'body': text, 'hmac': mac}).encode('utf-8'))
+
+def read_key(path):
+    with open(path, 'rb') as f:
+        return f.read().strip()
+
+_latest = b'' # signed bundle of the latest cycle, swapped as a whole
+
+class BundleHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/bundle' or not _latest:
+            self.send_error(404)
+            return
+        body = _latest
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def worker(args):
+    global _latest
+    key = read_key(args.key_file)
+    rpc = IPCClient(args.geth_ipc) if args.geth_ipc else None
+    if args.serve:
+        server = ThreadingHTTPServer((args.addr, args.serve), BundleHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='bundle', daemon=True).start()
+
+    while True:
+        registry = audit_registry.load(args.registry)
+        t0 = time.time()
+        body = probe_cycle(registry, args.name, rpc, args.probe_workers, args.probe_connect_timeout,
+                args.probe_read_timeout, args.probe_budget, args.rpc_port)
+        _latest = sign(body, key)
+        if args.out:
+            tmp = args.out + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(_latest)
+            os.replace(tmp, args.out)
+        print('vantage %s: probed %d nodes in %.1fs, head %d, bundle %d bytes' % (args.name, len(body['nodes']),
+            time.time() - t0, body['head'], len(_latest)), flush=True)
+        if not args.serve:
+            return
+        time.sleep(max(0, args.interval - (time.time() - t0)))
+
+## coordinator
+
+## fetch one bundle from an http(s) url or a file
+def fetch(source, timeout=10.0):
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=timeout) as resp:
+            return resp.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+## the body of a bundle if it is signed by the key of the vantage it names, else raise ValueError
+def verify(data, keys):
+    envelope = json.loads(gzip.decompress(data))
+    body = json.loads(envelope['body'])
+    key = keys.get(body.get('vantage'))
+    if key is None:
+        raise ValueError('unknown vantage', body.get('vantage'))
+    mac = hmac.new(key, envelope['body'].encode('utf-8'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(mac, envelope['hmac']):
+        raise ValueError('bad signature', body['vantage'])
+    if body.get('version') != BUNDLE_VERSION:
+        raise ValueError('unknown bundle version', body.get('version'))
+    return body
+
+## fetch and verify the bundles of all sources at once. returns (bundles, errors), bundles in source order
+def collect(sources, keys, max_age=MAX_AGE, now=None, timeout=10.0):
+    now = now or time.time()
+    bundles = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, len(sources)), thread_name_prefix='vantage') as pool:
+        futures = [pool.submit(fetch, source, timeout) for source in sources]
+        for (source, f) in zip(sources, futures):
+            try:
+                body = verify(f.result(), keys)
+            except Exception as e:
+                errors.append((source, str(e)))
+                continue
+            if now - body['ts'] > max_age:
+                errors.append((source, 'stale, %d s old' % (now - body['ts'])))
+                continue
+            bundles.append(body)
+    return (bundles, errors)
+
+## is a node up from one vantage? True/False, None if that vantage couldn't tell.
+## witnesses by their rpc probe, the others (miners keep rpc closed) by p2p connection.
+def vantage_vote(node, values, head, valid_lag=VALID_LAG):
+    v = dict(zip(BUNDLE_FIELDS, values))
+    if node['type'] == 'witness' and v['probe'] is not None:
+        if v['probe'] == audit_probe.PROBE_BACKOFF:
+            return None
+        return v['probe'] == audit_probe.PROBE_OK and not v['fork'] and abs(head - v['block_height']) < valid_lag
+    if v['connected'] is None:
+        return None
+    return bool(v['connected'])
+
+## one view per node: node id -> {'verdict', 'up', 'of', 'votes' (per bundle)}
+def merge(registry, bundles, valid_lag=VALID_LAG):
+    view = {}
+    for node in registry:
+        votes = [vantage_vote(node, b['nodes'][node['id']], b['head'], valid_lag) if node['id'] in b['nodes'] else None for b in bundles]
+        up = sum(1 for v in votes if v)
+        of = sum(1 for v in votes if v is not None)
+        if not of:
+            verdict = None
+        elif up * 2 > of:
+            verdict = UP
+        elif up:
+            verdict = SPLIT
+        else:
+            verdict = DOWN
+        view[node['id']] = {'verdict': verdict, 'up': up, 'of': of, 'votes': votes}
+    return view
+
+def print_view(registry, bundles, errors, view):
+    print('Jouleverse Multi-Vantage Audit')
+    print('===============================================')
+    print('VANTAGE', 'AGE', 'HEAD')
+    now = time.time()
+    for b in bundles:
+        print(b['vantage'], '%ds' % (now - b['ts']), b['head'])
+    for (source, error) in errors:
+        print('❗ left out:', source, error)
+    print('----------------- consensus -------------------')
+    print('TYPE', 'IP', 'OWNER', 'CONSENSUS', 'UP/OF', 'VANTAGES')
+    cell = {True: '🟩', False: '🟥', None: '⬜'}
+    for node in registry:
+        v = view[node['id']]
+        print(node['type'], node['ip'], f'"{node["owner"]}"', v['verdict'] or '--', '%d/%d' % (v['up'], v['of']),
+                ''.join(cell[vote] for vote in v['votes']))
+
+    ## down from a minority only: more likely the vantage's network than the node
+    local = {}
+    for node in registry:
+        v = view[node['id']]
+        if v['verdict'] == UP:
+            for (b, vote) in zip(bundles, v['votes']):
+                if vote is False:
+                    local.setdefault(b['vantage'], []).append(node['owner'])
+    if local:
+        print('---------------- notice -----------------')
+        for (vantage, owners) in local.items():
+            print('🧭 DOWN FROM %s ONLY:' % vantage, ','.join(owners))
+
+def coordinator(args):
+    with open(args.keys) as f:
+        keys = {name: secret.encode('utf-8') for (name, secret) in json.load(f).items()}
+    registry = audit_registry.load(args.registry)
+    (bundles, errors) = collect(args.source, keys, args.max_age, timeout=args.timeout)
+    print_view(registry, bundles, errors, merge(registry, bundles, args.valid_lag))
+    if not bundles:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser('audit_vantage')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('worker', help='probe all witnesses from here and publish a signed bundle')
+    p.add_argument('--name', required=True, help='name of this vantage, as in the keys of the coordinator')
+    p.add_argument('--key-file', required=True, help='file holding the secret shared with the coordinator')
+    p.add_argument('--registry', default=audit_registry.DEFAULT_PATH, help='node registry (json)')
+    p.add_argument('--geth-ipc', help='geth.ipc of the local node, for its peers, head and fork reference')
+    p.add_argument('--out', help='write the bundle to this file')
+    p.add_argument('--serve', type=int, help='keep probing every --interval and serve the latest bundle at http://:PORT/bundle')
+    p.add_argument('--addr', default='', help='address for --serve to listen on, default all')
+    p.add_argument('--interval', type=int, default=3600, help='seconds between two probe cycles with --serve')
+    p.add_argument('--probe-workers', type=int, default=32)
+    p.add_argument('--probe-connect-timeout', type=float, default=3.0)
+    p.add_argument('--probe-read-timeout', type=float, default=5.0)
+    p.add_argument('--probe-budget', type=float, default=30.0)
+    p.add_argument('--rpc-port', type=int, default=audit_probe.RPC_PORT, help='rpc port of the witnesses')
+
+    p = subparsers.add_parser('merge', help='merge the bundles of several vantages into one view')
+    p.add_argument('source', nargs='+', help='bundle urls or files')
+    p.add_argument('--keys', required=True, help='json file: vantage name -> shared secret')
+    p.add_argument('--registry', default=audit_registry.DEFAULT_PATH, help='node registry (json)')
+    p.add_argument('--max-age', type=int, default=MAX_AGE, help='seconds, older bundles are left out')
+    p.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for a bundle url')
+    p.add_argument('--valid-lag', type=int, default=VALID_LAG, help='a witness is up from a vantage if less than this many blocks behind its head')
+
+    args = parser.parse_args()
+    if args.command == 'worker':
+        if not args.out and not args.serve:
+            parser.error('worker needs --out or --serve')
+        worker(args)
+    else:
+        coordinator(args)
+
+if __name__ == '__main__':
+    main()
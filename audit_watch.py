@@ -0,0 +1,139 @@
+# Streaming watchdog over new heads: missed clique turns per signer, and chain stalls.
+#
+# Subscribes to newHeads on geth.ipc. In clique the signers, sorted by address, take turns:
+# block n is in turn for signers[n % len(signers)], and a block sealed in turn has difficulty 2,
+# out of turn difficulty 1. So every block with difficulty 1 is a turn missed by its in-turn
+# signer. A signer missing --missed-turns turns in a row raises an alert, a few blocks after
+# it went down instead of the next morning. No new head for longer than the stall threshold
+# raises an alert too, and both raise a follow-up when things are back to normal.
+#
+# Alerts go to stdout, and optionally to a webhook (json POST) and a file (json lines).
+#
+# Usage:
+# $ python3 audit_watch.py ~/data/mainnet/geth.ipc [--missed-turns 3] [--webhook URL] [--alert-file PATH]
+
+import argparse
+import json
+import sys
+import time
+import traceback
+import urllib.request
+from datetime import datetime
+
+from jsonrpc import IPCClient, IPCSubscription, RPCError
+
+STALL_SECONDS = 60 # same threshold as the blockchain status of the report
+SIGNERS_REFRESH = 100 # blocks, signers change by votes only
+
+## alert sinks
+
+class Alerter:
+    def __init__(self, webhook=None, path=None, stream=None):
+        self.webhook = webhook
+        self.path = path
+        self.stream = stream or sys.stdout
+
+    def alert(self, kind, message, **fields):
+        event = dict(fields, time=int(time.time()), kind=kind, message=message)
+        print(datetime.now().astimezone().strftime('%Y-%m-%d %H:%M:%S %z'), 'ALERT', kind + ':', message, file=self.stream, flush=True)
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        if self.webhook:
+            try:
+                req = urllib.request.Request(self.webhook, json.dumps(event, ensure_ascii=False).encode('utf-8'),
+                        {'Content-Type': 'application/json'})
+                urllib.request.urlopen(req, timeout=5).close()
+            except OSError as e:
+                print('alert webhook failed:', str(e), file=sys.stderr, flush=True)
+
+
+class Watchdog:
+    def __init__(self, geth_ipc, alerter, names=None, missed_turns=3, stall_seconds=STALL_SECONDS):
+        self.geth_ipc = geth_ipc
+        self.alerter = alerter
+        self.names = names or {} # lc(signer address) -> owner
+        self.missed_turns = missed_turns
+        self.stall_seconds = stall_seconds
+        self.rpc = IPCClient(geth_ipc)
+
+        self.signers = []
+        self.signers_at = None
+        self.last_number = None
+        self.last_head_time = time.time()
+        self.stalled = False
+        self.missed = {} # signer -> turns missed in a row
+        self.alerted = set() # signers with an open missed-turns alert
+
+    def name(self, signer):
+        return self.names.get(signer, signer)
+
+    def refresh_signers(self, number):
+        if self.signers_at is None or number - self.signers_at >= SIGNERS_REFRESH:
+            self.signers = sorted(s.lower() for s in self.rpc.call('clique_getSigners', [hex(number)]))
+            self.signers_at = number
+
+    ## the in-turn signer of a head missed its turn if the head has difficulty 1
+    def on_head(self, head):
+        number = int(head['number'], 16)
+        if self.last_number is not None and number <= self.last_number:
+            return # reorg to a sibling, that height is counted already
+        self.last_number = number
+        self.last_head_time = time.time()
+        if self.stalled:
+            self.stalled = False
+            self.alerter.alert('chain-resumed', 'new block %d' % number, block=number)
+
+        self.refresh_signers(number)
+        if not self.signers:
+            return
+        in_turn = self.signers[number % len(self.signers)]
+        if int(head['difficulty'], 16) == 2:
+            if in_turn in self.alerted:
+                self.alerter.alert('signer-resumed', '%s sealed block %d in turn again' % (self.name(in_turn), number),
+                        signer=in_turn, owner=self.name(in_turn), block=number)
+                self.alerted.discard(in_turn)
+            self.missed[in_turn] = 0
+        else:
+            self.missed[in_turn] = self.missed.get(in_turn, 0) + 1
+            if self.missed[in_turn] >= self.missed_turns and in_turn not in self.alerted:
+                self.alerted.add(in_turn)
+                self.alerter.alert('missed-turns', '%s missed %d turns in a row, last at block %d' % (self.name(in_turn), self.missed[in_turn], number),
+                        signer=in_turn, owner=self.name(in_turn), block=number, missed=self.missed[in_turn])
+
+    def check_stall(self):
+        idle = time.time() - self.last_head_time
+        if idle > self.stall_seconds and not self.stalled:
+            self.stalled = True
+            self.alerter.alert('chain-stalled', 'no new block for %d s, last block %s' % (idle, self.last_number),
+                    block=self.last_number, idle=int(idle))
+
+    ## follow new heads forever, resubscribing after errors (e.g. geth restarting)
+    def run(self):
+        while True:
+            try:
+                for head in IPCSubscription(self.geth_ipc, 'newHeads', timeout=min(5.0, self.stall_seconds / 4)):
+                    if head is not None:
+                        self.on_head(head)
+                    self.check_stall()
+            except RPCError:
+                traceback.print_exc()
+                sys.stderr.flush()
+                self.rpc.close()
+                self.check_stall()
+                time.sleep(5)
+
+def main():
+    parser = argparse.ArgumentParser('audit_watch')
+    parser.add_argument('geth_ipc', help='path to geth.ipc file to be attached to')
+    parser.add_argument('--missed-turns', type=int, default=3, help='alert when a signer misses this many turns in a row')
+    parser.add_argument('--stall-seconds', type=int, default=STALL_SECONDS, help='alert when there is no new block for this long')
+    parser.add_argument('--webhook', help='also POST alerts as json to this url')
+    parser.add_argument('--alert-file', help='also append alerts as json lines to this file')
+    args = parser.parse_args()
+
+    alerter = Alerter(args.webhook, args.alert_file)
+    Watchdog(args.geth_ipc, alerter, missed_turns=args.missed_turns, stall_seconds=args.stall_seconds).run()
+
+if __name__ == '__main__':
+    main()
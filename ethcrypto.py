@@ -0,0 +1,216 @@
+# keccak256, rlp and secp256k1 signer recovery, just enough to verify clique seals, and signing
+# for discv4 pings.
+#
+# Uses pycryptodome for keccak256 when it is installed (it comes with web3) and coincurve for
+# secp256k1 when it is installed (it does not, pip install coincurve), and falls back to plain
+# python otherwise, so the audit keeps working with the standard library only. The plain python
+# signer recovery takes about 10ms, a lot for a header index backfill.
+
+import secrets
+
+## keccak256
+
+try:
+    from Crypto.Hash import keccak as _keccak
+
+    def keccak256(data):
+        return _keccak.new(digest_bits=256, data=data).digest()
+except ImportError:
+    _RC = [
+        0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+        0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+        0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+        0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+        0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+        0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+        ]
+    _ROT = [
+        [0, 36, 3, 41, 18], [1, 44, 10, 45, 2], [62, 6, 43, 15, 61],
+        [28, 55, 25, 21, 56], [27, 20, 39, 8, 14],
+        ]
+    _MASK = (1 << 64) - 1
+
+    def _rol(v, n):
+        return ((v << n) | (v >> (64 - n))) & _MASK if n else v
+
+    def _keccak_f(a):
+        for rc in _RC:
+            c = [a[x][0] ^ a[x][1] ^ a[x][2] ^ a[x][3] ^ a[x][4] for x in range(5)]
+            d = [c[(x - 1) % 5] ^ _rol(c[(x + 1) % 5], 1) for x in range(5)]
+            a = [[a[x][y] ^ d[x] for y in range(5)] for x in range(5)]
+            b = [[0] * 5 for x in range(5)]
+            for x in range(5):
+                for y in range(5):
+                    b[y][(2 * x + 3 * y) % 5] = _rol(a[x][y], _ROT[x][y])
+            a = [[b[x][y] ^ ((~b[(x + 1) % 5][y]) & b[(x + 2) % 5][y]) for y in range(5)] for x in range(5)]
+            a[0][0] ^= rc
+        return a
+
+    def keccak256(data):
+        rate = 136
+        data = bytes(data) + b'\x01'
+        data += b'\x00' * (-len(data) % rate)
+        data = data[:-1] + bytes([data[-1] | 0x80])
+        a = [[0] * 5 for x in range(5)]
+        for off in range(0, len(data), rate):
+            block = data[off:off + rate]
+            for i in range(rate // 8):
+                a[i % 5][i // 5] ^= int.from_bytes(block[8 * i:8 * i + 8], 'little')
+            a = _keccak_f(a)
+        return b''.join(a[i % 5][i // 5].to_bytes(8, 'little') for i in range(4))
+
+## rlp
+
+def _rlp_length(n, offset):
+    if n < 56:
+        return bytes([offset + n])
+    b = n.to_bytes((n.bit_length() + 7) // 8, 'big')
+    return bytes([offset + 55 + len(b)]) + b
+
+## encode bytes, ints (as minimal big endian) and nested lists of them
+def rlp_encode(item):
+    if isinstance(item, list):
+        payload = b''.join(rlp_encode(x) for x in item)
+        return _rlp_length(len(payload), 0xc0) + payload
+    if isinstance(item, int):
+        item = item.to_bytes((item.bit_length() + 7) // 8, 'big') if item else b''
+    if len(item) == 1 and item[0] < 0x80:
+        return item
+    return _rlp_length(len(item), 0x80) + item
+
+## secp256k1 public key recovery
+
+_P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+_G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+      0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+
+## jacobian point arithmetic, (x, y, z) with z == 0 the point at infinity
+def _jdouble(p):
+    (x, y, z) = p
+    if not y or not z:
+        return (0, 0, 0)
+    ysq = y * y % _P
+    s = 4 * x * ysq % _P
+    m = 3 * x * x % _P
+    nx = (m * m - 2 * s) % _P
+    ny = (m * (s - nx) - 8 * ysq * ysq) % _P
+    return (nx, ny, 2 * y * z % _P)
+
+def _jadd(p, q):
+    if not p[2]:
+        return q
+    if not q[2]:
+        return p
+    (x1, y1, z1) = p
+    (x2, y2, z2) = q
+    z1s = z1 * z1 % _P
+    z2s = z2 * z2 % _P
+    u1 = x1 * z2s % _P
+    u2 = x2 * z1s % _P
+    s1 = y1 * z2s * z2 % _P
+    s2 = y2 * z1s * z1 % _P
+    if u1 == u2:
+        return _jdouble(p) if s1 == s2 else (0, 0, 0)
+    h = u2 - u1
+    r = s2 - s1
+    h2 = h * h % _P
+    h3 = h * h2 % _P
+    u1h2 = u1 * h2 % _P
+    nx = (r * r - h3 - 2 * u1h2) % _P
+    ny = (r * (u1h2 - nx) - s1 * h3) % _P
+    return (nx, ny, h * z1 * z2 % _P)
+
+## a*p + b*q in one pass (shamir's trick)
+def _jmul2(a, p, b, q):
+    pq = _jadd(p, q)
+    out = (0, 0, 0)
+    for i in range(max(a.bit_length(), b.bit_length()) - 1, -1, -1):
+        out = _jdouble(out)
+        bits = ((a >> i) & 1, (b >> i) & 1)
+        if bits == (1, 1):
+            out = _jadd(out, pq)
+        elif bits == (1, 0):
+            out = _jadd(out, p)
+        elif bits == (0, 1):
+            out = _jadd(out, q)
+    return out
+
+def _from_jacobian(p):
+    zinv = pow(p[2], -1, _P)
+    return (p[0] * zinv * zinv % _P, p[1] * zinv * zinv * zinv % _P)
+
+def _recover_pubkey_py(msg_hash, sig):
+    r = int.from_bytes(sig[0:32], 'big')
+    s = int.from_bytes(sig[32:64], 'big')
+    v = sig[64]
+    if not (0 < r < _N and 0 < s < _N and v in (0, 1)):
+        raise ValueError('invalid signature')
+    x = r
+    alpha = (x * x * x + 7) % _P
+    y = pow(alpha, (_P + 1) // 4, _P)
+    if y * y % _P != alpha:
+        raise ValueError('invalid signature')
+    if y & 1 != v:
+        y = _P - y
+    e = int.from_bytes(msg_hash, 'big')
+    rinv = pow(r, -1, _N)
+    # Q = r^-1 * (s*R - e*G)
+    q = _jmul2(s * rinv % _N, (x, y, 1), (-e * rinv) % _N, (_G[0], _G[1], 1))
+    if not q[2]:
+        raise ValueError('invalid signature')
+    (qx, qy) = _from_jacobian(q)
+    return qx.to_bytes(32, 'big') + qy.to_bytes(32, 'big')
+
+try:
+    from coincurve import PublicKey as _PublicKey
+
+    def recover_pubkey(msg_hash, sig):
+        return _PublicKey.from_signature_and_message(bytes(sig), msg_hash, hasher=None).format(compressed=False)[1:]
+except ImportError:
+    recover_pubkey = _recover_pubkey_py
+
+## secp256k1 signing, for discv4 packets
+
+def _sign_py(msg_hash, secret):
+    d = int.from_bytes(secret, 'big')
+    z = int.from_bytes(msg_hash, 'big')
+    while True:
+        k = secrets.randbelow(_N - 1) + 1
+        (x, y) = _from_jacobian(_jmul2(k, (_G[0], _G[1], 1), 0, (0, 0, 0)))
+        r = x % _N
+        s = pow(k, -1, _N) * (z + r * d) % _N
+        if r and s:
+            break
+    v = (y & 1) ^ (1 if s > _N // 2 else 0)
+    s = min(s, _N - s) # low s
+    return r.to_bytes(32, 'big') + s.to_bytes(32, 'big') + bytes([v])
+
+def _pubkey_py(secret):
+    (x, y) = _from_jacobian(_jmul2(int.from_bytes(secret, 'big'), (_G[0], _G[1], 1), 0, (0, 0, 0)))
+    return x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+
+try:
+    from coincurve import PrivateKey as _PrivateKey
+
+    ## 65-byte [r || s || v] signature of msg_hash with a 32-byte secret key
+    def sign(msg_hash, secret):
+        return _PrivateKey(secret).sign_recoverable(msg_hash, hasher=None)
+
+    ## 64-byte public key of a 32-byte secret key
+    def private_to_pubkey(secret):
+        return _PrivateKey(secret).public_key.format(compressed=False)[1:]
+except ImportError:
+    sign = _sign_py
+    private_to_pubkey = _pubkey_py
+
+def new_private_key():
+    return (secrets.randbelow(_N - 1) + 1).to_bytes(32, 'big')
+
+## 64-byte uncompressed public key (without the 0x04 prefix) -> 0x address, lowercase
+def pubkey_to_address(pubkey):
+    return '0x' + keccak256(pubkey)[-20:].hex()
+
+## address that signed msg_hash with a 65-byte [r || s || v] signature
+def ecrecover(msg_hash, sig):
+    return pubkey_to_address(recover_pubkey(msg_hash, sig))
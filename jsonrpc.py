@@ -0,0 +1,320 @@
+# Minimal JSON-RPC clients over geth.ipc and http.
+#
+# The audit only needs a handful of methods, so it talks JSON-RPC directly instead of going
+# through web3: no web3 import, no middleware onion, and calls can be batched (many calls in
+# one json array) or pipelined (many requests written back to back on one connection).
+#
+# Every client has the same interface:
+#   call(method, params)   -> result, raises RPCError
+#   batch([(method, params), ...])    -> raw responses in the same order
+#   pipeline([(method, params), ...]) -> raw responses in the same order
+#
+# Web3Client keeps web3 as the fallback backend behind the same interface. IPCSubscription
+# streams the notifications of an eth_subscribe.
+#
+# All round trips go through audit_cassette, which can record them or answer them from a recording.
+
+import codecs
+import http.client
+import itertools
+import json
+import socket
+import threading
+
+import audit_cassette
+import audit_trace
+
+
+class RPCError(Exception):
+    pass
+
+class RPCTimeout(RPCError):
+    pass
+
+class RPCConnectionError(RPCError):
+    pass
+
+
+## result of a raw response, or raise
+def unwrap(resp, method=''):
+    if resp is None:
+        raise RPCError(method, 'no response')
+    if 'error' in resp:
+        raise RPCError(method, resp['error'])
+    return resp['result']
+
+## read json values one by one from a stream socket
+class JSONReader:
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+
+    def read(self, sock, source=''):
+        while True:
+            self._buf = self._buf.lstrip()
+            if self._buf:
+                try:
+                    (obj, end) = json.JSONDecoder().raw_decode(self._buf)
+                    self._buf = self._buf[end:]
+                    return obj
+                except ValueError:
+                    pass # incomplete, keep reading
+            data = sock.recv(65536)
+            if not data:
+                raise RPCConnectionError('connection closed by ' + source)
+            self._buf += self._decoder.decode(data)
+
+
+class Client:
+    endpoint = ''
+    cassette_endpoint = None # how the cassette tells this endpoint apart, default endpoint
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _request(self, method, params):
+        return {'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': params or []}
+
+    ## send payloads, return the json value answering each of them
+    def _roundtrip(self, payloads):
+        raise NotImplementedError
+
+    def _exchange(self, payloads):
+        return audit_cassette.roundtrip(self.cassette_endpoint or self.endpoint, payloads, self._roundtrip)
+
+    def call(self, method, params=None):
+        with audit_trace.span(method, 'rpc', endpoint=self.endpoint):
+            (resp,) = self._exchange([self._request(method, params)])
+        return unwrap(resp, method)
+
+    def batch(self, calls):
+        if not calls:
+            return []
+        reqs = [self._request(m, p) for (m, p) in calls]
+        with audit_trace.span('batch ' + calls[0][0], 'rpc', endpoint=self.endpoint, size=len(calls)):
+            (resp,) = self._exchange([reqs])
+        if isinstance(resp, dict): # the whole batch was rejected
+            raise RPCError('batch', resp.get('error'))
+        by_id = {r.get('id'): r for r in resp}
+        return [by_id.get(req['id']) for req in reqs]
+
+    def pipeline(self, calls):
+        if not calls:
+            return []
+        reqs = [self._request(m, p) for (m, p) in calls]
+        with audit_trace.span('pipeline ' + calls[0][0], 'rpc', endpoint=self.endpoint, size=len(calls)):
+            responses = self._exchange(reqs)
+        by_id = {r.get('id'): r for r in responses if isinstance(r, dict)}
+        return [by_id.get(req['id']) for req in reqs]
+
+    def close(self):
+        pass
+
+
+class IPCClient(Client):
+    cassette_endpoint = 'ipc' # there is one geth.ipc, wherever it is
+
+    def __init__(self, path, timeout=10.0):
+        super().__init__()
+        self.path = path
+        self.endpoint = path
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError as e:
+                sock.close()
+                raise RPCConnectionError(self.path, str(e))
+            self._sock = sock
+            self._reader = JSONReader()
+        return self._sock
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _roundtrip(self, payloads):
+        with self._lock:
+            try:
+                sock = self._connect()
+                sock.sendall(b''.join(json.dumps(p).encode('utf-8') for p in payloads))
+                return [self._reader.read(sock, self.path) for p in payloads]
+            except socket.timeout as e:
+                self.close() # don't reuse a socket in unknown state
+                raise RPCTimeout(self.path, str(e))
+            except OSError as e:
+                self.close()
+                raise RPCConnectionError(self.path, str(e))
+            except RPCError:
+                self.close()
+                raise
+
+
+## eth_subscribe over its own geth.ipc connection. iterating yields the notification results,
+## and None whenever nothing arrived for `timeout` seconds, so the caller can check the time.
+class IPCSubscription:
+    def __init__(self, path, kind, params=None, timeout=5.0):
+        self.path = path
+        self.kind = kind
+        self.params = params or []
+        self.timeout = timeout
+        self.id = None
+        self._sock = None
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def __iter__(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+            reader = JSONReader()
+            sock.sendall(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'eth_subscribe', 'params': [self.kind] + self.params}).encode('utf-8'))
+            self.id = unwrap(reader.read(sock, self.path), 'eth_subscribe')
+        except socket.timeout as e:
+            sock.close()
+            raise RPCTimeout(self.path, str(e))
+        except OSError as e:
+            sock.close()
+            raise RPCConnectionError(self.path, str(e))
+        self._sock = sock
+
+        try:
+            while True:
+                try:
+                    msg = reader.read(sock, self.path)
+                except socket.timeout:
+                    yield None
+                    continue
+                except OSError as e:
+                    raise RPCConnectionError(self.path, str(e))
+                if msg.get('method') == 'eth_subscription' and msg['params'].get('subscription') == self.id:
+                    yield msg['params']['result']
+        finally:
+            self.close()
+
+
+## http client with a keep-alive connection. pipelined requests are sent one after another
+## on that connection, since http/1.1 servers don't reliably support real pipelining.
+class HTTPClient(Client):
+    def __init__(self, host, port, connect_timeout=3.0, read_timeout=5.0, path='/'):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.endpoint = host + ':' + str(port)
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+            conn.connect()
+            conn.sock.settimeout(self.read_timeout)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _post(self, payload):
+        conn = self._connect()
+        body = json.dumps(payload).encode('utf-8')
+        conn.request('POST', self.path, body, {'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        data = resp.read()
+        if resp.status != 200:
+            raise RPCError('http status', resp.status)
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise RPCError('invalid json response')
+
+    ## a kept-alive connection may have been closed by the server meanwhile, retry that once
+    def _post_retry(self, payload):
+        reused = self._conn is not None
+        try:
+            return self._post(payload)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            if not reused:
+                raise
+            self.close()
+            return self._post(payload)
+
+    def _roundtrip(self, payloads):
+        source = self.endpoint
+        with self._lock:
+            try:
+                return [self._post_retry(p) for p in payloads]
+            except socket.timeout as e:
+                self.close()
+                raise RPCTimeout(source, str(e))
+            except (http.client.HTTPException, RPCError) as e:
+                self.close()
+                if isinstance(e, RPCError):
+                    raise
+                raise RPCError(source, str(e))
+            except OSError as e:
+                self.close()
+                raise RPCConnectionError(source, str(e))
+
+
+## fallback backend: the same interface on top of a web3 provider. web3 can't batch, so
+## batched and pipelined calls are sent one by one.
+class Web3Client(Client):
+    def __init__(self, provider):
+        super().__init__()
+        self.provider = provider
+        self.endpoint = str(getattr(provider, 'endpoint_uri', None) or getattr(provider, 'ipc_path', ''))
+
+    @classmethod
+    def ipc(cls, path):
+        from web3 import Web3
+        client = cls(Web3.IPCProvider(path))
+        client.cassette_endpoint = 'ipc'
+        return client
+
+    @classmethod
+    def http(cls, host, port, connect_timeout=3.0, read_timeout=5.0):
+        import requests
+        from web3 import Web3
+        provider = Web3.HTTPProvider('http://' + host + ':' + str(port), session=requests.Session(),
+                request_kwargs={'timeout': (connect_timeout, read_timeout)})
+        provider.middlewares = () # no http_retry_request, it would multiply the timeouts
+        client = cls(provider)
+        client.cassette_endpoint = host + ':' + str(port)
+        return client
+
+    def _roundtrip(self, payloads):
+        import requests
+        responses = []
+        for payload in payloads:
+            reqs = payload if isinstance(payload, list) else [payload]
+            out = []
+            for req in reqs:
+                try:
+                    resp = dict(self.provider.make_request(req['method'], req['params']))
+                except requests.exceptions.Timeout as e: # must go before ConnectionError, ConnectTimeout is both
+                    raise RPCTimeout(req['method'], str(e))
+                except (requests.exceptions.ConnectionError, ConnectionError, FileNotFoundError) as e:
+                    raise RPCConnectionError(req['method'], str(e))
+                except Exception as e:
+                    raise RPCError(req['method'], str(e))
+                resp['id'] = req['id']
+                out.append(resp)
+            responses.append(out if isinstance(payload, list) else out[0])
+        return responses
@@ -0,0 +1,67 @@
+# One audit run against the fake network of audit_fakenet, served from this process on a free
+# port, recorded to a store in a temporary directory.
+#
+# Usage:
+# $ python3 -m unittest test_audit_fakenet
+
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import audit_fakenet
+import audit_store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class FakenetAuditTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='audit-fakenet-')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.nodes = audit_fakenet.synthetic_registry(40, seed=3)
+        self.registry = os.path.join(self.dir, 'nodes.json')
+        with open(self.registry, 'w') as f:
+            json.dump(self.nodes, f)
+        network = audit_fakenet.FakeNetwork(self.nodes, timeout_rate=0, failure_rate=0.05, fork_rate=0.2, block_time=1, seed=3)
+        self.ipc = os.path.join(self.dir, 'geth.ipc')
+        servers = audit_fakenet.serve(network, self.ipc, 0)
+        for server in servers:
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+        self.port = servers[1].server_address[1]
+
+    def audit(self, *args):
+        result = subprocess.run([sys.executable, os.path.join(HERE, 'audit_network.py'), self.ipc, '--registry', self.registry,
+                '--rpc-port', str(self.port), '--reach-timeout', '0.5', '--probe-read-timeout', '2'] + list(args),
+                capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_report_and_store(self):
+        db = os.path.join(self.dir, 'audit.db')
+        report = self.audit('--db', db)
+        self.assertIn('---------------- notice -----------------', report)
+        self.assertIn('----------- monthly availability --------------', report)
+
+        forked = re.search(r'FORKED \(block hash at \d+ differs\): (.*)', report)
+        self.assertIsNotNone(forked, report)
+        owners = forked.group(1).split(',')
+        ids = {node['owner']: node['id'] for node in self.nodes}
+
+        # a forked witness is stored as forked and not valid, and so it is in the availability table
+        conn = sqlite3.connect(db)
+        conn.row_factory = sqlite3.Row
+        for owner in owners:
+            sample = dict(conn.execute('SELECT * FROM samples WHERE node_id = ?', (ids[owner],)).fetchone())
+            self.assertEqual(sample['fork'], 1)
+            self.assertFalse(audit_store.is_valid(sample, audit_store.VALID_LAG))
+            self.assertRegex(report, r'witness "%s" 0 1 0\.00%%' % owner)
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
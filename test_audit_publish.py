@@ -0,0 +1,156 @@
+# Publish stage against the local stand-ins: the fake smtp server of audit_publish and a bare
+# git repo with a clone, in a temporary directory.
+#
+# Usage:
+# $ python3 -m unittest test_audit_publish
+
+import glob
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+import audit_publish
+
+REPORT = 'witness 20240101 10.1.2.3 🟢 connected 100001 🟩 J-6 "node-6" ✅\n'
+RECIPIENTS = ['a@x.org', 'b@x.org', 'c@x.org', 'd@x.org', 'e@x.org']
+
+def git(*args):
+    return subprocess.run(['git'] + list(args), capture_output=True, text=True, check=True).stdout
+
+@unittest.skipIf(shutil.which('git') is None, 'git is not installed')
+class PublishTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='audit-publish-')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.retry_delay = audit_publish.RETRY_DELAY
+        audit_publish.RETRY_DELAY = 0.01
+        self.addCleanup(setattr, audit_publish, 'RETRY_DELAY', self.retry_delay)
+
+        self.bare = os.path.join(self.dir, 'status.git')
+        self.clone = os.path.join(self.dir, 'status')
+        git('init', '-q', '--bare', self.bare)
+        git('clone', '-q', self.bare, self.clone)
+        git('-C', self.clone, 'config', 'user.name', 'audit')
+        git('-C', self.clone, 'config', 'user.email', 'audit@example.com')
+        self.mails = os.path.join(self.dir, 'mails')
+        self.spool = os.path.join(self.dir, 'spool')
+
+    def smtp(self, fail=0, fail_data=0, drop=0):
+        server = audit_publish.fake_smtp_server('127.0.0.1', 0, self.mails, fail, fail_data, drop)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address[1]
+
+    def config(self, smtp_port):
+        sinks = [
+                {'type': 'file', 'path': os.path.join(self.dir, 'daily-report.txt')},
+                {'type': 'smtp', 'host': '127.0.0.1', 'port': smtp_port, 'from': 'audit@example.com', 'to': RECIPIENTS,
+                    'batch': 2, 'timeout': 5},
+                {'type': 'git', 'repo': self.clone, 'path': 'daily-report.txt', 'push': True, 'timeout': 20},
+                ]
+        path = os.path.join(self.dir, 'publish.json')
+        with open(path, 'w') as f:
+            json.dump({'subject': 'report - {date}', 'spool': self.spool, 'sinks': sinks}, f)
+        return audit_publish.load_config(path)
+
+    def received(self):
+        mails = []
+        for path in sorted(glob.glob(os.path.join(self.mails, 'mail-*.json'))):
+            with open(path) as f:
+                mails.append(json.load(f))
+        return mails
+
+    def pushed(self):
+        return git('-C', self.bare, 'log', '--format=%s', 'HEAD').split('\n')[:-1]
+
+    def test_all_sinks(self):
+        # two connections turned away, then the first batch refused: retried until all are sent
+        config = self.config(self.smtp(fail=2, fail_data=1))
+        self.assertEqual(audit_publish.publish(config, REPORT), 0)
+
+        with open(os.path.join(self.dir, 'daily-report.txt')) as f:
+            self.assertEqual(f.read(), REPORT)
+        mails = self.received()
+        self.assertEqual(sorted(to for mail in mails for to in mail['to']), RECIPIENTS)
+        self.assertTrue(all(len(mail['to']) <= 2 for mail in mails))
+        self.assertEqual(len(self.pushed()), 1)
+        committed = git('-C', self.bare, 'show', 'HEAD:daily-report.txt')
+        self.assertIn('10.*.*.3', committed)
+        self.assertNotIn('10.1.2.3', committed)
+        self.assertEqual(audit_publish.spooled(self.spool), [])
+
+    def test_partial_batches_spooled(self):
+        # the first batch refused and no retries: only its recipients are spooled, then sent
+        config = self.config(self.smtp(fail_data=1))
+        config['sinks'] = [dict(config['sinks'][1], retries=0)]
+        self.assertEqual(audit_publish.publish(config, REPORT), 1)
+        self.assertEqual(sorted(to for mail in self.received() for to in mail['to']), RECIPIENTS[2:])
+        (path,) = audit_publish.spooled(self.spool)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['sink']['to'], RECIPIENTS[:2])
+        self.assertEqual(audit_publish.publish(config), 0) # retry
+        self.assertEqual(sorted(to for mail in self.received() for to in mail['to']), RECIPIENTS)
+        self.assertEqual(audit_publish.spooled(self.spool), [])
+
+    def test_disconnected_partway(self):
+        # the connection dropped after the first batch and no retries: the batches after it are spooled, then sent
+        config = self.config(self.smtp(drop=1))
+        config['sinks'] = [dict(config['sinks'][1], retries=0)]
+        self.assertEqual(audit_publish.publish(config, REPORT), 1)
+        self.assertEqual(sorted(to for mail in self.received() for to in mail['to']), RECIPIENTS[:2])
+        (path,) = audit_publish.spooled(self.spool)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['sink']['to'], RECIPIENTS[2:])
+        self.assertEqual(audit_publish.publish(config), 0) # retry
+        self.assertEqual(sorted(to for mail in self.received() for to in mail['to']), RECIPIENTS)
+        self.assertEqual(audit_publish.spooled(self.spool), [])
+
+    def test_spool_round_trip(self):
+        port = self.smtp()
+        config = self.config(port + 1 if port < 65535 else port - 1) # nothing listening there
+        config['sinks'][1]['retries'] = 0
+        self.assertEqual(audit_publish.publish(config, REPORT), 1)
+        (path,) = audit_publish.spooled(self.spool)
+        self.assertEqual(self.received(), [])
+
+        with open(path) as f:
+            entry = json.load(f)
+        entry['sink']['port'] = port
+        with open(path, 'w') as f:
+            json.dump(entry, f)
+        self.assertEqual(audit_publish.publish(config), 0) # retry
+        self.assertEqual(audit_publish.spooled(self.spool), [])
+        self.assertEqual(sorted(to for mail in self.received() for to in mail['to']), RECIPIENTS)
+
+    def test_spool_before_new_report(self):
+        # spooled reports of the file and git sinks, then a new report to the same sinks
+        config = self.config(self.smtp())
+        (file_sink, smtp_sink, git_sink) = config['sinks']
+        audit_publish.spool(self.spool, file_sink, 'old', 'old report\n')
+        audit_publish.spool(self.spool, git_sink, 'old', 'old report\n')
+        self.assertEqual(audit_publish.publish(config, 'new report\n', 'new'), 0)
+
+        with open(file_sink['path']) as f:
+            self.assertEqual(f.read(), 'new report\n')
+        self.assertEqual(self.pushed(), ['new', 'old']) # committed one after the other, in order
+        self.assertEqual(git('-C', self.bare, 'show', 'HEAD:daily-report.txt'), 'new report\n')
+        self.assertEqual(git('-C', self.bare, 'show', 'HEAD~1:daily-report.txt'), 'old report\n')
+        self.assertEqual(audit_publish.spooled(self.spool), [])
+
+    def test_superseded_spool_dropped(self):
+        # a spooled git report that still fails is dropped once a newer one is committed
+        config = self.config(self.smtp())
+        config['sinks'] = [config['sinks'][2]]
+        broken = dict(config['sinks'][0], repo=os.path.join(self.dir, 'missing'), retries=0)
+        audit_publish.spool(self.spool, broken, 'old', 'old report\n')
+        self.assertEqual(audit_publish.publish(config, 'new report\n', 'new'), 0)
+        self.assertEqual(self.pushed(), ['new'])
+        self.assertEqual(audit_publish.spooled(self.spool), [])
+
+if __name__ == '__main__':
+    unittest.main()
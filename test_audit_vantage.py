@@ -0,0 +1,116 @@
+# Two vantage workers against the fake network of audit_fakenet, served from this process on a
+# free port, and the merge of their signed bundles.
+#
+# Usage:
+# $ python3 -m unittest test_audit_vantage
+
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import audit_fakenet
+import audit_probe
+import audit_vantage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+KEYS = {'shanghai': b'secret-of-shanghai', 'beijing': b'secret-of-beijing'}
+
+class VantageTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='audit-vantage-')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.nodes = audit_fakenet.synthetic_registry(20, seed=5)
+        self.registry = os.path.join(self.dir, 'nodes.json')
+        with open(self.registry, 'w') as f:
+            json.dump(self.nodes, f)
+        self.network = audit_fakenet.FakeNetwork(self.nodes, timeout_rate=0, failure_rate=0, lag_rate=0.3, fork_rate=0,
+                block_time=1, seed=5)
+        self.ipc = os.path.join(self.dir, 'geth.ipc')
+        servers = audit_fakenet.serve(self.network, self.ipc, 0)
+        for server in servers:
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+        self.port = servers[1].server_address[1]
+
+    def worker(self, name, *args):
+        key_file = os.path.join(self.dir, name + '.key')
+        with open(key_file, 'wb') as f:
+            f.write(KEYS[name])
+        out = os.path.join(self.dir, name + '.json.gz')
+        result = subprocess.run([sys.executable, os.path.join(HERE, 'audit_vantage.py'), 'worker', '--name', name,
+                '--key-file', key_file, '--registry', self.registry, '--out', out, '--rpc-port', str(self.port),
+                '--probe-read-timeout', '2'] + list(args), capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return out
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_merge(self):
+        shanghai = self.worker('shanghai', '--geth-ipc', self.ipc)
+        beijing = self.worker('beijing')
+        (bundles, errors) = audit_vantage.collect([shanghai, beijing], KEYS)
+        self.assertEqual(errors, [])
+        self.assertEqual([b['vantage'] for b in bundles], ['shanghai', 'beijing'])
+
+        witnesses = [node for node in self.nodes if node['type'] == 'witness']
+        lagging = [node for node in witnesses if self.network.behaviour[node['ip']] == audit_fakenet.WITNESS_LAG]
+        self.assertTrue(lagging)
+        view = audit_vantage.merge(self.nodes, bundles)
+        for node in witnesses:
+            self.assertEqual(view[node['id']]['verdict'], audit_vantage.DOWN if node in lagging else audit_vantage.UP, node)
+        # 100 blocks behind is up with a valid lag above that
+        view = audit_vantage.merge(self.nodes, bundles, valid_lag=200)
+        self.assertTrue(all(view[node['id']]['verdict'] == audit_vantage.UP for node in witnesses))
+        # miners keep rpc closed: only the vantage with a geth of its own tells them
+        for node in self.nodes:
+            if node['type'] == 'miner':
+                self.assertEqual(view[node['id']]['votes'][1], None)
+
+        # a witness down from beijing only is split
+        (shanghai_body, beijing_body) = bundles
+        down = [node for node in witnesses if node not in lagging][-1]['id']
+        beijing_body['nodes'][down][1] = audit_probe.PROBE_TIMEOUT
+        split = self.write('split.json.gz', audit_vantage.sign(beijing_body, KEYS['beijing']))
+        (bundles, errors) = audit_vantage.collect([shanghai, split], KEYS)
+        view = audit_vantage.merge(self.nodes, bundles)
+        self.assertEqual(view[down]['verdict'], audit_vantage.SPLIT)
+        self.assertEqual(view[down]['votes'], [True, False])
+
+    def test_rejected(self):
+        shanghai = self.worker('shanghai')
+        with open(shanghai, 'rb') as f:
+            envelope = json.loads(gzip.decompress(f.read()))
+        body = json.loads(envelope['body'])
+
+        # the body changed under the same hmac
+        tampered = dict(body, head=body['head'] + 1)
+        tampered = self.write('tampered.json.gz', gzip.compress(json.dumps(
+            dict(envelope, body=json.dumps(tampered, separators=(',', ':'), sort_keys=True))).encode('utf-8')))
+        # signed with the key of another vantage
+        forged = self.write('forged.json.gz', audit_vantage.sign(body, KEYS['beijing']))
+        unknown = self.write('unknown.json.gz', audit_vantage.sign(dict(body, vantage='wuhan'), KEYS['shanghai']))
+
+        (bundles, errors) = audit_vantage.collect([tampered, shanghai, forged, unknown], KEYS)
+        self.assertEqual([b['vantage'] for b in bundles], ['shanghai'])
+        self.assertEqual([source for (source, error) in errors], [tampered, forged, unknown])
+        self.assertIn('bad signature', errors[0][1])
+        self.assertIn('bad signature', errors[1][1])
+        self.assertIn('unknown vantage', errors[2][1])
+
+        # too old
+        (bundles, errors) = audit_vantage.collect([shanghai], KEYS, max_age=60, now=time.time() + 120)
+        self.assertEqual(bundles, [])
+        self.assertIn('stale', errors[0][1])
+
+if __name__ == '__main__':
+    unittest.main()